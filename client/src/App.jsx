@@ -8,6 +8,8 @@ import './App.css';
 
 function App() {
   const [wsStatus, setWsStatus] = useState('disconnected');
+  const [inputLatency, setInputLatency] = useState(null);
+  const latencyShownAt = useRef(0);
   const [currentView, setCurrentView] = useState('game'); // 'game', 'settings', 'editor'
   const [showMenu, setShowMenu] = useState(false);
   const wsRef = useRef(null);
@@ -28,10 +30,28 @@ function App() {
       ws.onclose = () => {
         console.log('WebSocket disconnected');
         setWsStatus('disconnected');
+        setInputLatency(null);
         // Auto-reconnect after 3 seconds
         setTimeout(connect, 3000);
       };
 
+      ws.onmessage = (event) => {
+        if (typeof event.data !== 'string') return;
+        const msg = JSON.parse(event.data);
+        if (msg.type === 'ping') {
+          // Clock sync: answer with our receive and send times
+          const t1 = performance.now();
+          ws.send(JSON.stringify({ type: 'pong', t0: msg.t0, t1, t2: performance.now() }));
+        } else if (msg.type === 'ack') {
+          // Press -> virtual controller -> back to the phone; refresh at most twice a second
+          const now = performance.now();
+          if (now - latencyShownAt.current > 500) {
+            latencyShownAt.current = now;
+            setInputLatency(Math.round(now - msg.t));
+          }
+        }
+      };
+
       ws.onerror = (error) => {
         console.error('WebSocket error:', error);
         setWsStatus('error');
@@ -124,6 +144,7 @@ function App() {
         <GamepadController
           wsRef={wsRef}
           serverStatus={wsStatus}
+          inputLatency={inputLatency}
           serverIP={SERVER_IP}
           mjpegPort={MJPEG_PORT}
         />
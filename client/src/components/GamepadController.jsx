@@ -3,8 +3,9 @@ import { Html5QrcodeScanner } from 'html5-qrcode';
 import AnalogStick from './AnalogStick';
 import ActionButton from './ActionButton';
 import DPad from './DPad';
+import { InputEncoder } from '../protocol';
 
-export default function GamepadController({ wsRef, serverStatus, serverIP, mjpegPort }) {
+export default function GamepadController({ wsRef, serverStatus, inputLatency, serverIP, mjpegPort }) {
     const [isFullscreen, setIsFullscreen] = useState(false);
     const [showVideo, setShowVideo] = useState(true);
     const [showNav, setShowNav] = useState(true);
@@ -35,12 +36,18 @@ export default function GamepadController({ wsRef, serverStatus, serverIP, mjpeg
     const mjpegUrl = `http://${serverIP}:${mjpegPort}/`;
     const mjpegConfigUrl = `http://${serverIP}:${mjpegPort}/config`;
 
-    // Send WebSocket message helper
+    // Send WebSocket message helper (binary protocol, sticks batched per frame)
+    const encoderRef = useRef(null);
+    if (!encoderRef.current) {
+        encoderRef.current = new InputEncoder((packet) => {
+            if (wsRef?.current?.readyState === WebSocket.OPEN) {
+                wsRef.current.send(packet);
+            }
+        });
+    }
     const sendMessage = useCallback((data) => {
-        if (wsRef?.current?.readyState === WebSocket.OPEN) {
-            wsRef.current.send(JSON.stringify(data));
-        }
-    }, [wsRef]);
+        encoderRef.current.push(data);
+    }, []);
 
     // Left stick - Movement
     const handleLeftStickMove = useCallback(({ x, y }) => {
@@ -398,6 +405,7 @@ export default function GamepadController({ wsRef, serverStatus, serverIP, mjpeg
                             <span style={{ fontSize: '12px', color: '#aaa' }}>Status:</span>
                             <span className={`status-text ${serverStatus}`} style={{ color: serverStatus === 'connected' ? '#00ff9d' : '#ff5555' }}>
                                 {serverStatus === 'connected' ? 'Connected' : 'Disconnected'}
+                                {serverStatus === 'connected' && inputLatency !== null && ` · ${inputLatency} ms`}
                             </span>
                         </div>
                     </div>
@@ -0,0 +1,91 @@
+// Binary input protocol (mirrors server/input/protocol.py)
+// Packet: [version u8][record count u8][sequence u16] + records, little-endian
+//   stick record:   [type u8][x i16][y i16]   x/y scaled by 32767
+//   buttons record: [type u8][mask u32]       full pressed-button state
+//   time record:    [type u8][ms f64]         client send time (performance.now()), version 2
+// Records added by a version go after the older ones: servers stop at a type they do not know
+
+const PROTOCOL_VERSION = 2;
+const TYPE_LEFT_STICK = 1;
+const TYPE_RIGHT_STICK = 2;
+const TYPE_BUTTONS = 3;
+const TYPE_CLIENT_TIME = 4;
+const AXIS_SCALE = 32767;
+
+const BUTTON_BITS = [
+    'A', 'B', 'X', 'Y',
+    'LB', 'RB', 'LT', 'RT',
+    'START', 'SELECT',
+    'D_UP', 'D_DOWN', 'D_LEFT', 'D_RIGHT',
+];
+
+const DPAD_TO_BUTTON = { up: 'D_UP', down: 'D_DOWN', left: 'D_LEFT', right: 'D_RIGHT' };
+
+const clampAxis = (v) => Math.round(Math.max(-1, Math.min(1, v)) * AXIS_SCALE);
+
+// Coalesces stick updates and sends them batched once per animation frame;
+// button changes flush immediately (together with any pending stick values)
+export class InputEncoder {
+    constructor(send) {
+        this.send = send;
+        this.seq = 0;
+        this.buttons = 0;
+        this.sticks = {};
+        this.buttonsDirty = false;
+        this.scheduled = false;
+    }
+
+    push(msg) {
+        if (msg.type === 'left_stick' || msg.type === 'right_stick') {
+            this.sticks[msg.type] = msg;
+            this.schedule();
+            return;
+        }
+        const name = msg.type === 'dpad' ? DPAD_TO_BUTTON[msg.direction?.toLowerCase()] : msg.button;
+        const bit = BUTTON_BITS.indexOf(name);
+        if (bit < 0) return;
+        if (msg.pressed) this.buttons |= (1 << bit);
+        else this.buttons &= ~(1 << bit);
+        this.buttonsDirty = true;
+        this.flush();
+    }
+
+    schedule() {
+        if (this.scheduled) return;
+        this.scheduled = true;
+        requestAnimationFrame(() => this.flush());
+    }
+
+    flush() {
+        this.scheduled = false;
+        const sticks = Object.values(this.sticks);
+        if (sticks.length === 0 && !this.buttonsDirty) return;
+        const count = sticks.length + (this.buttonsDirty ? 1 : 0) + 1;
+
+        const view = new DataView(new ArrayBuffer(4 + 9 + sticks.length * 5 + (this.buttonsDirty ? 5 : 0)));
+        view.setUint8(0, PROTOCOL_VERSION);
+        view.setUint8(1, count);
+        view.setUint16(2, this.seq, true);
+        this.seq = (this.seq + 1) & 0xFFFF;
+
+        let offset = 4;
+        for (const stick of sticks) {
+            view.setUint8(offset, stick.type === 'left_stick' ? TYPE_LEFT_STICK : TYPE_RIGHT_STICK);
+            view.setInt16(offset + 1, clampAxis(stick.x), true);
+            view.setInt16(offset + 3, clampAxis(stick.y), true);
+            offset += 5;
+        }
+        if (this.buttonsDirty) {
+            view.setUint8(offset, TYPE_BUTTONS);
+            view.setUint32(offset + 1, this.buttons >>> 0, true);
+            offset += 5;
+        }
+        // Send time, echoed back in the server's ack for the latency indicator
+        view.setUint8(offset, TYPE_CLIENT_TIME);
+        view.setFloat64(offset + 1, performance.now(), true);
+
+        this.sticks = {};
+        this.buttonsDirty = false;
+        this.send(view.buffer);
+    }
+}
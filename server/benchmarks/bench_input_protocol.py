@@ -0,0 +1,71 @@
+# Benchmark: JSON vs binary input protocol
+"""
+Compares encode/decode cost and wire size of the JSON input messages and
+the binary protocol in input/protocol.py, for single updates and for a
+batched frame (both sticks plus a button change).
+
+Usage: python benchmarks/bench_input_protocol.py [iterations]
+"""
+import itertools
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from input.protocol import BinaryDecoder, encode_packet, buttons_mask
+
+LEFT = {'type': 'left_stick', 'x': 0.4231, 'y': -0.8812}
+RIGHT = {'type': 'right_stick', 'x': -0.1203, 'y': 0.3377}
+BUTTON = {'type': 'button', 'button': 'A', 'pressed': True}
+
+
+def bench(label: str, func, iterations: int) -> float:
+    seconds = timeit.timeit(func, number=iterations)
+    per_op_us = seconds / iterations * 1e6
+    print(f"  {label:<28} {per_op_us:8.3f} us/op")
+    return per_op_us
+
+
+def run(iterations: int = 200000) -> dict:
+    results = {}
+    # A full uint16 cycle of packets so every decode sees a newer sequence number
+    packets = itertools.cycle([encode_packet(n, [LEFT]) for n in range(0x10000)])
+
+    # Single stick update
+    json_stick = json.dumps(LEFT)
+    bin_stick = encode_packet(0, [LEFT])
+    print("Single stick update")
+    print(f"  size: json={len(json_stick)} B, binary={len(bin_stick)} B")
+    results['json_encode'] = bench("json encode", lambda: json.dumps(LEFT), iterations)
+    results['json_decode'] = bench("json decode", lambda: json.loads(json_stick), iterations)
+    results['binary_encode'] = bench("binary encode", lambda: encode_packet(1, [LEFT]), iterations)
+    decoder = BinaryDecoder()
+    results['binary_decode'] = bench(
+        "binary decode", lambda: decoder.decode(next(packets)), iterations
+    )
+
+    # One frame: both sticks and a button change
+    frame = [LEFT, RIGHT, BUTTON]
+    json_frame = [json.dumps(m) for m in frame]
+    mask = buttons_mask(['A'])
+    bin_frame = encode_packet(0, [LEFT, RIGHT], mask)
+    print("Batched frame (2 sticks + 1 button)")
+    print(f"  size: json={sum(len(m) for m in json_frame)} B in {len(json_frame)} messages, "
+          f"binary={len(bin_frame)} B in 1 packet")
+    results['json_frame'] = bench(
+        "json encode+decode", lambda: [json.loads(json.dumps(m)) for m in frame], iterations // 3
+    )
+    decoder = BinaryDecoder()
+    seq = itertools.count()
+    results['binary_frame'] = bench(
+        "binary encode+decode",
+        lambda: decoder.decode(encode_packet(next(seq), [LEFT, RIGHT], mask)),
+        iterations // 3,
+    )
+    return results
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
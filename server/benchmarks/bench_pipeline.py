@@ -0,0 +1,333 @@
+# Benchmark: capture -> transform -> encode -> send pipeline
+"""
+Times each video pipeline stage on its own, across resolutions, scale
+factors and JPEG qualities:
+
+    capture   ScreenCapture.capture_frame (grab, BGRA->BGR, resize)
+    resize    the cv2.resize call capture uses when scale < 1
+    jpeg      ScreenCapture.encode_jpeg
+    h264      VideoEncoder.encode_video_frame (PyAV; skipped without av)
+    mjpeg     the MJPEG part write to a local socket, drained by a reader
+
+Frames come from the synthetic test pattern or are replayed from a video
+file or a directory of images (--replay), so runs are repeatable without a
+display. Results (fps, ms/frame, MB/s of stage output, peak RSS so far)
+can be saved as JSON and compared against an earlier run for another
+commit or machine.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--resolutions 720p,1080p,1440p]
+        [--scales 1,0.75,0.5] [--qualities 50,70,95] [--stages capture,jpeg]
+        [--replay clip.mp4] [--seconds 1] [--json results.json]
+        [--compare baseline.json]
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import settings
+from core.capture import ScreenCapture, SyntheticScreen
+from core.encoder import EncoderConfig, VideoEncoder
+from core.latency import mjpeg_part_header, percentile
+
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    AV_AVAILABLE = False
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080), '1440p': (2560, 1440)}
+STAGES = ('capture', 'resize', 'jpeg', 'h264', 'mjpeg')
+FRAME_POOL = 30  # Distinct frames cycled through the encode stages
+
+
+class ReplayScreen:
+    """mss-like grabber cycling through recorded frames"""
+
+    def __init__(self, frames: List[np.ndarray]):
+        height, width = frames[0].shape[:2]
+        monitor = {'left': 0, 'top': 0, 'width': width, 'height': height}
+        self.monitors = [monitor, monitor]
+        self._frames = itertools.cycle(frames)
+
+    def grab(self, monitor: dict) -> np.ndarray:
+        return next(self._frames)
+
+    def close(self) -> None:
+        pass
+
+
+def load_replay(path: str, limit: int) -> List[np.ndarray]:
+    """BGR frames from a video file or a directory of images"""
+    frames = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path))[:limit]:
+            image = cv2.imread(os.path.join(path, name), cv2.IMREAD_COLOR)
+            if image is not None:
+                frames.append(image)
+    else:
+        video = cv2.VideoCapture(path)
+        while len(frames) < limit:
+            ok, image = video.read()
+            if not ok:
+                break
+            frames.append(image)
+        video.release()
+    if not frames:
+        raise SystemExit(f"no frames could be read from {path}")
+    return frames
+
+
+def make_screen(size, replay: Optional[List[np.ndarray]]):
+    if replay is None:
+        return SyntheticScreen(*size)
+    return ReplayScreen([
+        cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2BGRA)
+        for frame in replay
+    ])
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def measure(func: Callable, items: list, seconds: float, min_frames: int = 10) -> dict:
+    """Run func over items for `seconds`; func returns the bytes it produced"""
+    times = []
+    produced = 0
+    deadline = time.perf_counter() + seconds
+    for item in itertools.cycle(items):
+        started = time.perf_counter()
+        produced += func(item) or 0
+        finished = time.perf_counter()
+        times.append(finished - started)
+        if finished >= deadline and len(times) >= min_frames:
+            break
+    total = sum(times)
+    times.sort()
+    return {
+        'frames': len(times),
+        'fps': round(len(times) / total, 1) if total else None,
+        'ms_per_frame': round(total / len(times) * 1000, 3),
+        'p50_ms': round(percentile(times, 50) * 1000, 3),
+        'p95_ms': round(percentile(times, 95) * 1000, 3),
+        'mb_per_s': round(produced / total / 1e6, 2) if total else None,
+        'bytes_per_frame': int(produced / len(times)),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+class SocketSink:
+    """Local socket pair whose far end is drained by a thread, like a fast client"""
+
+    def __init__(self):
+        self.writer, self._reader = socket.socketpair()
+        self.wfile = self.writer.makefile('wb', buffering=0)  # Like BaseHTTPRequestHandler.wfile
+        self._thread = threading.Thread(target=self._drain, name='bench-reader', daemon=True)
+        self._thread.start()
+
+    def _drain(self) -> None:
+        while self._reader.recv(1 << 20):
+            pass
+
+    def close(self) -> None:
+        self.wfile.close()
+        self.writer.close()
+        self._thread.join(1.0)
+        self._reader.close()
+
+
+def bench_resolution(name: str, size, args, replay) -> List[dict]:
+    results = []
+
+    def record(stage: str, scale: float, quality: Optional[int], stats: dict) -> None:
+        result = {'stage': stage, 'resolution': name, 'scale': scale, 'quality': quality, **stats}
+        results.append(result)
+        if not args.quiet:
+            label = f"{stage:<8} {name:<6} x{scale:<5g}" + (f" q{quality:<3}" if quality else '     ')
+            print(f"  {label} {stats['fps']:>8} fps  {stats['ms_per_frame']:>8.3f} ms/frame  "
+                  f"p95 {stats['p95_ms']:>8.3f} ms  {stats['mb_per_s']:>8} MB/s  rss {stats['peak_rss_mb']} MB",
+                  flush=True)
+
+    for scale in args.scales:
+        capture = ScreenCapture(monitor_index=1, scale_factor=scale)
+        capture.start(make_screen(size, replay))
+        frames = [capture.capture_frame() for _ in range(FRAME_POOL)]
+
+        if 'capture' in args.stages:
+            record('capture', scale, None, measure(
+                lambda _: capture.capture_frame().data.nbytes, [None], args.seconds))
+
+        if 'resize' in args.stages and scale < 1.0:
+            source = [np.array(capture.sct.grab(capture.monitor))[:, :, :3] for _ in range(4)]
+            target = (capture.target_width, capture.target_height)
+            record('resize', scale, None, measure(
+                lambda frame: cv2.resize(frame, target, interpolation=cv2.INTER_NEAREST).nbytes,
+                source, args.seconds))
+
+        for quality in args.qualities:
+            if 'jpeg' in args.stages:
+                record('jpeg', scale, quality, measure(
+                    lambda frame: len(capture.encode_jpeg(frame, quality) or b''), frames, args.seconds))
+
+            if 'mjpeg' in args.stages:
+                parts = [capture.encode_jpeg(frame, quality) for frame in frames]
+                sink = SocketSink()
+                frame_ids = itertools.count(1)
+
+                def write(data: bytes) -> int:
+                    sink.wfile.write(mjpeg_part_header(next(frame_ids), time.perf_counter(), len(data)) + data + b'\r\n')
+                    return len(data)
+
+                try:
+                    record('mjpeg', scale, quality, measure(write, parts, args.seconds))
+                finally:
+                    sink.close()
+
+        if 'h264' in args.stages and AV_AVAILABLE:
+            encoder = VideoEncoder(EncoderConfig(
+                codec=settings.video_codec, bitrate=settings.video_bitrate, fps=settings.target_fps,
+            ))
+            # Encoders need even dimensions for 4:2:0
+            width, height = frames[0].width & ~1, frames[0].height & ~1
+            video_frames = [
+                av.VideoFrame.from_ndarray(np.ascontiguousarray(frame.data[:height, :width]), format='bgr24')
+                for frame in frames
+            ]
+            pts = itertools.count()
+
+            def encode(frame) -> int:
+                frame.pts = next(pts)
+                return sum(packet.size for packet in encoder.encode_video_frame(frame))
+
+            stats = measure(encode, video_frames, args.seconds)
+            stats['encoder'] = encoder.codec.codec.name if encoder.codec else None
+            record('h264', scale, None, stats)
+            encoder.stop()
+
+        capture.stop()
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'av': av.__version__ if AV_AVAILABLE else None,
+    }
+
+
+def case_key(result: dict) -> tuple:
+    return result['stage'], result['resolution'], result['scale'], result['quality']
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    """Print the fps change of every case also present in the baseline"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {case_key(result): result for result in baseline['results']}
+    print(f"Compared with {baseline_path} ({baseline['environment'].get('commit')} "
+          f"on {baseline['environment'].get('host')}):")
+    for result in results:
+        old = before.get(case_key(result))
+        if not old or not old['fps'] or not result['fps']:
+            continue
+        change = (result['fps'] / old['fps'] - 1) * 100
+        stage, resolution, scale, quality = case_key(result)
+        label = f"{stage:<8} {resolution:<6} x{scale:<5g}" + (f" q{quality:<3}" if quality else '     ')
+        print(f"  {label} {old['fps']:>8} -> {result['fps']:>8} fps  {change:+6.1f}%")
+
+
+def parse_list(value: str, cast) -> list:
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--resolutions', type=lambda v: parse_list(v, str), default=list(RESOLUTIONS),
+                        help='comma-separated: ' + ','.join(RESOLUTIONS))
+    parser.add_argument('--scales', type=lambda v: parse_list(v, float), default=[1.0, 0.75, 0.5])
+    parser.add_argument('--qualities', type=lambda v: parse_list(v, int), default=[50, 70, 95])
+    parser.add_argument('--stages', type=lambda v: parse_list(v, str), default=list(STAGES),
+                        help='comma-separated: ' + ','.join(STAGES))
+    parser.add_argument('--replay', metavar='PATH', help='video file or image directory to replay')
+    parser.add_argument('--replay-frames', type=int, default=120, help='frames to load from --replay')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time per case')
+    parser.add_argument('--json', metavar='PATH', help='write results as JSON to this file')
+    parser.add_argument('--compare', metavar='PATH', help='baseline JSON from an earlier run')
+    parser.add_argument('--quiet', action='store_true', help='no per-case lines')
+    args = parser.parse_args(argv)
+    unknown = [r for r in args.resolutions if r not in RESOLUTIONS] + [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown resolution or stage: {', '.join(unknown)}")
+    return args
+
+
+def run(argv=None) -> dict:
+    args = parse_args(argv)
+    replay = load_replay(args.replay, args.replay_frames) if args.replay else None
+    if 'h264' in args.stages and not AV_AVAILABLE and not args.quiet:
+        print("h264 skipped: PyAV not installed (pip install av)")
+
+    results = []
+    for name in args.resolutions:
+        if not args.quiet:
+            print(f"{name} ({'replay ' + args.replay if replay else 'synthetic'})")
+        results.extend(bench_resolution(name, RESOLUTIONS[name], args, replay))
+
+    report = {
+        'environment': environment(),
+        'source': f"replay:{os.path.basename(args.replay)}" if replay else 'synthetic',
+        'seconds_per_case': args.seconds,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,89 @@
+# Benchmark: multi-process pipeline throughput vs encoder count
+"""
+Runs the PIPELINE=process pipeline (core/process_pipeline.py) with an
+uncapped frame rate for each encoder count and reports frames sent per
+second, mean encode time per worker and capture->sent latency. On hosts
+with 8+ cores fps should climb with the worker count until capture (one
+process) or memory bandwidth is the limit.
+
+The synthetic source is used unless CAPTURE_METHOD says otherwise.
+
+Usage:
+    python benchmarks/bench_process_pipeline.py [--workers 1,2,4,8] [--seconds 5]
+        [--scale 1.0] [--quality 70] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CAPTURE_METHOD', 'synthetic')  # Before settings load; children inherit it
+
+from config.settings import settings
+from core.process_pipeline import SENT, ProcessPipeline
+
+UNCAPPED_FPS = 1000
+
+
+def run_case(workers: int, args) -> dict:
+    pipeline = ProcessPipeline(workers, host='127.0.0.1', port=args.port, target_fps=UNCAPPED_FPS,
+                               scale_factor=args.scale, jpeg_quality=args.quality)
+    pipeline.start()
+    try:
+        time.sleep(args.warmup)
+        sent, started = pipeline.counters[SENT], time.perf_counter()
+        time.sleep(args.seconds)
+        fps = (pipeline.counters[SENT] - sent) / (time.perf_counter() - started)
+        with urllib.request.urlopen(f"http://127.0.0.1:{args.port}/stats", timeout=5) as response:
+            stats = json.load(response)
+        if pipeline.dead():
+            raise SystemExit(f"pipeline process exited: {', '.join(pipeline.dead())}")
+    finally:
+        pipeline.stop()
+    return {
+        'workers': workers,
+        'fps': round(fps, 1),
+        'encode_ms': [worker['encode_ms'] for worker in stats['workers']],
+        'latency_p50_ms': stats.get('latency_p50_ms'),
+        'latency_p95_ms': stats.get('latency_p95_ms'),
+        'no_slot': stats['no_slot'],
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=lambda v: [int(n) for n in v.split(',') if n.strip()],
+                        default=[1, 2, 4, 8], help='encoder counts to compare')
+    parser.add_argument('--seconds', type=float, default=5.0, help='measurement time per case')
+    parser.add_argument('--warmup', type=float, default=2.0, help='start-up time per case')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--quality', type=int, default=70)
+    parser.add_argument('--port', type=int, default=settings.mjpeg_port, help='sender port (nothing connects)')
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+def run(argv=None) -> list:
+    args = parse_args(argv)
+    print(f"Process pipeline ({os.cpu_count()} cores, {settings.capture_method}, "
+          f"scale {args.scale}, quality {args.quality})", flush=True)
+    results = []
+    for workers in args.workers:
+        result = run_case(workers, args)
+        results.append(result)
+        speedup = result['fps'] / results[0]['fps'] if results[0]['fps'] else 0.0
+        print(f"  {workers:>2} encoders: {result['fps']:>7.1f} fps (x{speedup:.2f})  "
+              f"encode {result['encode_ms']} ms  latency p50 {result['latency_p50_ms']} "
+              f"p95 {result['latency_p95_ms']} ms", flush=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'cpus': os.cpu_count(), 'results': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+    return results
+
+
+if __name__ == '__main__':
+    run()
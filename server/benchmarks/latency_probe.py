@@ -0,0 +1,236 @@
+# Glass-to-glass latency probe
+"""
+Measures capture-to-decode latency from the video the client actually
+decodes: the server stamps a marker into every captured frame
+(LATENCY_MARKER=1, core/marker.py) and the probe reads it back after
+decoding each MJPEG or WebRTC frame.
+
+Server and probe share the wall clock, so run both on one host; with
+CAPTURE_METHOD=synthetic no display or capture driver is needed. --serve
+starts such a server on loopback for the duration of the probe.
+
+Usage:
+    python benchmarks/latency_probe.py --serve webrtc [--seconds 10]
+    python benchmarks/latency_probe.py --serve mjpeg
+    CAPTURE_METHOD=synthetic LATENCY_MARKER=1 python main.py --headless --webrtc
+    python benchmarks/latency_probe.py --webrtc http://127.0.0.1:8889
+    python benchmarks/latency_probe.py --mjpeg http://127.0.0.1:8888/
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import settings
+from core import marker
+from input.clock import RollingHistogram
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTOGRAM_WINDOW = 1_000_000
+
+
+class Results:
+    def __init__(self, warmup: float):
+        self.latency = RollingHistogram(HISTOGRAM_WINDOW)  # Capture -> decoded on the probe
+        self.decode = RollingHistogram(HISTOGRAM_WINDOW)   # Probe-side decode time (MJPEG)
+        self.frames = 0
+        self.unreadable = 0
+        self.skipped = 0
+        self.repeated = 0
+        self._last_id: Optional[int] = None
+        self._measure_from = time.time() + warmup
+        self._first = None
+        self._last = None
+
+    def add(self, image: np.ndarray, decoded_at: float) -> None:
+        if decoded_at < self._measure_from:
+            return
+        self._first = self._first or decoded_at
+        self._last = decoded_at
+        self.frames += 1
+        found = marker.read(image)
+        if found is None:
+            self.unreadable += 1
+            return
+        if self._last_id is not None:
+            if found.frame_id == self._last_id:
+                self.repeated += 1
+                return
+            if found.frame_id > self._last_id + 1:
+                self.skipped += found.frame_id - self._last_id - 1
+        self._last_id = found.frame_id
+        self.latency.add(found.age(decoded_at) * 1000.0)
+
+    def report(self, transport: str, url: str) -> dict:
+        seconds = (self._last - self._first) if self._first and self._last else 0.0
+        return {
+            'transport': transport,
+            'url': url,
+            'frames': self.frames,
+            'fps': round((self.frames - 1) / seconds, 1) if seconds else None,
+            'unreadable': self.unreadable,
+            'repeated': self.repeated,
+            'skipped_ids': self.skipped,
+            'latency': self.latency.summary(),
+            'decode': self.decode.summary(),
+        }
+
+
+def probe_mjpeg(url: str, seconds: float, results: Results) -> None:
+    """Read the multipart stream, decoding every JPEG part"""
+    deadline = time.time() + seconds
+    with urllib.request.urlopen(url, timeout=5) as stream:
+        while time.time() < deadline:
+            length = None
+            line = stream.readline()
+            if not line:
+                raise ConnectionError('MJPEG stream closed')
+            if not line.startswith(b'--frame'):
+                continue
+            while True:
+                line = stream.readline().strip()
+                if not line:
+                    break
+                name, _, value = line.partition(b':')
+                if name.lower() == b'content-length':
+                    length = int(value)
+            if length is None:
+                continue
+            data = stream.read(length)
+            started = time.time()
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            decoded_at = time.time()
+            if image is None:
+                results.unreadable += 1
+                continue
+            results.decode.add((decoded_at - started) * 1000.0)
+            results.add(image, decoded_at)
+
+
+async def probe_webrtc(url: str, seconds: float, results: Results) -> None:
+    """Negotiate a receive-only session and read back every decoded frame"""
+    import aiohttp
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+
+    pc = RTCPeerConnection()
+    pc.addTransceiver('video', direction='recvonly')
+    track_ready = asyncio.get_running_loop().create_future()
+
+    @pc.on('track')
+    def on_track(track):
+        if track.kind == 'video' and not track_ready.done():
+            track_ready.set_result(track)
+
+    await pc.setLocalDescription(await pc.createOffer())
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{url.rstrip('/')}/offer", json={
+                'sdp': pc.localDescription.sdp, 'type': pc.localDescription.type,
+            }) as response:
+                answer = await response.json()
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=answer['sdp'], type=answer['type']))
+        track = await asyncio.wait_for(track_ready, 10)
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            frame = await asyncio.wait_for(track.recv(), 5)
+            image = frame.to_ndarray(format='bgr24')
+            results.add(image, time.time())
+    finally:
+        await pc.close()
+
+
+def start_server(transport: str) -> subprocess.Popen:
+    """Run main.py headless on loopback with the synthetic source and markers"""
+    env = dict(os.environ, HOST='127.0.0.1', CAPTURE_METHOD='synthetic', LATENCY_MARKER='1')
+    env.setdefault('AUTOTUNE', 'off')  # Measure the configured settings unless asked otherwise
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(SERVER_DIR, 'main.py'), '--headless', f'--{transport}'],
+        env=env, cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    port = settings.webrtc_port if transport == 'webrtc' else settings.mjpeg_port
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"server exited: {server.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f"server did not listen on port {port}")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--webrtc', metavar='URL', help='probe a running WebRTC server')
+    target.add_argument('--mjpeg', metavar='URL', help='probe a running MJPEG stream')
+    target.add_argument('--serve', choices=('webrtc', 'mjpeg'),
+                        help='start a synthetic-capture server on loopback and probe it')
+    parser.add_argument('--seconds', type=float, default=10.0, help='measurement length')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds of frames to ignore first')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args(argv)
+
+
+def run(argv=None) -> dict:
+    args = parse_args(argv)
+    server = None
+    if args.serve:
+        server = start_server(args.serve)
+        transport = args.serve
+        port = settings.webrtc_port if transport == 'webrtc' else settings.mjpeg_port
+        url = f"http://127.0.0.1:{port}" + ('/' if transport == 'mjpeg' else '')
+    else:
+        transport = 'webrtc' if args.webrtc else 'mjpeg'
+        url = args.webrtc or args.mjpeg
+
+    results = Results(args.warmup)
+    try:
+        if transport == 'webrtc':
+            asyncio.run(probe_webrtc(url, args.seconds + args.warmup, results))
+        else:
+            probe_mjpeg(url, args.seconds + args.warmup, results)
+    finally:
+        if server:
+            stop_server(server)
+    report = results.report(transport, url)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Glass-to-glass probe ({transport} {url})")
+        print(f"  frames: {report['frames']} at {report['fps']} fps, unreadable markers {report['unreadable']}, "
+              f"repeated {report['repeated']}, skipped ids {report['skipped_ids']}")
+        for key, label in (('latency', 'capture->decode'), ('decode', 'probe decode')):
+            stats = report[key]
+            if stats:
+                print(f"  {label:<16} p50={stats['p50_ms']} ms  p95={stats['p95_ms']} ms  "
+                      f"p99={stats['p99_ms']} ms  max={stats['max_ms']} ms")
+        if not report['latency']:
+            print("  no markers read: is the server running with LATENCY_MARKER=1?")
+    return report
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,300 @@
+# Multi-viewer load test
+"""
+Opens N concurrent viewers against a local MJPEG or WebRTC server and
+reports, for each step of a ramp (e.g. 1, 2, 4, 8 viewers), the delivered
+fps per viewer, capture-to-receive latency and the server's CPU and thread
+count. The thread count climbs per viewer under MJPEG's thread-per-client
+model; under WebRTC the per-peer encoders show in server CPU.
+
+Some viewers can read slowly (--slow K --slow-fps F): MJPEG viewers then
+stop reading the socket between frames, so the server's writes block, and
+WebRTC viewers take decoded frames late.
+
+Latency: MJPEG uses the X-Capture-Ts part header (the server's
+perf_counter; comparable within one host on Linux and Windows). WebRTC
+reads the in-frame marker (LATENCY_MARKER=1, core/marker.py) from every
+LATENCY_SAMPLE_EVERY-th frame. Viewers all run in this process, so with
+WebRTC the tool's own decoding also costs CPU; watch its share too.
+
+Server CPU needs psutil and the server's pid: --serve starts the server
+itself (synthetic capture, markers on), otherwise give --server-pid or
+let the tool look up the process listening on the port.
+
+Usage:
+    python benchmarks/load_viewers.py --serve mjpeg --ramp 1,2,4,8,16
+    python benchmarks/load_viewers.py --webrtc http://127.0.0.1:8889 --ramp 1,2,4 --slow 1 --slow-fps 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import List, Optional
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.latency_probe import start_server, stop_server
+from config.settings import settings
+from core import marker
+from core.latency import percentile
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+LATENCY_SAMPLE_EVERY = 10  # WebRTC frames per marker read
+
+
+class Viewer:
+    """Counters of one simulated viewer for the current measurement window"""
+
+    def __init__(self, index: int, read_fps: Optional[float]):
+        self.index = index
+        self.read_interval = 1.0 / read_fps if read_fps else 0.0
+        self.frames = 0
+        self.latencies: List[float] = []
+        self.error: Optional[str] = None
+        self.measuring = False
+
+    def on_frame(self, latency_ms: Optional[float] = None) -> None:
+        if not self.measuring:
+            return
+        self.frames += 1
+        if latency_ms is not None:
+            self.latencies.append(latency_ms)
+
+    async def pace(self) -> None:
+        if self.read_interval:
+            await asyncio.sleep(self.read_interval)
+
+
+async def view_mjpeg(url: str, viewer: Viewer) -> None:
+    parsed = urlparse(url)
+    reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80)
+    try:
+        writer.write(f"GET {parsed.path or '/'} HTTP/1.1\r\nHost: {parsed.netloc}\r\n\r\n".encode())
+        await writer.drain()
+        await reader.readuntil(b'\r\n\r\n')
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError('stream closed')
+            if not line.startswith(b'--frame'):
+                continue
+            headers = {}
+            while True:
+                line = (await reader.readline()).strip()
+                if not line:
+                    break
+                name, _, value = line.partition(b':')
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers[b'content-length']))
+            received = time.perf_counter()
+            captured = headers.get(b'x-capture-ts')
+            viewer.on_frame((received - float(captured)) * 1000.0 if captured else None)
+            await viewer.pace()
+    finally:
+        writer.close()
+
+
+async def view_webrtc(url: str, viewer: Viewer) -> None:
+    import aiohttp
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+
+    pc = RTCPeerConnection()
+    pc.addTransceiver('video', direction='recvonly')
+    track_ready = asyncio.get_running_loop().create_future()
+
+    @pc.on('track')
+    def on_track(track):
+        if track.kind == 'video' and not track_ready.done():
+            track_ready.set_result(track)
+
+    try:
+        await pc.setLocalDescription(await pc.createOffer())
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{url.rstrip('/')}/offer", json={
+                'sdp': pc.localDescription.sdp, 'type': pc.localDescription.type,
+            }) as response:
+                answer = await response.json()
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=answer['sdp'], type=answer['type']))
+        track = await asyncio.wait_for(track_ready, 10)
+        received = 0
+        while True:
+            frame = await track.recv()
+            received += 1
+            latency_ms = None
+            if viewer.measuring and received % LATENCY_SAMPLE_EVERY == 0:
+                found = marker.read(frame.to_ndarray(format='bgr24'))
+                if found:
+                    latency_ms = found.age() * 1000.0
+            viewer.on_frame(latency_ms)
+            await viewer.pace()
+    finally:
+        await pc.close()
+
+
+async def run_viewer(view, url: str, viewer: Viewer) -> None:
+    try:
+        await view(url, viewer)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        viewer.error = f"{type(e).__name__}: {e}"
+
+
+def find_server_pid(port: int) -> Optional[int]:
+    """Pid of the local process listening on `port` (needs psutil, may need privileges)"""
+    if not PSUTIL_AVAILABLE:
+        return None
+    try:
+        for connection in psutil.net_connections(kind='tcp'):
+            if connection.status == psutil.CONN_LISTEN and connection.laddr and connection.laddr.port == port:
+                return connection.pid
+    except (psutil.AccessDenied, OSError):
+        pass
+    return None
+
+
+class ServerSampler:
+    """CPU percent and thread count of the server process over a window"""
+
+    def __init__(self, pid: Optional[int]):
+        self.process = psutil.Process(pid) if PSUTIL_AVAILABLE and pid else None
+
+    def start(self) -> None:
+        if self.process:
+            self.process.cpu_percent(None)
+
+    def sample(self) -> dict:
+        if not self.process:
+            return {'server_cpu_percent': None, 'server_threads': None, 'server_rss_mb': None}
+        try:
+            return {
+                'server_cpu_percent': round(self.process.cpu_percent(None), 1),
+                'server_threads': self.process.num_threads(),
+                'server_rss_mb': round(self.process.memory_info().rss / (1024 * 1024), 1),
+            }
+        except psutil.Error:
+            return {'server_cpu_percent': None, 'server_threads': None, 'server_rss_mb': None}
+
+
+async def run_step(count: int, args, view, url: str, sampler: ServerSampler) -> dict:
+    viewers = [
+        Viewer(n, args.slow_fps if n < args.slow else args.read_fps) for n in range(count)
+    ]
+    tasks = [asyncio.ensure_future(run_viewer(view, url, viewer)) for viewer in viewers]
+    try:
+        await asyncio.sleep(args.warmup)
+        for viewer in viewers:
+            viewer.measuring = True
+        sampler.start()
+        tool_cpu = time.process_time()
+        started = time.perf_counter()
+        await asyncio.sleep(args.seconds)
+        elapsed = time.perf_counter() - started
+        tool_cpu = time.process_time() - tool_cpu
+        server = sampler.sample()
+        for viewer in viewers:
+            viewer.measuring = False
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def fps_of(group: List[Viewer]) -> Optional[dict]:
+        rates = sorted(viewer.frames / elapsed for viewer in group)
+        if not rates:
+            return None
+        return {'mean': round(sum(rates) / len(rates), 1), 'min': round(rates[0], 1), 'max': round(rates[-1], 1)}
+
+    latencies = sorted(latency for viewer in viewers for latency in viewer.latencies)
+    return {
+        'viewers': count,
+        'slow_viewers': min(args.slow, count),
+        'failed': sum(1 for viewer in viewers if viewer.error),
+        'errors': sorted({viewer.error for viewer in viewers if viewer.error}),
+        'fps': fps_of([v for v in viewers if v.index >= args.slow and not v.error]),
+        'slow_fps': fps_of([v for v in viewers if v.index < args.slow and not v.error]),
+        'total_fps': round(sum(viewer.frames for viewer in viewers) / elapsed, 1),
+        'latency_p50_ms': round(percentile(latencies, 50), 1) if latencies else None,
+        'latency_p95_ms': round(percentile(latencies, 95), 1) if latencies else None,
+        'tool_cpu_percent': round(tool_cpu / elapsed * 100, 1),
+        **server,
+    }
+
+
+def print_step(step: dict) -> None:
+    fps = step['fps'] or {}
+    slow = f"  slow {step['slow_fps']['mean']} fps" if step['slow_fps'] else ''
+    print(f"  {step['viewers']:>3} viewers: {fps.get('mean')} fps/viewer (min {fps.get('min')}){slow}  "
+          f"total {step['total_fps']} fps  latency p50 {step['latency_p50_ms']} p95 {step['latency_p95_ms']} ms  "
+          f"server cpu {step['server_cpu_percent']}% threads {step['server_threads']}  "
+          f"tool cpu {step['tool_cpu_percent']}%"
+          + (f"  failed {step['failed']}: {'; '.join(step['errors'])}" if step['failed'] else ''),
+          flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--mjpeg', metavar='URL', help='MJPEG stream URL, e.g. http://127.0.0.1:8888/')
+    target.add_argument('--webrtc', metavar='URL', help='WebRTC server URL, e.g. http://127.0.0.1:8889')
+    target.add_argument('--serve', choices=('webrtc', 'mjpeg'),
+                        help='start a synthetic-capture server on loopback and load it')
+    parser.add_argument('--ramp', type=lambda v: [int(n) for n in v.split(',') if n.strip()],
+                        default=[1, 2, 4, 8], help='viewer counts to step through')
+    parser.add_argument('--seconds', type=float, default=5.0, help='measurement time per step')
+    parser.add_argument('--warmup', type=float, default=2.0, help='connect/settle time per step')
+    parser.add_argument('--read-fps', type=float, default=0.0, help='frame read rate of normal viewers (0 = as fast as sent)')
+    parser.add_argument('--slow', type=int, default=0, help='number of slow viewers in each step')
+    parser.add_argument('--slow-fps', type=float, default=5.0, help='frame read rate of slow viewers')
+    parser.add_argument('--server-pid', type=int, help='server process for CPU sampling')
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON to this file')
+    return parser.parse_args(argv)
+
+
+def run(argv=None) -> dict:
+    args = parse_args(argv)
+    server = None
+    if args.serve:
+        server = start_server(args.serve)
+        transport = args.serve
+        port = settings.webrtc_port if transport == 'webrtc' else settings.mjpeg_port
+        url = f"http://127.0.0.1:{port}" + ('/' if transport == 'mjpeg' else '')
+        pid = server.pid
+    else:
+        transport = 'webrtc' if args.webrtc else 'mjpeg'
+        url = args.webrtc or args.mjpeg
+        pid = args.server_pid or find_server_pid(urlparse(url).port or 80)
+    if not PSUTIL_AVAILABLE or not pid:
+        print("Server CPU not sampled: " + ("install psutil" if not PSUTIL_AVAILABLE else "pass --server-pid"))
+
+    view = view_webrtc if transport == 'webrtc' else view_mjpeg
+    sampler = ServerSampler(pid)
+    steps = []
+    print(f"Load test ({transport} {url}, {args.seconds:g} s per step"
+          + (f", {args.slow} slow at {args.slow_fps:g} fps" if args.slow else '') + ")")
+    try:
+        for count in args.ramp:
+            step = asyncio.run(run_step(count, args, view, url, sampler))
+            steps.append(step)
+            print_step(step)
+    finally:
+        if server:
+            stop_server(server)
+
+    report = {'transport': transport, 'url': url, 'steps': steps}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+    return report
+
+
+if __name__ == '__main__':
+    run()
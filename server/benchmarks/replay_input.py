@@ -0,0 +1,248 @@
+# Input replay and load generator
+"""
+Replays input recordings (input/recorder.py, INPUT_RECORD_DIR) with many
+concurrent synthetic clients, either in-process through the input
+handlers or over WebSocket against a running input server.
+
+In-process, every client gets its own controller slot on the recording
+backend (no drivers needed) and reports handler time per message and the
+receive -> device update delay. Over WebSocket the server's acks give the
+same injection delay, plus the round trip to the ack; the server accepts
+at most four clients.
+
+Usage:
+    python benchmarks/replay_input.py session.cgir [more.cgir ...]
+        [--clients N] [--speed X | --max] [--loops N] [--binary]
+        [--ws ws://host:8765]
+    python benchmarks/replay_input.py --synthetic 10 --clients 16 --max
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import sys
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.latency import now
+from input.clock import RollingHistogram, server_ms
+from input.protocol import BUTTON_MASKS, encode_packet
+from input.recorder import read_recording
+
+Session = List[Tuple[float, dict]]
+
+DPAD_TO_BUTTON = {'up': 'D_UP', 'down': 'D_DOWN', 'left': 'D_LEFT', 'right': 'D_RIGHT'}
+HISTOGRAM_WINDOW = 1_000_000
+
+
+def synthetic_session(seconds: float, rate: int = 60) -> Session:
+    """Both sticks circling at `rate` Hz with a button tap every half second"""
+    session = []
+    for n in range(int(seconds * rate)):
+        t = n / rate
+        angle = 2 * math.pi * t
+        session.append((t, {'type': 'left_stick', 'x': math.cos(angle), 'y': math.sin(angle)}))
+        session.append((t, {'type': 'right_stick', 'x': -math.sin(angle), 'y': math.cos(angle) / 2}))
+        if n % (rate // 2 or 1) == 0:
+            session.append((t, {'type': 'button', 'button': 'A', 'pressed': True}))
+            session.append((t + 0.05, {'type': 'button', 'button': 'A', 'pressed': False}))
+    session.sort(key=lambda item: item[0])
+    return session
+
+
+class Encoder:
+    """Turns session messages into wire payloads stamped with the send time"""
+
+    def __init__(self, binary: bool):
+        self.binary = binary
+        self.seq = itertools.count()
+        self.buttons = 0
+
+    def encode(self, msg: dict, client_time: float):
+        if not self.binary:
+            return json.dumps({**msg, 't': client_time})
+        if msg['type'] in ('left_stick', 'right_stick'):
+            return encode_packet(next(self.seq) & 0xFFFF, [msg], client_time=client_time)
+        button = DPAD_TO_BUTTON.get(msg.get('direction')) if msg['type'] == 'dpad' else msg.get('button')
+        mask = BUTTON_MASKS.get(button, 0)
+        self.buttons = (self.buttons | mask) if msg.get('pressed') else (self.buttons & ~mask)
+        return encode_packet(next(self.seq) & 0xFFFF, [], self.buttons, client_time)
+
+
+async def pace(start: float, offset: float, speed: float, sent: int) -> None:
+    """Wait for a message's replay time; at max speed just yield now and then"""
+    if speed > 0:
+        delay = start + offset / speed - now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    elif sent % 64 == 0:
+        await asyncio.sleep(0)
+
+
+class Results:
+    def __init__(self):
+        self.sent = 0
+        self.handler = RollingHistogram(HISTOGRAM_WINDOW)   # handle_raw_message time per message
+        self.inject = RollingHistogram(HISTOGRAM_WINDOW)    # receive -> device update
+        self.ack_rtt = RollingHistogram(HISTOGRAM_WINDOW)   # send -> ack received (WebSocket)
+        self.rejected = 0
+
+    def report(self, seconds: float) -> dict:
+        report = {
+            'messages': self.sent,
+            'seconds': round(seconds, 3),
+            'messages_per_s': round(self.sent / seconds, 1) if seconds else None,
+            'handler': self.handler.summary(),
+            'inject': self.inject.summary(),
+            'ack_rtt': self.ack_rtt.summary(),
+        }
+        if self.rejected:
+            report['rejected_clients'] = self.rejected
+        return report
+
+
+async def replay_local(sessions: List[Session], args, results: Results) -> None:
+    """Replay through the input handlers with one slot per synthetic client"""
+    from input import input_server
+    from input.backends import RecordingBackend, set_backend
+
+    set_backend(RecordingBackend())
+
+    def on_inject(acks, injected):
+        injected_ms = server_ms(injected)
+        for _, received in acks:
+            results.inject.add(injected_ms - server_ms(received))
+
+    async def client(index: int, session: Session):
+        slot = input_server.ControllerSlot(index)
+        slot.open()
+        slot.start()
+        slot.on_inject = on_inject
+        encoder = Encoder(args.binary)
+        decoder = input_server.BinaryDecoder()
+        start = now()
+        for offset, msg in itertools.chain.from_iterable(
+            ((offset + loop * (session[-1][0] + 0.05), msg) for offset, msg in session)
+            for loop in range(args.loops)
+        ):
+            await pace(start, offset, args.speed, results.sent)
+            payload = encoder.encode(msg, server_ms())
+            began = now()
+            input_server.handle_raw_message(slot, payload, decoder)
+            handled = now()
+            slot.request_ack(0.0, began)
+            results.handler.add((handled - began) * 1000.0)
+            results.sent += 1
+        await asyncio.sleep(0.05)  # Let the last update reach the device
+        slot.on_inject = None
+        slot.reset()
+
+    await asyncio.gather(*(
+        client(n, sessions[n % len(sessions)]) for n in range(args.clients)
+    ))
+    input_server.gamepad_thread_running = False
+
+
+async def replay_websocket(sessions: List[Session], args, results: Results) -> None:
+    """Replay against a running input server, one WebSocket per synthetic client"""
+    import websockets
+
+    async def receive(ws):
+        async for message in ws:
+            if isinstance(message, bytes):
+                continue
+            data = json.loads(message)
+            if data.get('type') == 'ping':
+                t = server_ms()
+                await ws.send(json.dumps({'type': 'pong', 't0': data['t0'], 't1': t, 't2': t}))
+            elif data.get('type') == 'ack':
+                results.inject.add(data['inject'] - data['recv'])
+                results.ack_rtt.add(server_ms() - data['t'])
+
+    async def client(session: Session):
+        try:
+            ws = await websockets.connect(args.ws)
+        except OSError as e:
+            print(f"connect failed: {e}")
+            results.rejected += 1
+            return
+        receiver = asyncio.create_task(receive(ws))
+        encoder = Encoder(args.binary)
+        start = now()
+        try:
+            for loop in range(args.loops):
+                base = loop * (session[-1][0] + 0.05)
+                for offset, msg in session:
+                    await pace(start, base + offset, args.speed, results.sent)
+                    await ws.send(encoder.encode(msg, server_ms()))
+                    results.sent += 1
+            await asyncio.sleep(0.2)  # Collect the last acks
+        except websockets.exceptions.ConnectionClosed as e:
+            if e.rcvd and e.rcvd.code == 1013:
+                results.rejected += 1
+        finally:
+            receiver.cancel()
+            await ws.close()
+
+    await asyncio.gather(*(
+        client(sessions[n % len(sessions)]) for n in range(args.clients)
+    ))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('recordings', nargs='*', help='input recordings (.cgir)')
+    parser.add_argument('--synthetic', type=float, metavar='SECONDS',
+                        help='replay a generated session of this length instead')
+    parser.add_argument('--clients', type=int, default=1, help='concurrent synthetic clients')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed (1 = real time)')
+    parser.add_argument('--max', dest='speed', action='store_const', const=0.0,
+                        help='replay as fast as possible')
+    parser.add_argument('--loops', type=int, default=1, help='replay each session this many times')
+    parser.add_argument('--binary', action='store_true', help='send the binary protocol instead of JSON')
+    parser.add_argument('--ws', metavar='URL', help='replay over WebSocket to a running server')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+    if not args.recordings and not args.synthetic:
+        parser.error('give recordings or --synthetic SECONDS')
+    return args
+
+
+def run(argv=None) -> dict:
+    args = parse_args(argv)
+    if args.synthetic:
+        sessions = [synthetic_session(args.synthetic)]
+    else:
+        sessions = [list(read_recording(path)) for path in args.recordings]
+        sessions = [session for session in sessions if session]
+        if not sessions:
+            raise SystemExit('recordings are empty')
+
+    results = Results()
+    started = now()
+    replay = replay_websocket if args.ws else replay_local
+    asyncio.run(replay(sessions, args, results))
+    report = results.report(now() - started)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        mode = f"websocket {args.ws}" if args.ws else 'in-process'
+        speed = 'max' if args.speed <= 0 else f"{args.speed:g}x"
+        print(f"Replay ({mode}, {args.clients} clients, {speed}, {'binary' if args.binary else 'json'})")
+        print(f"  messages: {report['messages']} in {report['seconds']} s = {report['messages_per_s']} msg/s")
+        for key, label in (('handler', 'handler'), ('inject', 'inject delay'), ('ack_rtt', 'ack round trip')):
+            stats = report[key]
+            if stats:
+                print(f"  {label:<15} p50={stats['p50_ms']} ms  p95={stats['p95_ms']} ms  "
+                      f"p99={stats['p99_ms']} ms  max={stats['max_ms']} ms")
+        if results.rejected:
+            print(f"  rejected clients: {results.rejected}")
+    return report
+
+
+if __name__ == '__main__':
+    run()
@@ -22,13 +22,46 @@ class Settings:
     video_bitrate: str = field(default_factory=lambda: os.getenv('VIDEO_BITRATE', '15M'))
     jpeg_quality: int = field(default_factory=lambda: int(os.getenv('JPEG_QUALITY', 95)))
     scale_factor: float = field(default_factory=lambda: float(os.getenv('SCALE_FACTOR', 1.0)))
+    webrtc_encoder: str = field(default_factory=lambda: os.getenv('WEBRTC_ENCODER', 'aiortc'))  # 'aiortc' or 'ffmpeg' (pre-encoded H.264)
+    autotune: str = field(default_factory=lambda: os.getenv('AUTOTUNE', 'auto'))  # 'auto' (calibrate once per host), 'force' or 'off' (see core/autotune.py)
+    autotune_headroom: float = field(default_factory=lambda: float(os.getenv('AUTOTUNE_HEADROOM', 0.3)))  # Fraction of the frame time kept free
+    autotune_cache: str = field(default_factory=lambda: os.getenv('AUTOTUNE_CACHE', ''))  # Default ~/.cloudgame/autotune.json
+    adaptive_streaming: bool = field(default_factory=lambda: os.getenv('ADAPTIVE_STREAMING', '1').lower() in ('1', 'true', 'yes'))
+    
+    # WebRTC session setup
+    ice_lan_only: bool = field(default_factory=lambda: os.getenv('ICE_LAN_ONLY', '1').lower() in ('1', 'true', 'yes'))
+    ice_servers: str = field(default_factory=lambda: os.getenv('ICE_SERVERS', 'stun:stun.l.google.com:19302'))
+    pc_pool_size: int = field(default_factory=lambda: int(os.getenv('PC_POOL_SIZE', 0)))
+    
+    # Runtime settings (headless mode)
+    event_loop: str = field(default_factory=lambda: os.getenv('EVENT_LOOP', 'asyncio'))  # 'asyncio' or 'uvloop'
+    pipeline: str = field(default_factory=lambda: os.getenv('PIPELINE', 'thread'))  # MJPEG: 'thread' or 'process' (see core/process_pipeline.py)
+    pipeline_workers: int = field(default_factory=lambda: int(os.getenv('PIPELINE_WORKERS', 0)))  # Encoder processes, 0 = cores - 2
+    governor: bool = field(default_factory=lambda: os.getenv('GOVERNOR', '1').lower() in ('1', 'true', 'yes'))  # Lower fps/scale/quality under CPU load (see core/governor.py)
+    governor_cpu_budget: float = field(default_factory=lambda: float(os.getenv('GOVERNOR_CPU_BUDGET', 50)))  # Percent of all cores the streamer may use
+    governor_interval: float = field(default_factory=lambda: float(os.getenv('GOVERNOR_INTERVAL', 1)))  # Seconds between load samples
     
     # Capture settings
     monitor_index: int = field(default_factory=lambda: int(os.getenv('MONITOR_INDEX', 1)))
-    capture_method: str = field(default_factory=lambda: os.getenv('CAPTURE_METHOD', 'mss'))
+    capture_method: str = field(default_factory=lambda: os.getenv('CAPTURE_METHOD', 'mss'))  # 'mss' or 'synthetic' (moving test pattern)
+    synthetic_monitors: int = field(default_factory=lambda: int(os.getenv('SYNTHETIC_MONITORS', 1)))  # Side-by-side monitors of the synthetic source
+    latency_marker: bool = field(default_factory=lambda: os.getenv('LATENCY_MARKER', '0').lower() in ('1', 'true', 'yes'))  # Stamp frame id/time into frames (see core/marker.py)
+    
+    # Telemetry settings
+    stats_interval: float = field(default_factory=lambda: float(os.getenv('STATS_INTERVAL', 10)))  # 0 disables periodic stats logs
+    log_level: str = field(default_factory=lambda: os.getenv('LOG_LEVEL', 'INFO'))
+    log_debug: str = field(default_factory=lambda: os.getenv('LOG_DEBUG', ''))  # comma-separated categories, e.g. 'input,mjpeg'
+    trace_buffer: int = field(default_factory=lambda: int(os.getenv('TRACE_BUFFER', 200000)))  # Spans kept by /debug/trace
+    log_rate_limit: float = field(default_factory=lambda: float(os.getenv('LOG_RATE_LIMIT', 10)))  # records/s per category, 0 = unlimited
     
     # Input settings
     mouse_sensitivity: int = field(default_factory=lambda: int(os.getenv('MOUSE_SENSITIVITY', 20)))
+    mouse_rate: int = field(default_factory=lambda: int(os.getenv('MOUSE_RATE', 500)))  # Mouse ticks/s while the right stick is held (max 1000)
+    input_sync_interval: float = field(default_factory=lambda: float(os.getenv('INPUT_SYNC_INTERVAL', 2)))  # Clock-sync ping period in seconds, 0 disables
+    input_backend: str = field(default_factory=lambda: os.getenv('INPUT_BACKEND', 'auto'))  # 'auto', 'vigem', 'uinput' or 'recording'
+    input_jitter_buffer: bool = field(default_factory=lambda: os.getenv('INPUT_JITTER_BUFFER', '0').lower() in ('1', 'true', 'yes'))  # Re-time bursty stick samples (see input/jitter.py)
+    input_jitter_max_ms: float = field(default_factory=lambda: float(os.getenv('INPUT_JITTER_MAX_MS', 40)))  # Upper bound on the jitter buffer depth
+    input_record_dir: str = field(default_factory=lambda: os.getenv('INPUT_RECORD_DIR', ''))  # Record each input session here (see input/recorder.py), empty disables
     
     def to_dict(self) -> dict:
         """Convert settings to dictionary"""
@@ -0,0 +1,259 @@
+# Startup auto-tuning
+"""
+Picks stream settings this host can sustain (AUTOTUNE=auto, the default):
+at first startup it times capture and encode on the configured monitor
+and chooses the largest scale, then the highest JPEG quality, whose frame
+cost fits the target fps with AUTOTUNE_HEADROOM to spare. If nothing fits,
+the fps steps down FPS_LADDER. WebRTC is timed with the H.264 encoder
+(VideoEncoder) when PyAV is installed.
+
+Results are cached per host fingerprint (CPU, core count, monitor and
+resolution, capture method, transport), so a new CPU or display triggers a
+fresh calibration. `python main.py --calibrate` or AUTOTUNE=force re-runs it
+on demand; AUTOTUNE=off keeps the configured values. Values pinned through
+their env vars (TARGET_FPS, SCALE_FACTOR, JPEG_QUALITY, MJPEG_*) are never
+overridden.
+"""
+import hashlib
+import json
+import os
+import platform
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Optional
+
+from config.settings import settings
+from core.capture import ScreenCapture, open_screen
+from utils.log import get_logger
+
+logger = get_logger('autotune')
+
+FPS_LADDER = (120, 90, 60, 45, 30, 20)
+SCALES = (1.0, 0.75, 0.5, 0.33)
+QUALITIES = (90, 80, 70, 60, 50)
+PREFERRED_MIN_QUALITY = 70  # Below this, drop scale first
+SAMPLES = 8
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cloudgame', 'autotune.json')
+
+# Setting -> env vars that pin it (config.settings, then the MJPEG server's own)
+PINNED_BY = {
+    'target_fps': ('TARGET_FPS', 'MJPEG_TARGET_FPS'),
+    'scale_factor': ('SCALE_FACTOR', 'MJPEG_SCALE'),
+    'jpeg_quality': ('JPEG_QUALITY', 'MJPEG_QUALITY'),
+}
+
+
+@dataclass
+class TuneResult:
+    """Chosen settings and the measurements behind them"""
+    target_fps: int
+    scale_factor: float
+    jpeg_quality: int
+    frame_ms: float
+    budget_ms: float
+    requested_fps: int
+    headroom: float
+    transport: str
+    measured_at: float = field(default_factory=time.time)
+    costs: Dict[str, dict] = field(default_factory=dict)
+
+
+def _cpu_model() -> str:
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def fingerprint(monitor: dict, transport: str) -> dict:
+    """What the calibration depends on; a change means re-measuring"""
+    return {
+        'host': platform.node(),
+        'cpu': _cpu_model(),
+        'cpus': os.cpu_count(),
+        'monitor': settings.monitor_index,
+        'resolution': f"{monitor['width']}x{monitor['height']}",
+        'capture': settings.capture_method,
+        'transport': transport,
+    }
+
+
+def _median_ms(func: Callable, samples: int) -> float:
+    times = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(times)
+
+
+def _h264_encoder():
+    """Frame -> H.264 timing function, or None without PyAV"""
+    try:
+        import av
+        from core.encoder import EncoderConfig, VideoEncoder
+    except ImportError:
+        return None
+    encoder = VideoEncoder(EncoderConfig(
+        codec=settings.video_codec, bitrate=settings.video_bitrate, fps=settings.target_fps,
+    ))
+    pts = iter(range(1 << 30))
+
+    def encode(frame):
+        # Encoders need even dimensions for 4:2:0
+        height, width = frame.data.shape[0] & ~1, frame.data.shape[1] & ~1
+        video_frame = av.VideoFrame.from_ndarray(frame.data[:height, :width].copy(), format='bgr24')
+        video_frame.pts = next(pts)
+        encoder.encode_video_frame(video_frame)
+
+    return encode
+
+
+def measure_costs(screen, transport: str, samples: int = SAMPLES) -> Dict[str, dict]:
+    """Median capture and encode ms per scale (and per JPEG quality)"""
+    h264 = _h264_encoder() if transport == 'webrtc' else None
+    costs = {}
+    for scale in SCALES:
+        capture = ScreenCapture(monitor_index=settings.monitor_index, scale_factor=scale)
+        capture.start(screen)
+        capture.capture_frame()  # Warm up
+        entry = {'capture_ms': round(_median_ms(capture.capture_frame, samples), 3)}
+        frame = capture.capture_frame()
+        if h264:
+            for _ in range(3):
+                h264(frame)  # Encoder open and first frames are slow
+            entry['encode_ms'] = round(_median_ms(lambda: h264(frame), samples), 3)
+        else:
+            entry['jpeg_ms'] = {
+                str(quality): round(_median_ms(lambda: capture.encode_jpeg(frame, quality), samples), 3)
+                for quality in QUALITIES
+            }
+        costs[str(scale)] = entry
+    return costs
+
+
+def _frame_ms(entry: dict, quality: int) -> float:
+    if 'encode_ms' in entry:
+        return entry['capture_ms'] + entry['encode_ms']
+    return entry['capture_ms'] + entry['jpeg_ms'][str(quality)]
+
+
+def choose(costs: Dict[str, dict], target_fps: int, headroom: float, transport: str) -> TuneResult:
+    """Best (scale, quality) that holds the fps; lower the fps only if nothing fits"""
+    candidates = (
+        [(s, q) for s in SCALES for q in QUALITIES if q >= PREFERRED_MIN_QUALITY]
+        + [(s, q) for s in SCALES for q in QUALITIES if q < PREFERRED_MIN_QUALITY]
+    )
+    ladder = [target_fps] + [fps for fps in FPS_LADDER if fps < target_fps]
+    for fps in ladder:
+        budget = 1000.0 / fps * (1.0 - headroom)
+        for scale, quality in candidates:
+            frame_ms = _frame_ms(costs[str(scale)], quality)
+            if frame_ms <= budget:
+                return TuneResult(fps, scale, quality, round(frame_ms, 3), round(budget, 3),
+                                  target_fps, headroom, transport, costs=costs)
+    scale, quality = SCALES[-1], QUALITIES[-1]
+    fps = ladder[-1]
+    return TuneResult(fps, scale, quality, round(_frame_ms(costs[str(scale)], quality), 3),
+                      round(1000.0 / fps * (1.0 - headroom), 3), target_fps, headroom, transport, costs=costs)
+
+
+def _cache_path() -> str:
+    return settings.autotune_cache or DEFAULT_CACHE
+
+
+def load_cache() -> dict:
+    try:
+        with open(_cache_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache: dict) -> None:
+    path = _cache_path()
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp = f"{path}.tmp"
+        with open(temp, 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(temp, path)
+    except OSError as e:
+        logger.warning(f"Could not save calibration to {path}: {e}")
+
+
+def pinned(name: str) -> bool:
+    """True if the user set this value through its env var"""
+    return os.getenv(PINNED_BY[name][0]) is not None
+
+
+def apply(result: TuneResult) -> dict:
+    """Use the tuned values wherever they are not pinned; returns what changed"""
+    tuned = {'target_fps': result.target_fps, 'scale_factor': result.scale_factor, 'jpeg_quality': result.jpeg_quality}
+    applied = {name: value for name, value in tuned.items() if not pinned(name)}
+    settings.update(**applied)
+    mjpeg = {name: value for name, value in tuned.items() if os.getenv(PINNED_BY[name][1]) is None}
+    if result.transport == 'mjpeg' and mjpeg:
+        from video.mjpeg_server import update_settings
+        update_settings(mjpeg)
+    return applied
+
+
+def calibrate(transport: str, target_fps: Optional[int] = None) -> TuneResult:
+    """Measure this host and choose settings (blocks for a few seconds)"""
+    target_fps = target_fps or settings.target_fps
+    started = time.perf_counter()
+    screen = open_screen()
+    try:
+        costs = measure_costs(screen, transport)
+    finally:
+        screen.close()
+    result = choose(costs, target_fps, settings.autotune_headroom, transport)
+    logger.info(
+        f"Calibrated in {time.perf_counter() - started:.1f} s: {result.target_fps} fps, "
+        f"scale {result.scale_factor}, quality {result.jpeg_quality} "
+        f"({result.frame_ms:.1f} ms of {result.budget_ms:.1f} ms budget)"
+    )
+    return result
+
+
+def autotune(transport: str, force: bool = False) -> Optional[TuneResult]:
+    """Apply cached or freshly calibrated settings for this host at startup"""
+    mode = settings.autotune.lower()
+    if mode == 'off' and not force:
+        return None
+    if all(pinned(name) for name in PINNED_BY):
+        logger.info("Stream settings pinned by env vars; skipping calibration")
+        return None
+    try:
+        screen = open_screen()
+        monitor = screen.monitors[settings.monitor_index]
+        screen.close()
+    except Exception as e:
+        logger.warning(f"Calibration skipped, capture unavailable: {e}")
+        return None
+
+    key = hashlib.sha1(json.dumps(fingerprint(monitor, transport), sort_keys=True).encode()).hexdigest()[:16]
+    cache = load_cache()
+    entry = cache.get(key)
+    result = None
+    if entry and not force and mode != 'force':
+        result = TuneResult(**entry['result'])
+        if result.requested_fps != settings.target_fps or result.headroom != settings.autotune_headroom:
+            result = None  # Calibrated for another target
+    if result is None:
+        result = calibrate(transport)
+        cache[key] = {'fingerprint': fingerprint(monitor, transport), 'result': asdict(result)}
+        save_cache(cache)
+    else:
+        logger.info(
+            f"Using calibration from {time.strftime('%Y-%m-%d %H:%M', time.localtime(result.measured_at))}: "
+            f"{result.target_fps} fps, scale {result.scale_factor}, quality {result.jpeg_quality}"
+        )
+    apply(result)
+    return result
@@ -1,22 +1,87 @@
 # Screen capture module
 import cv2
 import numpy as np
-import mss
+import itertools
 import threading
 import time
-from typing import Optional, Tuple
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
 
 from config.settings import settings
+from core import marker
+from core.latency import now
+from core import trace
+from core.metrics import CAPTURE_SECONDS, DEADLINE_MISSES, FRAMES_DROPPED
+from utils.log import get_logger
+
+logger = get_logger('capture')
+
+try:
+    import mss
+    MSS_AVAILABLE = True
+except ImportError:
+    MSS_AVAILABLE = False
+
+SYNTHETIC_SIZE = (1280, 720)
+
+
+class SyntheticScreen:
+    """Drop-in for mss that grabs a moving test pattern (CAPTURE_METHOD=synthetic)"""
+    
+    def __init__(self, width: int = SYNTHETIC_SIZE[0], height: int = SYNTHETIC_SIZE[1], count: int = 1):
+        # `count` monitors side by side; monitors[0] spans them all, like mss
+        count = max(1, count)
+        self.monitors = [{'left': 0, 'top': 0, 'width': width * count, 'height': height}] + [
+            {'left': width * n, 'top': 0, 'width': width, 'height': height} for n in range(count)
+        ]
+        x = np.linspace(0, 255, width * count, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self._pattern = np.empty((height, width * count, 4), dtype=np.uint8)
+        self._pattern[:, :, 0] = x
+        self._pattern[:, :, 1] = y
+        self._pattern[:, :, 2] = (x + y) / 2
+        self._pattern[:, :, 3] = 255
+        self._offset = 0
+        
+    def grab(self, monitor: dict) -> np.ndarray:
+        """BGRA frame, scrolled a little every grab so encoders see motion"""
+        self._offset = (self._offset + 8) % self._pattern.shape[1]
+        screen = np.roll(self._pattern, self._offset, axis=1)
+        return screen[monitor['top']:monitor['top'] + monitor['height'],
+                      monitor['left']:monitor['left'] + monitor['width']]
+        
+    def close(self) -> None:
+        pass
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_screen():
+    """Screen grabber for settings.capture_method (mss API)"""
+    if settings.capture_method == 'synthetic':
+        return SyntheticScreen(count=settings.synthetic_monitors)
+    if not MSS_AVAILABLE:
+        raise RuntimeError("mss not installed (pip install mss); CAPTURE_METHOD=synthetic needs no capture library")
+    return mss.mss()
 
 
 @dataclass
 class Frame:
     """Represents a captured frame"""
     data: np.ndarray
-    timestamp: float
+    timestamp: float  # Monotonic capture time (core.latency.now)
     width: int
     height: int
+    frame_id: int = 0
+    stages: Dict[str, float] = field(default_factory=dict)  # Stage name -> time it completed
+    
+    def mark(self, stage: str) -> None:
+        """Record that the frame has finished a pipeline stage"""
+        self.stages[stage] = now()
 
 
 class ScreenCapture:
@@ -28,34 +93,38 @@ class ScreenCapture:
         self.sct = None
         self.monitor = None
         self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
         self._running = False
         self._latest_frame: Optional[Frame] = None
         self._capture_thread: Optional[threading.Thread] = None
+        self._frame_ids = itertools.count(1)
+        self._frame_time = 1.0 / settings.target_fps
         
-    def start(self) -> None:
-        """Initialize screen capture"""
-        self.sct = mss.mss()
+    def start(self, screen=None) -> None:
+        """Initialize screen capture (optionally from a given mss-like grabber)"""
+        self.sct = screen or open_screen()
         self.monitor = self.sct.monitors[self.monitor_index]
         
         # Pre-calculate dimensions
         self.target_width = int(self.monitor['width'] * self.scale_factor)
         self.target_height = int(self.monitor['height'] * self.scale_factor)
         
-        print(f"Screen capture initialized:")
-        print(f"  Monitor: {self.monitor_index}")
-        print(f"  Resolution: {self.monitor['width']}x{self.monitor['height']}")
-        print(f"  Output: {self.target_width}x{self.target_height}")
+        logger.info(
+            f"Screen capture initialized: monitor {self.monitor_index}, "
+            f"{self.monitor['width']}x{self.monitor['height']} -> "
+            f"{self.target_width}x{self.target_height}"
+        )
         
     def start_continuous(self, target_fps: int = None) -> None:
         """Start continuous capture in background thread"""
         if self._running:
             return
             
-        target_fps = target_fps or settings.target_fps
+        self.set_fps(target_fps or settings.target_fps)
         self._running = True
         self._capture_thread = threading.Thread(
             target=self._capture_loop,
-            args=(target_fps,),
+            name='capture',
             daemon=True
         )
         self._capture_thread.start()
@@ -67,23 +136,39 @@ class ScreenCapture:
             self._capture_thread.join(timeout=1.0)
         if self.sct:
             self.sct.close()
+            self.sct = None
             
-    def _capture_loop(self, target_fps: int) -> None:
+    def set_fps(self, target_fps: int) -> None:
+        """Change the continuous capture rate (takes effect on the next frame)"""
+        self._frame_time = 1.0 / max(1, target_fps)
+        
+    def set_scale(self, scale_factor: float) -> None:
+        """Change the output scale (takes effect on the next frame)"""
+        if self.monitor:
+            self.target_width = int(self.monitor['width'] * scale_factor)
+            self.target_height = int(self.monitor['height'] * scale_factor)
+        self.scale_factor = scale_factor
+        
+    def _capture_loop(self) -> None:
         """Background capture loop"""
-        frame_time = 1.0 / target_fps
+        missed = DEADLINE_MISSES.labels('capture')
         
         while self._running:
+            frame_time = self._frame_time
             start = time.time()
             
             frame = self.capture_frame()
             if frame:
-                with self._lock:
+                with self._frame_ready:
                     self._latest_frame = frame
+                    self._frame_ready.notify_all()
             
             elapsed = time.time() - start
             sleep_time = frame_time - elapsed
             if sleep_time > 0:
                 time.sleep(sleep_time)
+            else:
+                missed.inc()
                 
     def capture_frame(self) -> Optional[Frame]:
         """Capture a single frame"""
@@ -92,7 +177,10 @@ class ScreenCapture:
             
         try:
             # Fast screen grab
+            grab_start = now()
             img = self.sct.grab(self.monitor)
+            captured_at = now()
+            CAPTURE_SECONDS.labels('shared').observe(captured_at - grab_start)
             frame = np.array(img)
             
             # BGRA to BGR (drop alpha channel)
@@ -106,14 +194,25 @@ class ScreenCapture:
                     interpolation=cv2.INTER_NEAREST
                 )
             
-            return Frame(
+            frame_id = next(self._frame_ids)
+            if settings.latency_marker:
+                marker.stamp(frame, frame_id, captured_at)
+            
+            result = Frame(
                 data=frame,
-                timestamp=time.time(),
+                timestamp=captured_at,
                 width=frame.shape[1],
-                height=frame.shape[0]
+                height=frame.shape[0],
+                frame_id=frame_id,
+                stages={'capture': captured_at}
             )
+            result.mark('transform')
+            if trace.enabled:
+                trace.stage_spans('capture', result.stages, grab_start, frame=result.frame_id)
+            return result
         except Exception as e:
-            print(f"Capture error: {e}")
+            logger.warning(f"Capture error: {e}")
+            FRAMES_DROPPED.labels('capture', 'error').inc()
             return None
             
     def get_latest_frame(self) -> Optional[Frame]:
@@ -121,6 +220,18 @@ class ScreenCapture:
         with self._lock:
             return self._latest_frame
             
+    def wait_for_frame(self, previous: Optional[Frame] = None,
+                       timeout: float = 1.0) -> Optional[Frame]:
+        """Block until a frame newer than `previous` is captured (continuous mode)"""
+        with self._frame_ready:
+            self._frame_ready.wait_for(
+                lambda: self._latest_frame is not None and self._latest_frame is not previous,
+                timeout=timeout
+            )
+            if self._latest_frame is previous:
+                return None
+            return self._latest_frame
+            
     def encode_jpeg(self, frame: Frame, quality: int = None) -> Optional[bytes]:
         """Encode frame as JPEG"""
         quality = quality or settings.jpeg_quality
@@ -129,6 +240,7 @@ class ScreenCapture:
             int(cv2.IMWRITE_JPEG_OPTIMIZE), 0  # Disable optimization for speed
         ]
         success, jpeg = cv2.imencode('.jpg', frame.data, encode_params)
+        frame.mark('encode')
         return jpeg.tobytes() if success else None
 
 
@@ -142,3 +254,168 @@ def get_capture() -> ScreenCapture:
     if _capture is None:
         _capture = ScreenCapture()
     return _capture
+
+
+class MonitorSubscription:
+    """A stream's claim on one monitor; capture runs while any claim is open"""
+    
+    def __init__(self, hub: 'MonitorCapture', index: int, fps: float):
+        self.hub = hub
+        self.index = index
+        self.fps = fps  # May be changed while subscribed; the hub runs at the highest
+        
+    def wait_for_frame(self, previous: Optional[Frame] = None,
+                       timeout: float = 1.0) -> Optional[Frame]:
+        return self.hub.wait_for_frame(self.index, previous, timeout)
+        
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MonitorCapture:
+    """
+    One capture session shared by per-monitor streams (/monitor/N).
+    
+    Each pass grabs the bounding box of the subscribed monitors in a single
+    call and publishes one Frame per monitor whose data is a view into that
+    grab, so splitting costs no copy. Frames are shared between streams and
+    must not be modified in place. The capture thread runs only while a
+    monitor has subscribers, at the highest fps any of them asked for.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        self._subscriptions: List[MonitorSubscription] = []
+        self._latest: Dict[int, Frame] = {}
+        self._frame_ids: Dict[int, itertools.count] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._monitors: Optional[List[dict]] = None
+        
+    def monitors(self) -> List[dict]:
+        """mss monitor list: [0] spans all monitors, 1.. are the monitors"""
+        if self._monitors is None:
+            with open_screen() as screen:
+                self._monitors = [dict(monitor) for monitor in screen.monitors]
+        return self._monitors
+        
+    def subscribe(self, index: int, fps: float = None) -> MonitorSubscription:
+        """Start receiving frames of monitor `index` (close the subscription to stop)"""
+        if not 1 <= index < len(self.monitors()):
+            raise ValueError(f"No monitor {index} (have 1-{len(self.monitors()) - 1})")
+        subscription = MonitorSubscription(self, index, fps or settings.target_fps)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._frame_ids.setdefault(index, itertools.count(1))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._capture_loop, name='capture-monitors', daemon=True)
+                self._thread.start()
+        logger.info(f"Monitor {index} subscribed ({self.subscribers().get(index, 0)} streams)")
+        return subscription
+        
+    def unsubscribe(self, subscription: MonitorSubscription) -> None:
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+            if not any(s.index == subscription.index for s in self._subscriptions):
+                self._latest.pop(subscription.index, None)
+                
+    def subscribers(self) -> Dict[int, int]:
+        """Open subscriptions per monitor index"""
+        with self._lock:
+            counts: Dict[int, int] = {}
+            for subscription in self._subscriptions:
+                counts[subscription.index] = counts.get(subscription.index, 0) + 1
+            return counts
+        
+    def wait_for_frame(self, index: int, previous: Optional[Frame] = None,
+                       timeout: float = 1.0) -> Optional[Frame]:
+        """Block until a frame of monitor `index` newer than `previous` is captured"""
+        with self._frame_ready:
+            self._frame_ready.wait_for(
+                lambda: self._latest.get(index) is not None and self._latest.get(index) is not previous,
+                timeout=timeout
+            )
+            latest = self._latest.get(index)
+            return None if latest is previous else latest
+            
+    def _capture_loop(self) -> None:
+        """Grab subscribed monitors until the last subscription closes"""
+        missed = DEADLINE_MISSES.labels('monitors')
+        screen = open_screen()  # mss handles belong to the thread that opened them
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscriptions:
+                        self._thread = None
+                        return
+                    indexes = sorted({s.index for s in self._subscriptions})
+                    frame_time = 1.0 / max(s.fps for s in self._subscriptions)
+                start = time.time()
+                try:
+                    self._grab(screen, indexes)
+                except Exception as e:
+                    logger.warning(f"Capture error: {e}")
+                    FRAMES_DROPPED.labels('capture', 'error').inc()
+                sleep_time = frame_time - (time.time() - start)
+                if sleep_time > 0:
+                    time.sleep(sleep_time)
+                else:
+                    missed.inc()
+        finally:
+            screen.close()
+            
+    def _grab(self, screen, indexes: List[int]) -> None:
+        """One grab covering `indexes`, split into per-monitor views"""
+        monitors = [self._monitors[index] for index in indexes]
+        left = min(m['left'] for m in monitors)
+        top = min(m['top'] for m in monitors)
+        region = {
+            'left': left,
+            'top': top,
+            'width': max(m['left'] + m['width'] for m in monitors) - left,
+            'height': max(m['top'] + m['height'] for m in monitors) - top,
+        }
+        grab_start = now()
+        pixels = np.asarray(screen.grab(region))  # BGRA, shares the grab's buffer
+        captured_at = now()
+        CAPTURE_SECONDS.labels('monitors').observe(captured_at - grab_start)
+        
+        frames = {}
+        for index, monitor in zip(indexes, monitors):
+            x, y = monitor['left'] - left, monitor['top'] - top
+            view = pixels[y:y + monitor['height'], x:x + monitor['width'], :3]
+            frame_id = next(self._frame_ids[index])
+            if settings.latency_marker:
+                marker.stamp(view, frame_id, captured_at)
+            frames[index] = Frame(
+                data=view,
+                timestamp=captured_at,
+                width=monitor['width'],
+                height=monitor['height'],
+                frame_id=frame_id,
+                stages={'capture': captured_at}
+            )
+        if trace.enabled:
+            trace.span('capture', 'capture', grab_start, captured_at, monitors=len(indexes))
+            
+        with self._frame_ready:
+            self._latest.update(frames)
+            self._frame_ready.notify_all()
+
+
+_monitor_capture: Optional[MonitorCapture] = None
+
+
+def get_monitor_capture() -> MonitorCapture:
+    """Get or create the shared multi-monitor capture"""
+    global _monitor_capture
+    if _monitor_capture is None:
+        _monitor_capture = MonitorCapture()
+    return _monitor_capture
@@ -1,11 +1,58 @@
 # Video encoding module
 import subprocess
 import threading
+import time
+from fractions import Fraction
 from typing import Optional, Generator
 from dataclasses import dataclass
 import numpy as np
 
 from config.settings import settings
+from utils.log import get_logger
+
+logger = get_logger('encoder')
+
+
+# Low-latency options per encoder, shared by the ffmpeg CLI and PyAV paths
+ENCODER_OPTIONS = {
+    'h264_nvenc': {
+        'preset': 'p1',  # Fastest preset
+        'tune': 'ull',  # Ultra low latency
+        'zerolatency': '1',
+    },
+    'libx264': {
+        'preset': 'ultrafast',
+        'tune': 'zerolatency',
+    },
+}
+
+# Extra options for the in-process encoder that feeds WebRTC: browsers
+# negotiate constrained baseline (42e01f), NVENC and x264 default to Main/High
+WEBRTC_OPTIONS = {
+    'h264_nvenc': {'profile': 'baseline'},
+    'libx264': {'profile': 'baseline'},
+}
+
+# Encoders whose FFmpeg wrapper applies a new bit_rate on the next frame
+# (x264 needs VBV, which open_codec enables; NVENC needs GPU support)
+LIVE_BITRATE_ENCODERS = ('libx264', 'h264_nvenc')
+# Other encoders reopen, which costs an IDR frame: only for a change that
+# lasted BITRATE_HOLD seconds, at most once per BITRATE_REOPEN_INTERVAL
+BITRATE_HOLD = 2.0
+BITRATE_REOPEN_INTERVAL = 10.0
+
+# Cached result of the (slow) ffmpeg encoder probe
+_detected_hw_encoder: Optional[str] = None
+
+
+def parse_bitrate(bitrate: str) -> int:
+    """Convert an ffmpeg-style bitrate ('15M', '800k') to bits per second"""
+    bitrate = str(bitrate).strip()
+    multipliers = {'k': 1_000, 'm': 1_000_000, 'g': 1_000_000_000}
+    suffix = bitrate[-1:].lower()
+    if suffix in multipliers:
+        return int(float(bitrate[:-1]) * multipliers[suffix])
+    return int(float(bitrate))
 
 
 @dataclass
@@ -30,9 +77,20 @@ class VideoEncoder:
         self.process: Optional[subprocess.Popen] = None
         self._lock = threading.Lock()
         self._hw_encoder = self._detect_hw_encoder()
+        self.codec = None  # PyAV codec context for in-process encoding
+        self.max_bitrate = parse_bitrate(self.config.bitrate)  # VBV ceiling of the in-process encoder
+        self._opened_at = 0.0
+        self._bitrate_changed_at: Optional[float] = None
         
     def _detect_hw_encoder(self) -> str:
-        """Detect available hardware encoder"""
+        """Detect available hardware encoder (probed once per process)"""
+        global _detected_hw_encoder
+        if _detected_hw_encoder is None:
+            _detected_hw_encoder = self._probe_hw_encoder()
+        return _detected_hw_encoder
+        
+    def _probe_hw_encoder(self) -> str:
+        """Ask ffmpeg which hardware encoders it has"""
         # Try NVENC (NVIDIA)
         try:
             result = subprocess.run(
@@ -41,18 +99,18 @@ class VideoEncoder:
                 text=True
             )
             if 'h264_nvenc' in result.stdout:
-                print("✓ NVIDIA NVENC encoder detected")
+                logger.info("✓ NVIDIA NVENC encoder detected")
                 return 'h264_nvenc'
             if 'h264_amf' in result.stdout:
-                print("✓ AMD AMF encoder detected")
+                logger.info("✓ AMD AMF encoder detected")
                 return 'h264_amf'
             if 'h264_qsv' in result.stdout:
-                print("✓ Intel QuickSync encoder detected")
+                logger.info("✓ Intel QuickSync encoder detected")
                 return 'h264_qsv'
         except Exception:
             pass
         
-        print("⚠ No hardware encoder found, using software (libx264)")
+        logger.warning("⚠ No hardware encoder found, using software (libx264)")
         return 'libx264'
     
     def get_ffmpeg_command(self, output_format: str = 'mpegts') -> list:
@@ -75,17 +133,8 @@ class VideoEncoder:
         ]
         
         # Add encoder-specific options
-        if encoder == 'h264_nvenc':
-            cmd.extend([
-                '-preset', 'p1',  # Fastest preset
-                '-tune', 'ull',  # Ultra low latency
-                '-zerolatency', '1',
-            ])
-        elif encoder == 'libx264':
-            cmd.extend([
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-            ])
+        for option, value in ENCODER_OPTIONS.get(encoder, {}).items():
+            cmd.extend([f'-{option}', value])
         
         # Output format
         if output_format == 'mpegts':
@@ -104,7 +153,7 @@ class VideoEncoder:
             stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL
         )
-        print(f"Encoder started: {self._hw_encoder}")
+        logger.info(f"Encoder started: {self._hw_encoder}")
         
     def stop(self) -> None:
         """Stop the encoder process"""
@@ -112,6 +161,82 @@ class VideoEncoder:
             self.process.stdin.close()
             self.process.wait()
             self.process = None
+        self.codec = None
+        
+    def open_codec(self, width: int, height: int, time_base: Optional[Fraction] = None):
+        """
+        Open an in-process (PyAV) encoder with the same low-latency settings
+        as the ffmpeg command. Packets come back per frame, with no pipe
+        framing delay. `time_base` is that of the frames' pts (rate control
+        reads frame spacing from it); the default assumes one tick per frame.
+        """
+        import av
+        
+        candidates = ['libx264']
+        if self.config.hardware_accel and self._hw_encoder != 'libx264':
+            candidates.insert(0, self._hw_encoder)
+        
+        for encoder in candidates:
+            try:
+                codec = av.CodecContext.create(encoder, 'w')
+                codec.width = width
+                codec.height = height
+                codec.pix_fmt = 'yuv420p'
+                codec.framerate = Fraction(self.config.fps, 1)
+                codec.time_base = time_base or Fraction(1, self.config.fps)
+                codec.bit_rate = parse_bitrate(self.config.bitrate)
+                codec.gop_size = self.config.fps * 2
+                codec.max_b_frames = 0
+                codec.options = dict(
+                    ENCODER_OPTIONS.get(encoder, {}), **WEBRTC_OPTIONS.get(encoder, {}),
+                    maxrate=str(self.max_bitrate), bufsize=str(self.max_bitrate),
+                )
+                codec.open()
+                self.codec = codec
+                self._opened_at = time.monotonic()
+                self._bitrate_changed_at = None
+                self.config.width = width
+                self.config.height = height
+                logger.info(f"Encoder opened: {encoder} {width}x{height} @ {self.config.bitrate}")
+                return codec
+            except Exception as e:
+                logger.warning(f"Encoder {encoder} unavailable: {e}")
+        raise RuntimeError("No usable H.264 encoder")
+        
+    def set_bitrate(self, bitrate: int) -> None:
+        """
+        Change the target bitrate (called per frame). Changes under 10% are
+        ignored; encoders that cannot change it live reopen only on a
+        sustained change, and not more than once per BITRATE_REOPEN_INTERVAL.
+        """
+        self.config.bitrate = str(int(bitrate))
+        codec = self.codec
+        if codec is None:
+            return
+        if abs(bitrate - codec.bit_rate) / codec.bit_rate <= 0.1:
+            self._bitrate_changed_at = None
+            return
+        if codec.name in LIVE_BITRATE_ENCODERS:
+            codec.bit_rate = int(bitrate)
+            return
+        current = time.monotonic()
+        if self._bitrate_changed_at is None:
+            self._bitrate_changed_at = current
+        elif (current - self._bitrate_changed_at >= BITRATE_HOLD
+                and current - self._opened_at >= BITRATE_REOPEN_INTERVAL):
+            self.codec = None
+        
+    def encode_video_frame(self, frame, force_keyframe: bool = False) -> list:
+        """Encode an av.VideoFrame in-process, returning H.264 packets"""
+        import av
+        
+        if self.codec is None or frame.width != self.codec.width or frame.height != self.codec.height:
+            self.open_codec(frame.width, frame.height, frame.time_base)
+        
+        frame.pict_type = (
+            av.video.frame.PictureType.I if force_keyframe else av.video.frame.PictureType.NONE
+        )
+        return list(self.codec.encode(frame))
             
     def encode_frame(self, frame: np.ndarray) -> Optional[bytes]:
         """Encode a single frame"""
@@ -125,7 +250,7 @@ class VideoEncoder:
                 # Read encoded data (non-blocking would be better)
                 return self.process.stdout.read(8192)
         except Exception as e:
-            print(f"Encode error: {e}")
+            logger.warning(f"Encode error: {e}")
             return None
 
 
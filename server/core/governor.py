@@ -0,0 +1,303 @@
+# Host CPU governor
+"""
+Keeps the streamer inside a CPU budget when it shares the host with the
+game (GOVERNOR=1, the default). Every GOVERNOR_INTERVAL seconds it samples
+the server's own CPU (percent of all cores), system CPU (psutil when
+installed, else the load average) and missed frame deadlines
+(cloudgame_deadline_misses_total). Dropped frames are left out: most drop
+reasons (slow viewers, frame-rate limits, capture timeouts) are not CPU.
+
+Under load it steps down LADDER, one level per `down_after` bad samples:
+JPEG quality first, then resolution, then frame rate. It climbs back one
+level after `up_after` clean samples and `hold` seconds, and the hold
+doubles each time a step up has to be undone. Every transition is logged.
+
+Video servers register a target (register_target) whose settings the
+governor scales from the values they had when it first stepped down; the
+encoder presets are already the fastest ones (core/encoder.py), so the
+ladder has no preset step.
+"""
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from config.settings import settings
+from core.metrics import CLIENTS, DEADLINE_MISSES, counter, gauge
+from utils.log import get_logger
+
+logger = get_logger('governor')
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# (fps fraction, scale multiplier, JPEG quality offset)
+LADDER = [
+    (1.0, 1.0, 0),
+    (1.0, 1.0, -20),
+    (1.0, 0.75, -20),
+    (0.75, 0.75, -20),
+    (0.75, 0.5, -30),
+    (0.5, 0.5, -30),
+    (0.5, 0.35, -30),
+]
+MIN_QUALITY = 30
+MIN_SCALE = 0.1
+
+# Frame loops that run once per connected client, by their CLIENTS transport
+PER_CLIENT_LOOPS = {'mjpeg': 'mjpeg'}
+
+TRANSITIONS = counter('cloudgame_governor_transitions_total', 'CPU governor ladder steps', ('direction',))
+
+
+class Target:
+    """A pipeline whose fps/scale/quality the governor controls"""
+
+    def __init__(self, name: str, get: Callable[[], dict], set: Callable[[dict], object]):
+        self.name = name
+        self.get = get
+        self.set = set
+        self.base: Optional[dict] = None
+
+    def apply(self, step: Tuple[float, float, int]) -> None:
+        if step == LADDER[0]:
+            if self.base is not None:
+                self.set(self.base)
+                self.base = None
+            return
+        if self.base is None:
+            self.base = self.get()  # Values in force before the governor stepped in
+        fps_fraction, scale, quality_offset = step
+        self.set({
+            'target_fps': max(1, int(round(self.base['target_fps'] * fps_fraction))),
+            'scale_factor': max(MIN_SCALE, round(self.base['scale_factor'] * scale, 3)),
+            'jpeg_quality': max(MIN_QUALITY, self.base['jpeg_quality'] + quality_offset),
+        })
+
+
+_targets: Dict[str, Target] = {}
+
+
+def register_target(name: str, get: Callable[[], dict], set: Callable[[dict], object]) -> None:
+    """Let the governor control a pipeline; `get`/`set` use target_fps, scale_factor, jpeg_quality keys"""
+    _targets[name] = Target(name, get, set)
+    if _governor and _governor.level:
+        _targets[name].apply(LADDER[_governor.level])
+
+
+class CpuSampler:
+    """Process and system CPU percent and missed deadlines since the last sample"""
+
+    def __init__(self):
+        self.cpus = os.cpu_count() or 1
+        self._process = psutil.Process() if PSUTIL_AVAILABLE else None
+        if PSUTIL_AVAILABLE:
+            psutil.cpu_percent(None)
+        self._last = (time.perf_counter(), self._cpu_seconds(), self._misses())
+
+    def _cpu_seconds(self) -> float:
+        """CPU time of this process and, with psutil, its live children (PIPELINE=process)"""
+        seconds = time.process_time()
+        if self._process:
+            for child in self._process.children(recursive=True):
+                try:
+                    times = child.cpu_times()
+                    seconds += times.user + times.system
+                except psutil.Error:
+                    pass
+        return seconds
+
+    @staticmethod
+    def _misses() -> Dict[str, float]:
+        return {labels[0]: child.value for labels, child in DEADLINE_MISSES.samples()}
+
+    @staticmethod
+    def _missed_per_s(misses: Dict[str, float], last: Dict[str, float], elapsed: float) -> float:
+        """Missed deadlines per second of the worst frame loop"""
+        worst = 0.0
+        for loop, value in misses.items():
+            rate = (value - last.get(loop, 0.0)) / elapsed
+            if loop in PER_CLIENT_LOOPS:
+                # N clients missing the same frame is one miss, not N (MJPEG
+                # clients on the shared monitor capture count too, so this
+                # errs towards fewer misses)
+                rate /= max(1.0, CLIENTS.labels(PER_CLIENT_LOOPS[loop]).value)
+            worst = max(worst, rate)
+        return worst
+
+    def _system_percent(self) -> Optional[float]:
+        if PSUTIL_AVAILABLE:
+            return psutil.cpu_percent(None)
+        if hasattr(os, 'getloadavg'):
+            return min(100.0, os.getloadavg()[0] / self.cpus * 100.0)
+        return None
+
+    def sample(self) -> dict:
+        wall, cpu, misses = time.perf_counter(), self._cpu_seconds(), self._misses()
+        last_wall, last_cpu, last_misses = self._last
+        self._last = (wall, cpu, misses)
+        elapsed = max(1e-6, wall - last_wall)
+        return {
+            'process_percent': round(max(0.0, cpu - last_cpu) / elapsed / self.cpus * 100.0, 1),
+            'system_percent': self._system_percent(),
+            'misses_per_s': round(self._missed_per_s(misses, last_misses, elapsed), 2),
+        }
+
+
+class CpuGovernor:
+    """
+    Steps the stream settings down LADDER while the host is overloaded.
+
+    A sample is overloaded when the server uses more than `budget` percent
+    of all cores, the host is above `system_high` percent, or frame
+    deadlines are missed faster than `miss_fraction` of the target fps
+    the governor started from (not the one it lowered), so a step down
+    does not make the miss threshold stricter.
+    """
+
+    def __init__(self, budget: float, interval: float = 1.0, system_high: float = 90.0,
+                 miss_fraction: float = 0.1, down_after: int = 2, up_after: int = 5, hold: float = 10.0):
+        self.budget = budget
+        self.interval = interval
+        self.system_high = system_high
+        self.miss_fraction = miss_fraction
+        self.down_after = down_after
+        self.up_after = up_after
+        self.base_hold = hold
+        self.hold = hold
+        self.sampler = CpuSampler()
+
+        self.level = 0
+        self.reason = ''
+        self.last_sample: dict = {}
+        self._overloaded = 0
+        self._clean = 0
+        self._last_change = time.time()
+        self._probing = False
+
+    def overload_reason(self, sample: dict) -> Optional[str]:
+        """Why the sample is over budget, or None"""
+        if sample['process_percent'] > self.budget:
+            return f"streamer cpu {sample['process_percent']:.0f}% > budget {self.budget:.0f}%"
+        system = sample.get('system_percent')
+        if system is not None and system >= self.system_high:
+            return f"host cpu {system:.0f}%"
+        allowed = self._full_fps() * self.miss_fraction
+        if sample['misses_per_s'] > allowed:
+            return f"{sample['misses_per_s']:.1f} missed deadlines/s"
+        return None
+
+    def is_clean(self, sample: dict) -> bool:
+        """Enough margin to try a better level"""
+        system = sample.get('system_percent')
+        return (sample['process_percent'] < self.budget * 0.7
+                and (system is None or system < self.system_high - 15)
+                and sample['misses_per_s'] < self._full_fps() * self.miss_fraction / 4)
+
+    @staticmethod
+    def _full_fps() -> int:
+        """Target fps before the governor stepped in"""
+        target = _targets.get('settings')
+        values = target.base if target and target.base else _config_settings()
+        return values['target_fps']
+
+    def update(self, sample: dict) -> None:
+        """Feed one sample and step the ladder if needed"""
+        self.last_sample = sample
+        reason = self.overload_reason(sample)
+        now = time.time()
+        if reason:
+            self._overloaded += 1
+            self._clean = 0
+            if self._overloaded >= self.down_after and self.level < len(LADDER) - 1:
+                # Going down soon after going up means the probe failed
+                if self._probing and now - self._last_change < self.hold:
+                    self.hold = min(self.hold * 2, 120.0)
+                self._step(self.level + 1, reason, now)
+        elif self.is_clean(sample):
+            self._clean += 1
+            self._overloaded = 0
+            if self._clean >= self.up_after and self.level > 0 and now - self._last_change >= self.hold:
+                self._step(self.level - 1, 'load dropped', now)
+        else:
+            self._overloaded = 0
+            self._clean = 0
+
+        # A long stable period resets the probe back-off
+        if now - self._last_change > self.base_hold * 6:
+            self.hold = self.base_hold
+
+    def _step(self, level: int, reason: str, now: float) -> None:
+        old = self.level
+        self._probing = level < old
+        self.level = level
+        self.reason = reason
+        self._overloaded = 0
+        self._clean = 0
+        self._last_change = now
+        TRANSITIONS.labels('up' if level < old else 'down').inc()
+        for target in list(_targets.values()):
+            try:
+                target.apply(LADDER[level])
+            except Exception as e:
+                logger.warning(f"Governor could not update {target.name}: {e}")
+        fps, scale, quality = LADDER[level]
+        sample = self.last_sample
+        logger.info(
+            f"CPU level {old} -> {level} (fps x{fps}, scale x{scale}, quality {quality:+d}) - {reason} "
+            f"[streamer {sample.get('process_percent')}%, host {sample.get('system_percent')}%, "
+            f"{sample.get('misses_per_s')} misses/s]"
+        )
+
+    def state(self) -> dict:
+        """Current level and last sample for stats output"""
+        return {
+            'level': self.level,
+            'step': dict(zip(('fps_fraction', 'scale', 'quality_offset'), LADDER[self.level])),
+            'reason': self.reason,
+            'budget_percent': self.budget,
+            'sample': self.last_sample,
+            'targets': {name: target.get() for name, target in list(_targets.items())},
+        }
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.update(self.sampler.sample())
+
+
+_governor: Optional[CpuGovernor] = None
+gauge('cloudgame_governor_level', 'CPU governor ladder level (0 = full quality)',
+      callback=lambda: _governor.level if _governor else 0)
+
+
+def _config_settings() -> dict:
+    return {'target_fps': settings.target_fps, 'scale_factor': settings.scale_factor,
+            'jpeg_quality': settings.jpeg_quality}
+
+
+register_target('settings', _config_settings, lambda values: settings.update(**values))
+
+
+def get_governor() -> Optional[CpuGovernor]:
+    """The running governor, or None"""
+    return _governor
+
+
+async def serve() -> None:
+    """Run the governor until cancelled (a headless runtime component)"""
+    global _governor
+    _governor = CpuGovernor(settings.governor_cpu_budget, settings.governor_interval)
+    logger.info(
+        f"CPU governor: budget {settings.governor_cpu_budget:.0f}% of {_governor.sampler.cpus} cores"
+        + ("" if PSUTIL_AVAILABLE else " (install psutil for system CPU)")
+    )
+    try:
+        await _governor.run()
+    finally:
+        for target in list(_targets.values()):
+            target.apply(LADDER[0])
+        _governor = None
@@ -0,0 +1,104 @@
+# Frame latency tracking
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from core.metrics import LATENCY_SECONDS, STAGE_SECONDS
+
+# Monotonic, high-resolution and system-wide (QueryPerformanceCounter on
+# Windows, CLOCK_MONOTONIC on Linux), so loopback clients can compare it too
+now = time.perf_counter
+
+# Pipeline stages in order; a frame records the time it left each one
+STAGES = ('capture', 'transform', 'encode', 'send')
+
+
+def mjpeg_part_header(frame_id: int, capture_ts: float, length: int) -> bytes:
+    """Multipart boundary and headers for one MJPEG part"""
+    return (
+        b'--frame\r\n'
+        b'Content-Type: image/jpeg\r\n'
+        b'Content-Length: %d\r\n'
+        b'X-Frame-Id: %d\r\n'
+        b'X-Capture-Ts: %.6f\r\n'
+        b'\r\n' % (length, frame_id, capture_ts)
+    )
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+class LatencyTracker:
+    """
+    Rolling capture-to-wire latency and per-stage durations per transport.
+    Thread-safe: MJPEG handlers record from their own threads.
+    """
+
+    def __init__(self, window: int = 600):
+        self.window = window
+        self._lock = threading.Lock()
+        self._totals: Dict[str, deque] = {}
+        self._stages: Dict[str, Dict[str, deque]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def record(self, transport: str, stages: Dict[str, float]) -> None:
+        """Record one sent frame from its stage timestamps"""
+        sent = stages.get('send')
+        capture = stages.get('capture')
+        if sent is None or capture is None:
+            return
+        LATENCY_SECONDS.labels(transport).observe(sent - capture)
+        with self._lock:
+            totals = self._totals.get(transport)
+            if totals is None:
+                totals = self._totals[transport] = deque(maxlen=self.window)
+                self._stages[transport] = {}
+                self._counts[transport] = 0
+            totals.append(sent - capture)
+            self._counts[transport] += 1
+
+            # Duration of each stage is the gap from the previous recorded stage
+            previous = capture
+            for stage in STAGES[1:]:
+                stamp = stages.get(stage)
+                if stamp is None:
+                    continue
+                durations = self._stages[transport].get(stage)
+                if durations is None:
+                    durations = self._stages[transport][stage] = deque(maxlen=self.window)
+                durations.append(stamp - previous)
+                STAGE_SECONDS.labels(transport, stage).observe(stamp - previous)
+                previous = stamp
+
+    def record_latency(self, transport: str, capture_ts: float, sent_ts: Optional[float] = None) -> None:
+        """Record a frame when only capture and send times are known"""
+        self.record(transport, {'capture': capture_ts, 'send': sent_ts or now()})
+
+    def summary(self) -> dict:
+        """Capture-to-wire percentiles and mean stage durations in milliseconds"""
+        with self._lock:
+            result = {}
+            for transport, totals in self._totals.items():
+                values = sorted(totals)
+                if not values:
+                    continue
+                result[transport] = {
+                    'frames': self._counts[transport],
+                    'p50_ms': round(percentile(values, 50) * 1000, 2),
+                    'p95_ms': round(percentile(values, 95) * 1000, 2),
+                    'p99_ms': round(percentile(values, 99) * 1000, 2),
+                    'max_ms': round(values[-1] * 1000, 2),
+                    'stages_avg_ms': {
+                        stage: round(sum(d) / len(d) * 1000, 3)
+                        for stage, d in self._stages[transport].items() if d
+                    },
+                }
+            return result
+
+
+# Global tracker shared by all transports in the process
+latency_tracker = LatencyTracker()
@@ -0,0 +1,96 @@
+# In-frame latency marker
+"""
+Glass-to-glass test mode (LATENCY_MARKER=1): every captured frame gets a
+strip of black/white cells across its top edge carrying the frame id and
+the capture time, and a probe client (benchmarks/latency_probe.py) reads
+it back from the decoded video.
+
+The strip is MARKER_CELLS square cells across the full frame width, so it
+survives scaling and lossy encoding at any resolution:
+
+    4 sync bits | 20-bit frame id | 32-bit capture time | 8-bit check
+
+The capture time is wall-clock time in 0.1 ms units modulo 2**32 (it wraps
+every ~5 days), so server and probe must share a clock: run both on the
+same host.
+"""
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from core.latency import now
+
+MARKER_CELLS = 64
+SYNC_BITS = (1, 0, 1, 0)
+ID_BITS = 20
+TIME_BITS = 32
+CHECK_BITS = 8
+TIME_UNITS = 10000  # Per second
+
+_WEIGHTS = {bits: 1 << np.arange(bits - 1, -1, -1, dtype=np.uint64) for bits in (ID_BITS, TIME_BITS, CHECK_BITS)}
+
+
+class Marker(NamedTuple):
+    frame_id: int
+    stamp: int  # Capture time in TIME_UNITS, modulo 2**TIME_BITS
+
+    def age(self, at: Optional[float] = None) -> float:
+        """Seconds from capture to wall-clock time `at` (default: now)"""
+        at = time.time() if at is None else at
+        elapsed = (int(at * TIME_UNITS) - self.stamp) % (1 << TIME_BITS)
+        return elapsed / TIME_UNITS
+
+
+def _check(frame_id: int, stamp: int) -> int:
+    value = (frame_id << TIME_BITS) | stamp
+    return (sum(value.to_bytes(7, 'big')) ^ 0xA5) & 0xFF
+
+
+def _to_bits(value: int, bits: int) -> list:
+    return [(value >> shift) & 1 for shift in range(bits - 1, -1, -1)]
+
+
+def strip_height(width: int) -> int:
+    """Pixel height of the marker strip on a frame `width` pixels wide"""
+    return max(1, width // MARKER_CELLS)
+
+
+def stamp(frame: np.ndarray, frame_id: int, captured_at: float) -> None:
+    """Draw the marker into a BGR(A) frame in place; `captured_at` is a core.latency.now() time"""
+    frame_id &= (1 << ID_BITS) - 1
+    wall = time.time() - (now() - captured_at)
+    stamp_value = int(wall * TIME_UNITS) % (1 << TIME_BITS)
+    bits = (list(SYNC_BITS) + _to_bits(frame_id, ID_BITS) + _to_bits(stamp_value, TIME_BITS)
+            + _to_bits(_check(frame_id, stamp_value), CHECK_BITS))
+    width = frame.shape[1]
+    cells = np.array(bits, dtype=np.uint8) * 255
+    row = cells[np.arange(width) * MARKER_CELLS // width]
+    frame[:strip_height(width), :, :3] = row[None, :, None]
+
+
+def read(frame: np.ndarray) -> Optional[Marker]:
+    """Decode the marker from a BGR frame, or None if it is missing or damaged"""
+    height, width = frame.shape[:2]
+    strip = strip_height(width)
+    if width < MARKER_CELLS or height < strip:
+        return None
+    # Sample the middle of each cell, away from edges blurred by scaling and encoding
+    band = frame[strip // 4: max(strip // 4 + 1, strip * 3 // 4), :, :3].mean(axis=(0, 2))
+    cell = width / MARKER_CELLS
+    levels = np.array([
+        band[int((i + 0.25) * cell): max(int((i + 0.25) * cell) + 1, int((i + 0.75) * cell))].mean()
+        for i in range(MARKER_CELLS)
+    ])
+    bits = (levels >= 128).astype(np.uint64)
+    if tuple(bits[:len(SYNC_BITS)]) != SYNC_BITS:
+        return None
+    position = len(SYNC_BITS)
+    fields = []
+    for size in (ID_BITS, TIME_BITS, CHECK_BITS):
+        fields.append(int((bits[position:position + size] * _WEIGHTS[size]).sum()))
+        position += size
+    frame_id, stamp_value, check = fields
+    if check != _check(frame_id, stamp_value):
+        return None
+    return Marker(frame_id, stamp_value)
@@ -0,0 +1,328 @@
+# Pipeline metrics
+"""
+Low-overhead counters, gauges and histograms, exported by the video servers
+at /metrics in the Prometheus text format (/metrics?format=json for JSON).
+
+Recording is a dict lookup and a short locked update, about a microsecond,
+so a few dozen observations per frame stay far below 1% of a 60 fps frame
+budget. Hot paths should keep the child returned by labels() instead of
+looking it up per frame. Gauges can also be callbacks that are only
+evaluated at scrape time.
+
+    FRAMES = counter('cloudgame_frames_total', 'Frames sent', ('transport',))
+    FRAMES.labels('mjpeg').inc()
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Seconds; suits per-stage and end-to-end frame timings
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+class _Value:
+    """One labelled counter or gauge value"""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _HistogramValue:
+    """One labelled histogram: per-bucket counts, sum and count"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Metric:
+    """A named metric family with optional labels"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values) -> object:
+        """The child for a label combination (created on first use)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self) -> Iterable[Tuple[Tuple[str, ...], object]]:
+        return [(tuple(str(v) for v in key), child) for key, child in list(self._children.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], object]] = None):
+        super().__init__(name, help, labelnames)
+        # Each returns a number, or {label value(s): number} for labelled gauges;
+        # modules owning part of the state register one each
+        self.callbacks = [callback] if callback else []
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def samples(self):
+        samples = super().samples()
+        for callback in list(self.callbacks):
+            try:
+                result = callback()
+            except Exception:
+                continue
+            if not isinstance(result, dict):
+                samples.append(((), _constant(result)))
+                continue
+            samples.extend(
+                (key if isinstance(key, tuple) else (str(key),), _constant(value))
+                for key, value in result.items()
+            )
+        return samples
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+def _constant(value) -> _Value:
+    result = _Value()
+    result.value = float(value)
+    return result
+
+
+class RateMeter:
+    """Events per second over the last whole second, for cheap rate gauges"""
+
+    __slots__ = ('_second', '_current', 'last', '_lock')
+
+    def __init__(self):
+        self._second = 0
+        self._current = 0
+        self.last = 0
+        self._lock = threading.Lock()
+
+    def mark(self, count: int = 1) -> None:
+        second = int(time.monotonic())
+        with self._lock:
+            if second != self._second:
+                self.last = self._current if second == self._second + 1 else 0
+                self._second = second
+                self._current = 0
+            self._current += count
+
+    def rate(self) -> float:
+        second = int(time.monotonic())
+        with self._lock:
+            if second == self._second:
+                return float(self.last)
+            return float(self._current) if second == self._second + 1 else 0.0
+
+
+class Registry:
+    """All metrics of the process; get-or-create by name"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} already registered differently")
+                if isinstance(metric, Gauge):
+                    existing.callbacks.extend(c for c in metric.callbacks if c not in existing.callbacks)
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def metrics(self) -> List[Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda m: m.name)
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = (),
+          callback: Optional[Callable[[], object]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames, callback))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+# --- Pipeline metrics ---------------------------------------------------------
+
+CAPTURE_SECONDS = histogram('cloudgame_capture_seconds', 'Screen grab duration', ('source',))
+STAGE_SECONDS = histogram(
+    'cloudgame_stage_seconds', 'Time a delivered frame spent in each pipeline stage '
+    '(transform, encode, send = fan-out/write)', ('transport', 'stage')
+)
+LATENCY_SECONDS = histogram(
+    'cloudgame_latency_seconds', 'Capture to wire per delivered frame (input: arrival to device)', ('transport',)
+)
+ENCODED_BYTES = counter('cloudgame_encoded_bytes_total', 'Encoded video bytes sent', ('transport',))
+FRAMES_DROPPED = counter('cloudgame_frames_dropped_total', 'Frames captured but never sent', ('transport', 'reason'))
+DEADLINE_MISSES = counter('cloudgame_deadline_misses_total', 'Frame loop iterations that overran the frame interval', ('loop',))
+INPUT_MESSAGES = counter('cloudgame_input_messages_total', 'Decoded input messages')
+INPUT_RATE = RateMeter()
+gauge('cloudgame_input_messages_per_second', 'Input messages in the last second', callback=INPUT_RATE.rate)
+QUEUE_DEPTH = gauge('cloudgame_queue_depth', 'Items waiting in pipeline queues', ('queue',))
+CLIENTS = gauge('cloudgame_clients', 'Connected clients', ('transport',))
+
+
+# --- Export -----------------------------------------------------------------
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+_INF_LABEL = 'le="+Inf"'
+
+
+def render_prometheus(registry: Registry = REGISTRY) -> str:
+    """Text exposition format 0.0.4"""
+    lines = []
+    for metric in registry.metrics():
+        samples = metric.samples()
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, child in samples:
+            if isinstance(child, _HistogramValue):
+                counts, total, count = child.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, le)} {cumulative}")
+                lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, _INF_LABEL)} {count}")
+                lines.append(f"{metric.name}_sum{_labels(metric.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{metric.name}_count{_labels(metric.labelnames, key)} {count}")
+            else:
+                lines.append(f"{metric.name}{_labels(metric.labelnames, key)} {_format_value(child.value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def _histogram_quantile(buckets: Tuple[float, ...], counts: List[int], count: int, q: float) -> Optional[float]:
+    """Upper bucket bound holding quantile q (like Prometheus histogram_quantile)"""
+    if not count:
+        return None
+    rank = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return bound
+    return math.inf
+
+
+def render_json(registry: Registry = REGISTRY) -> dict:
+    """The same metrics as plain JSON, with approximate p50/p99 for histograms"""
+    result = {}
+    for metric in registry.metrics():
+        values = []
+        for key, child in metric.samples():
+            entry = {'labels': dict(zip(metric.labelnames, key))}
+            if isinstance(child, _HistogramValue):
+                counts, total, count = child.snapshot()
+                p50 = _histogram_quantile(metric.buckets, counts, count, 0.5)
+                p99 = _histogram_quantile(metric.buckets, counts, count, 0.99)
+                entry.update({
+                    'count': count,
+                    'sum': total,
+                    'mean': total / count if count else None,
+                    'p50_le': None if p50 is None or math.isinf(p50) else p50,
+                    'p99_le': None if p99 is None or math.isinf(p99) else p99,
+                })
+            else:
+                entry['value'] = child.value
+            values.append(entry)
+        result[metric.name] = {'type': metric.kind, 'help': metric.help, 'values': values}
+    return result
@@ -0,0 +1,471 @@
+# Multi-process MJPEG pipeline
+"""
+Runs capture, JPEG encoding and network sending in separate processes so
+their Python parts stop sharing one GIL (PIPELINE=process, MJPEG only):
+
+    capture --(seq, slot)--> encoder 0..N-1 --(seq, slot, length)--> sender --> viewers
+               seq % N                                 in seq order
+
+Frames travel through a ring of shared-memory slots: capture copies each
+BGRA grab into a free slot, an encoder converts, resizes and JPEG-encodes
+it into the same slot's output area, and the sender copies the JPEG out,
+returns the slot and writes it to every viewer. Queues only carry small
+tuples. A full ring is backpressure: capture skips the frame (counted)
+rather than queueing latency. Encoder i takes frames with seq % N == i and
+the sender puts them back in order with a small reorder buffer.
+
+PIPELINE_WORKERS sets N (0: cores - 2, at least 1). The sender serves the
+stream at / and counters at /stats on MJPEG_PORT, and forwards the threaded
+server's diagnostic routes (/metrics, /latency, /input/*, /debug/*,
+/monitors) to the main process, which holds that state. fps, scale and quality
+start from the MJPEG settings and follow the CPU governor through shared
+values read every frame.
+"""
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing.shared_memory import SharedMemory
+from socketserver import ThreadingMixIn
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from config.settings import settings
+from core import marker
+from core.latency import mjpeg_part_header, now, percentile
+from core.metrics import DEADLINE_MISSES, FRAMES_DROPPED
+from core.runtime import run_in_thread
+from utils.log import get_logger, setup_logging
+
+logger = get_logger('pipeline')
+
+# Shared counters: each is written by one process only (RawArray has no lock)
+CAPTURED, NO_SLOT, MISSED, LOST, SENT = range(5)
+COUNTERS = ('captured', 'no_slot', 'missed_deadlines', 'lost', 'sent')
+# Per-encoder values in worker_stats, each encoder writing only its own
+WORKER_ENCODED, WORKER_FAILED, WORKER_SECONDS = range(3)
+WORKER_VALUES = 3
+# Control values, written by the main process
+FPS, SCALE, QUALITY = range(3)
+
+JPEG_HEADROOM = 65536  # Output area per slot: 1 byte per pixel plus this
+REORDER_TIMEOUT = 1.0  # Seconds later frames wait for a missing one before it is skipped
+# Paths the sender forwards to the main process's diagnostics server
+DIAGNOSTIC_PATHS = ('/metrics', '/latency', '/input/', '/debug/', '/monitors')
+DIAGNOSTIC_TIMEOUT = 120.0  # /debug/trace records for the requested seconds
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1) - 2)
+
+
+def _layout(width: int, height: int, slots: int) -> dict:
+    frame_bytes = width * height * 4
+    jpeg_bytes = width * height + JPEG_HEADROOM
+    return {
+        'width': width, 'height': height, 'slots': slots,
+        'frame_bytes': frame_bytes, 'jpeg_bytes': jpeg_bytes, 'slot_bytes': frame_bytes + jpeg_bytes,
+    }
+
+
+def _views(shm: SharedMemory, layout: dict):
+    """Per-slot (BGRA frame, JPEG output) numpy views into the ring"""
+    frames, jpegs = [], []
+    for slot in range(layout['slots']):
+        offset = slot * layout['slot_bytes']
+        frames.append(np.ndarray((layout['height'], layout['width'], 4), np.uint8, shm.buf, offset))
+        jpegs.append(np.ndarray((layout['jpeg_bytes'],), np.uint8, shm.buf, offset + layout['frame_bytes']))
+    return frames, jpegs
+
+
+def _close(shm: SharedMemory, *views: list) -> None:
+    for view in views:
+        view.clear()
+    try:
+        shm.close()
+    except BufferError:
+        pass  # A view is still referenced; released at process exit
+
+
+def _child_setup() -> None:
+    # Ctrl+C reaches the whole process group; the main process stops us through the stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging()  # Spawned fresh: nothing has set up logging in this process
+
+
+def _capture_main(shm_name, layout, free_slots, tasks, control, counters, stop) -> None:
+    """Capture process: grab, copy into a free slot, hand to encoder seq % N"""
+    from core.capture import open_screen
+    _child_setup()
+    shm = SharedMemory(name=shm_name)
+    frames, jpegs = _views(shm, layout)
+    screen = open_screen()
+    monitor = screen.monitors[settings.monitor_index]
+    seq = 0
+    try:
+        while not stop.is_set():
+            frame_time = 1.0 / control[FPS]
+            start = time.time()
+            try:
+                slot = free_slots.get(timeout=frame_time)
+            except queue.Empty:
+                counters[NO_SLOT] += 1  # Encoders or sender behind: skip rather than queue
+                continue
+            pixels = np.asarray(screen.grab(monitor))
+            captured_at = now()
+            np.copyto(frames[slot], pixels)
+            if settings.latency_marker:
+                marker.stamp(frames[slot][:, :, :3], seq + 1, captured_at)
+            tasks[seq % len(tasks)].put((seq, slot, captured_at))
+            seq += 1
+            counters[CAPTURED] += 1
+
+            sleep_time = frame_time - (time.time() - start)
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+            else:
+                counters[MISSED] += 1
+    finally:
+        for task_queue in tasks:
+            task_queue.put(None)
+        screen.close()
+        _close(shm, frames, jpegs)
+
+
+def _encode_main(index, shm_name, layout, tasks, results, control, worker_stats) -> None:
+    """Encoder process: BGRA slot -> (resized) JPEG in the slot's output area"""
+    _child_setup()
+    base = index * WORKER_VALUES
+    shm = SharedMemory(name=shm_name)
+    frames, jpegs = _views(shm, layout)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, captured_at = task
+            started = now()
+            frame = frames[slot][:, :, :3]
+            scale = control[SCALE]
+            if scale < 1.0:
+                size = (int(layout['width'] * scale), int(layout['height'] * scale))
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST)
+                if settings.latency_marker:
+                    marker.stamp(frame, seq + 1, captured_at)  # Full-size cells
+            success, jpeg = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(control[QUALITY])])
+            frame = None
+            length = -1
+            if success and jpeg.size <= layout['jpeg_bytes']:
+                length = jpeg.size
+                jpegs[slot][:length] = jpeg.ravel()
+                worker_stats[base + WORKER_ENCODED] += 1
+            else:
+                worker_stats[base + WORKER_FAILED] += 1
+            worker_stats[base + WORKER_SECONDS] += now() - started
+            results.put((seq, slot, length, captured_at))
+    finally:
+        _close(shm, frames, jpegs)
+
+
+class _Latest:
+    """Newest in-order JPEG for the sender's viewer threads"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.part = None  # (seq, captured_at, jpeg bytes)
+        self.latencies = collections.deque(maxlen=600)  # Capture -> handed to viewers, ms
+
+    def publish(self, part) -> None:
+        with self.cond:
+            self.part = part
+            self.cond.notify_all()
+
+    def wait(self, previous, timeout: float = 1.0):
+        with self.cond:
+            self.cond.wait_for(lambda: self.part is not None and self.part is not previous, timeout=timeout)
+            return self.part
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _make_handler(latest: _Latest, counters, worker_stats, workers: int, diagnostics_port: Optional[int]):
+    class SenderHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _forward(self) -> None:
+            """Relay a diagnostic request to the main process"""
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{diagnostics_port}{self.path}',
+                                            timeout=DIAGNOSTIC_TIMEOUT) as response:
+                    status, headers, body = response.status, response.headers, response.read()
+            except urllib.error.HTTPError as e:
+                status, headers, body = e.code, e.headers, e.read()
+            except OSError as e:
+                self.send_error(502, f'diagnostics unavailable: {e}')
+                return
+            self.send_response(status)
+            for name in ('Content-type', 'Content-Disposition'):
+                if headers.get(name):
+                    self.send_header(name, headers[name])
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if diagnostics_port and self.path.startswith(DIAGNOSTIC_PATHS):
+                self._forward()
+                return
+            if self.path == '/stats':
+                body = pipeline_stats(counters, worker_stats, workers)
+                latencies = sorted(latest.latencies)
+                if latencies:
+                    body['latency_p50_ms'] = round(percentile(latencies, 50), 2)
+                    body['latency_p95_ms'] = round(percentile(latencies, 95), 2)
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps(body).encode())
+                return
+            if self.path != '/':
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            part = None
+            count = 0
+            try:
+                while True:
+                    newest = latest.wait(part)
+                    if newest is None or newest is part:
+                        continue
+                    part = newest
+                    count += 1
+                    _, captured_at, data = part
+                    self.wfile.write(mjpeg_part_header(count, captured_at, len(data)) + data + b'\r\n')
+            except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+                pass
+
+    return SenderHandler
+
+
+def _sender_main(host, port, shm_name, layout, results, free_slots, counters, worker_stats, workers,
+                 diagnostics_port, stop) -> None:
+    """Sender process: reorder encoded frames and write them to every viewer"""
+    _child_setup()
+    shm = SharedMemory(name=shm_name)
+    frames, jpegs = _views(shm, layout)
+    latest = _Latest()
+    httpd = _ThreadingHTTPServer((host, port), _make_handler(latest, counters, worker_stats, workers, diagnostics_port))
+    threading.Thread(target=httpd.serve_forever, name='pipeline-http', daemon=True).start()
+    pending = {}
+    next_seq = 0
+    waiting_since = None
+    try:
+        while not stop.is_set():
+            try:
+                result = results.get(timeout=REORDER_TIMEOUT / 4)
+            except queue.Empty:
+                result = None  # Still check the reorder timeout below
+            if result is not None:
+                if result[0] < next_seq:
+                    free_slots.put(result[1])  # Arrived after it was given up on
+                    continue
+                pending[result[0]] = result
+            # A frame that never arrives (its encoder died) must not stall the stream
+            if next_seq in pending or not pending:
+                waiting_since = None
+            elif waiting_since is None:
+                waiting_since = time.time()
+            elif time.time() - waiting_since > REORDER_TIMEOUT:
+                counters[LOST] += min(pending) - next_seq
+                next_seq = min(pending)
+                waiting_since = None
+            while next_seq in pending:
+                _, slot, length, captured_at = pending.pop(next_seq)
+                data = jpegs[slot][:length].tobytes() if length > 0 else None
+                free_slots.put(slot)
+                if data:
+                    latest.publish((next_seq, captured_at, data))
+                    latest.latencies.append((now() - captured_at) * 1000.0)
+                    counters[SENT] += 1
+                next_seq += 1
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        _close(shm, frames, jpegs)
+
+
+def pipeline_stats(counters, worker_stats, workers: int) -> dict:
+    """Counter snapshot with per-encoder frame counts and mean encode time"""
+    stats = {name: int(counters[index]) for index, name in enumerate(COUNTERS)}
+    stats['workers'] = []
+    for n in range(workers):
+        encoded, failed, seconds = worker_stats[n * WORKER_VALUES:(n + 1) * WORKER_VALUES]
+        frames = int(encoded + failed)
+        stats['workers'].append({
+            'frames': frames,
+            'encode_failed': int(failed),
+            'encode_ms': round(seconds / frames * 1000.0, 2) if frames else None,
+        })
+    stats['encoded'] = sum(worker['frames'] - worker['encode_failed'] for worker in stats['workers'])
+    stats['encode_failed'] = sum(worker['encode_failed'] for worker in stats['workers'])
+    return stats
+
+
+class ProcessPipeline:
+    """Starts, watches and stops the capture, encoder and sender processes"""
+
+    def __init__(self, workers: int = None, host: str = None, port: int = None,
+                 target_fps: int = None, scale_factor: float = None, jpeg_quality: int = None,
+                 diagnostics_port: int = None):
+        self.workers = workers or default_workers()
+        self.diagnostics_port = diagnostics_port  # Main-process server the sender forwards DIAGNOSTIC_PATHS to
+        self.host = host or settings.host
+        self.port = port or settings.mjpeg_port
+        self._ctx = multiprocessing.get_context('spawn')  # Same behaviour on Windows and Unix
+        self.control = self._ctx.RawArray('d', [
+            target_fps or settings.target_fps,
+            scale_factor or settings.scale_factor,
+            jpeg_quality or settings.jpeg_quality,
+        ])
+        self.counters = self._ctx.RawArray('d', len(COUNTERS))
+        self.worker_stats = self._ctx.RawArray('d', self.workers * WORKER_VALUES)
+        self._stop = self._ctx.Event()
+        self._shm: Optional[SharedMemory] = None
+        self._processes: List[multiprocessing.Process] = []
+        self._queues: list = []
+        self._mirrored: dict = {}
+
+    def start(self) -> None:
+        from core.capture import open_screen
+        with open_screen() as screen:
+            monitor = screen.monitors[settings.monitor_index]
+        # Two slots per encoder keep each busy while the sender drains, plus capture's own
+        layout = _layout(monitor['width'], monitor['height'], self.workers * 2 + 2)
+        self._shm = SharedMemory(create=True, size=layout['slots'] * layout['slot_bytes'])
+
+        free_slots = self._ctx.Queue()
+        for slot in range(layout['slots']):
+            free_slots.put(slot)
+        tasks = [self._ctx.Queue() for _ in range(self.workers)]
+        results = self._ctx.Queue()
+        self._queues = [free_slots, results] + tasks  # Children attach to them after start() returns
+        name = self._shm.name
+        self._processes = [
+            self._ctx.Process(target=_sender_main, name='pipeline-sender', daemon=True, args=(
+                self.host, self.port, name, layout, results, free_slots,
+                self.counters, self.worker_stats, self.workers, self.diagnostics_port, self._stop)),
+        ] + [
+            self._ctx.Process(target=_encode_main, name=f'pipeline-encode-{n}', daemon=True, args=(
+                n, name, layout, tasks[n], results, self.control, self.worker_stats))
+            for n in range(self.workers)
+        ] + [
+            self._ctx.Process(target=_capture_main, name='pipeline-capture', daemon=True, args=(
+                name, layout, free_slots, tasks, self.control, self.counters, self._stop)),
+        ]
+        for process in self._processes:
+            process.start()
+        logger.info(
+            f"Process pipeline: capture, {self.workers} encoders, sender on {self.host}:{self.port}; "
+            f"{layout['slots']} slots of {layout['slot_bytes'] / (1024 * 1024):.1f} MB "
+            f"({monitor['width']}x{monitor['height']})"
+        )
+
+    def dead(self) -> List[str]:
+        """Processes that exited on their own"""
+        return [p.name for p in self._processes if p.exitcode is not None]
+
+    def stop(self) -> None:
+        self._stop.set()
+        for process in reversed(self._processes):  # Capture first; it tells encoders to finish
+            if process.pid is None:
+                continue  # Start failed part-way
+            process.join(3)
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+        self._processes = []
+        self._queues = []
+        if self._shm:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def stream_settings(self) -> dict:
+        return {
+            'target_fps': int(self.control[FPS]),
+            'scale_factor': self.control[SCALE],
+            'jpeg_quality': int(self.control[QUALITY]),
+        }
+
+    def update_stream_settings(self, values: dict) -> None:
+        """Change fps/scale/quality; processes read them every frame"""
+        if 'target_fps' in values:
+            self.control[FPS] = max(1, min(120, int(values['target_fps'])))
+        if 'scale_factor' in values:
+            self.control[SCALE] = max(0.1, min(1.0, float(values['scale_factor'])))
+        if 'jpeg_quality' in values:
+            self.control[QUALITY] = max(10, min(100, int(values['jpeg_quality'])))
+
+    def stats(self) -> dict:
+        return dict(pipeline_stats(self.counters, self.worker_stats, self.workers), **self.stream_settings())
+
+    def mirror_metrics(self) -> None:
+        """Copy counter deltas into this process's metrics (read by the CPU governor)"""
+        stats = pipeline_stats(self.counters, self.worker_stats, self.workers)
+        targets = {
+            'no_slot': FRAMES_DROPPED.labels('pipeline', 'no_slot'),
+            'missed_deadlines': DEADLINE_MISSES.labels('pipeline'),
+            'encode_failed': FRAMES_DROPPED.labels('pipeline', 'encode_failed'),
+            'lost': FRAMES_DROPPED.labels('pipeline', 'lost'),
+        }
+        for name, child in targets.items():
+            value, last = stats[name], self._mirrored.get(name, 0)
+            if value > last:
+                child.inc(value - last)
+            self._mirrored[name] = value
+
+
+async def serve() -> None:
+    """Run the process pipeline until cancelled (a headless runtime component)"""
+    from core.governor import register_target
+    from video.mjpeg_server import MJPEGHandler, ThreadingHTTPServer, get_settings
+    stream = get_settings()  # MJPEG_* env and calibration, as the threaded server uses
+    # Metrics, runtime, governor and trace state live here: serve the threaded
+    # server's routes on loopback for the sender to forward
+    diagnostics = ThreadingHTTPServer(('127.0.0.1', 0), MJPEGHandler)
+    threading.Thread(target=diagnostics.serve_forever, name='pipeline-diagnostics', daemon=True).start()
+    pipeline = ProcessPipeline(
+        settings.pipeline_workers or None,
+        target_fps=stream['target_fps'], scale_factor=stream['scale_factor'], jpeg_quality=stream['jpeg_quality'],
+        diagnostics_port=diagnostics.server_address[1],
+    )
+    try:
+        await run_in_thread(pipeline.start, name='pipeline-start')
+        register_target('pipeline', pipeline.stream_settings, pipeline.update_stream_settings)
+        while True:
+            await asyncio.sleep(1.0)
+            pipeline.mirror_metrics()
+            dead = pipeline.dead()
+            if dead:
+                raise RuntimeError(f"pipeline process exited: {', '.join(dead)}")
+    finally:
+        await run_in_thread(pipeline.stop, name='pipeline-stop')
+        diagnostics.shutdown()
+        diagnostics.server_close()
@@ -0,0 +1,356 @@
+# Supervised asyncio runtime for headless mode
+"""
+Hosts the server components (input WebSocket, WebRTC or MJPEG video and
+their background tasks) on one event loop instead of a loop per thread.
+
+Each component is a coroutine that serves until cancelled. The runtime
+restarts a component that fails (with backoff), shuts everything down in
+reverse start order on SIGINT/SIGTERM, and lets worker threads schedule
+work on the loop with call_soon() / submit().
+
+Statistics (stats(), /debug/runtime):
+    loop lag, live task counts per component, and CPU time per component:
+    time spent in its tasks' steps on the loop thread, plus the CPU time of
+    its worker threads (matched by thread name prefix, Unix only).
+
+EVENT_LOOP=uvloop runs the loop on uvloop when it is installed.
+"""
+import asyncio
+import collections.abc
+import concurrent.futures
+import contextvars
+import signal
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from config.settings import settings
+from utils.log import get_logger
+from utils.loop_monitor import LoopLagMonitor
+
+logger = get_logger('runtime')
+
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+RESTART_BACKOFF = (1.0, 30.0)  # First and maximum delay before restarting a failed component
+
+_component: contextvars.ContextVar = contextvars.ContextVar('component', default=None)
+_runtime: Optional['Runtime'] = None
+
+
+def get_runtime() -> Optional['Runtime']:
+    """The running Runtime, or None outside headless mode"""
+    return _runtime
+
+
+def thread_cpu_time(thread: threading.Thread) -> Optional[float]:
+    """CPU seconds used by another thread, where the platform can tell"""
+    if not hasattr(time, 'pthread_getcpuclockid') or thread.ident is None:
+        return None
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (OSError, ValueError):
+        return None
+
+
+class _TimedCoroutine(collections.abc.Coroutine):
+    """Wraps a task's coroutine to charge the CPU time of each step to a component"""
+
+    __slots__ = ('_coro', '_component')
+
+    def __init__(self, coro, component: 'Component'):
+        self._coro = coro
+        self._component = component
+
+    def send(self, value):
+        start = time.thread_time()
+        try:
+            return self._coro.send(value)
+        finally:
+            self._component.loop_cpu += time.thread_time() - start
+
+    def throw(self, *args):
+        start = time.thread_time()
+        try:
+            return self._coro.throw(*args)
+        finally:
+            self._component.loop_cpu += time.thread_time() - start
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def __getattr__(self, name):
+        return getattr(self._coro, name)
+
+
+class Component:
+    """A long-running part of the server, supervised by the Runtime"""
+
+    def __init__(self, name: str, serve: Callable[[], Awaitable[None]],
+                 thread_prefixes: Sequence[str] = (), restart: bool = True):
+        self.name = name
+        self.serve = serve
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.restart = restart
+        self.state = 'stopped'
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self.loop_cpu = 0.0
+        self.tasks: 'weakref.WeakSet[asyncio.Task]' = weakref.WeakSet()
+        self._task: Optional[asyncio.Task] = None
+
+    def threads_cpu(self) -> Optional[float]:
+        if not self.thread_prefixes:
+            return 0.0
+        if not hasattr(time, 'pthread_getcpuclockid'):
+            return None
+        total = 0.0
+        for thread in threading.enumerate():
+            if thread.name.startswith(self.thread_prefixes):
+                total += thread_cpu_time(thread) or 0.0
+        return total
+
+
+class Runtime:
+    """One event loop running supervised components"""
+
+    def __init__(self, components: List[Component]):
+        self.components: Dict[str, Component] = {c.name: c for c in components}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_monitor = LoopLagMonitor()
+        self._stopping: Optional[asyncio.Event] = None
+        self._started = 0.0
+        self._last_sample = None  # (wall time, {component: cpu seconds})
+
+    # --- Running -------------------------------------------------------
+
+    def run(self) -> None:
+        """Run until shutdown() or a signal; blocks the calling thread"""
+        if settings.event_loop == 'uvloop':
+            if UVLOOP_AVAILABLE:
+                uvloop.install()
+            else:
+                logger.warning("uvloop not installed (pip install uvloop), using the default event loop")
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            pass
+
+    async def _main(self) -> None:
+        global _runtime
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_task_factory(self._task_factory)
+        self._stopping = asyncio.Event()
+        self._started = time.perf_counter()
+        _runtime = self
+        self._install_signal_handlers()
+        self.loop_monitor.start()
+        logger.info(f"Runtime started on {type(self.loop).__module__.split('.')[0]} loop")
+
+        for component in self.components.values():
+            self._start(component)
+        reporter = self.loop.create_task(self._report()) if settings.stats_interval > 0 else None
+        try:
+            await self._stopping.wait()
+        finally:
+            if reporter:
+                reporter.cancel()
+            for component in reversed(list(self.components.values())):
+                await self._stop(component)
+            await self.loop_monitor.stop()
+            _runtime = None
+            logger.info("Runtime stopped")
+
+    def _install_signal_handlers(self) -> None:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.shutdown)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: Ctrl+C arrives as KeyboardInterrupt instead
+
+    def _task_factory(self, loop, coro, **kwargs):
+        """Tag every task with the component whose context created it"""
+        context = kwargs.get('context')
+        component = context.get(_component) if context is not None else _component.get()
+        if component is None:
+            return asyncio.Task(coro, loop=loop, **kwargs)
+        task = asyncio.Task(_TimedCoroutine(coro, component), loop=loop, **kwargs)
+        component.tasks.add(task)
+        return task
+
+    # --- Supervision ---------------------------------------------------
+
+    def _start(self, component: Component) -> None:
+        context = contextvars.copy_context()
+        context.run(_component.set, component)
+        component._task = context.run(
+            self.loop.create_task, self._supervise(component), name=f'component-{component.name}'
+        )
+
+    async def _supervise(self, component: Component) -> None:
+        delay = RESTART_BACKOFF[0]
+        while True:
+            component.state = 'running'
+            started = time.perf_counter()
+            try:
+                await component.serve()
+                component.state = 'finished'
+                logger.info(f"{component.name} finished")
+                return
+            except asyncio.CancelledError:
+                component.state = 'stopped'
+                raise
+            except Exception as e:
+                component.last_error = f"{type(e).__name__}: {e}"
+                if not component.restart:
+                    component.state = 'failed'
+                    logger.error(f"{component.name} failed: {component.last_error}")
+                    return
+                if time.perf_counter() - started > RESTART_BACKOFF[1]:
+                    delay = RESTART_BACKOFF[0]  # It ran for a while: not a crash loop
+                component.state = 'restarting'
+                logger.error(f"{component.name} failed: {component.last_error}; restarting in {delay:.0f} s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RESTART_BACKOFF[1])
+                component.restarts += 1
+
+    async def _stop(self, component: Component, timeout: float = 5.0) -> None:
+        task = component._task
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            logger.warning(f"{component.name} did not stop within {timeout:.0f} s")
+        except Exception as e:
+            logger.warning(f"{component.name} stop error: {e}")
+
+    async def restart(self, name: str) -> None:
+        """Stop a component and start it again"""
+        component = self.components[name]
+        await self._stop(component)
+        component.restarts += 1
+        self._start(component)
+
+    def shutdown(self) -> None:
+        """Stop all components and return from run() (thread-safe)"""
+        if self.loop and self._stopping:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+
+    # --- Cross-thread scheduling ------------------------------------------
+
+    def call_soon(self, callback: Callable, *args) -> None:
+        """Run a callback on the loop from any thread"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def submit(self, coro):
+        """Run a coroutine on the loop from any thread; returns a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # --- Statistics ----------------------------------------------------
+
+    def stats_threadsafe(self, timeout: float = 2.0) -> dict:
+        """stats() for callers on other threads (e.g. MJPEG handlers)"""
+        future = concurrent.futures.Future()
+
+        def collect():
+            try:
+                future.set_result(self.stats())
+            except Exception as e:
+                future.set_exception(e)
+
+        self.loop.call_soon_threadsafe(collect)
+        return future.result(timeout)
+
+    def stats(self) -> dict:
+        """Loop lag, task counts and CPU time per component (call on the loop)"""
+        now = time.perf_counter()
+        cpu = {}
+        components = {}
+        for component in self.components.values():
+            threads = component.threads_cpu()
+            cpu[component.name] = component.loop_cpu + (threads or 0.0)
+            components[component.name] = {
+                'state': component.state,
+                'restarts': component.restarts,
+                'last_error': component.last_error,
+                'tasks': sum(1 for task in list(component.tasks) if not task.done()),
+                'loop_cpu_s': round(component.loop_cpu, 3),
+                'threads_cpu_s': None if threads is None else round(threads, 3),
+            }
+        if self._last_sample:
+            then, last_cpu = self._last_sample
+            elapsed = now - then
+            for name, seconds in cpu.items():
+                if elapsed > 0:
+                    components[name]['cpu_percent'] = round((seconds - last_cpu.get(name, 0.0)) / elapsed * 100, 1)
+        self._last_sample = (now, cpu)
+        return {
+            'loop': type(self.loop).__module__.split('.')[0],
+            'uptime_s': round(now - self._started, 1),
+            'loop_lag': self.loop_monitor.stats(),
+            'loop_thread_cpu_s': round(time.thread_time(), 3),
+            'tasks': len(asyncio.all_tasks(self.loop)),
+            'threads': threading.active_count(),
+            # The loop's default executor serves every component (and aiortc's own encoder)
+            'executor_threads_cpu_s': _executor_cpu(),
+            'components': components,
+        }
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(settings.stats_interval)
+            stats = self.stats()
+            parts = ', '.join(
+                f"{name} {c['state']} {c['tasks']} tasks {c.get('cpu_percent', 0)}% cpu"
+                for name, c in stats['components'].items()
+            )
+            logger.info(
+                f"Runtime: lag avg {stats['loop_lag']['avg_ms']} ms max {stats['loop_lag']['max_ms']} ms, "
+                f"{stats['tasks']} tasks, {stats['threads']} threads | {parts}"
+            )
+
+
+def _executor_cpu() -> Optional[float]:
+    """CPU seconds of the default executor's threads (asyncio_N), where the platform can tell"""
+    if not hasattr(time, 'pthread_getcpuclockid'):
+        return None
+    return round(sum(
+        thread_cpu_time(thread) or 0.0
+        for thread in threading.enumerate() if thread.name.startswith('asyncio_')
+    ), 3)
+
+
+async def run_in_thread(func: Callable, *args, name: str) -> Any:
+    """Run a blocking function on a named thread and wait for it on the loop"""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def settle(result, error):
+        if not done.done():
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(result)
+
+    def target():
+        try:
+            result = func(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(settle, None, e)
+        else:
+            loop.call_soon_threadsafe(settle, result, None)
+
+    threading.Thread(target=target, name=name, daemon=True).start()
+    return await done
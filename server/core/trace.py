@@ -0,0 +1,126 @@
+# Pipeline tracing
+"""
+On-demand span tracer for finding which stage stalled. GET
+/debug/trace?seconds=N on a video server records for N seconds and returns
+Chrome trace-event JSON; open it in https://ui.perfetto.dev or
+chrome://tracing.
+
+Spans go into a bounded deque, whose append is atomic, so recording threads
+never take a lock. Call sites check `trace.enabled` first, so a disabled
+tracer costs one attribute read:
+
+    if trace.enabled:
+        trace.span('encode', 'webrtc', started, now(), frame=frame_id)
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from config.settings import settings
+from core.latency import now
+
+MAX_SECONDS = 30.0
+# Frame stage timestamps (core.latency.STAGES) name the stage they end
+SPAN_NAMES = {'transform': 'resize', 'send': 'write'}
+
+enabled = False
+_events = deque(maxlen=max(1000, settings.trace_buffer))
+_thread_names: Dict[int, str] = {}
+_control_lock = threading.Lock()
+_started_at = 0.0
+
+
+class TraceBusy(RuntimeError):
+    """Raised when a trace is already being recorded"""
+
+
+def span(name: str, cat: str, start: float, end: float, **args) -> None:
+    """Record a span between two core.latency.now() times on the calling thread"""
+    if not enabled:
+        return
+    tid = threading.get_ident()
+    if tid not in _thread_names:
+        _thread_names[tid] = threading.current_thread().name
+    _events.append((name, cat, start, end - start, tid, args))
+
+
+def stage_spans(cat: str, stages: Dict[str, float], start: Optional[float] = None, **args) -> None:
+    """Record a span per pipeline stage from a frame's stage timestamps"""
+    if not enabled:
+        return
+    previous = start
+    for stage, stamp in stages.items():
+        if previous is not None:
+            span(SPAN_NAMES.get(stage, stage), cat, previous, stamp, **args)
+        previous = stamp
+
+
+def start() -> None:
+    """Start recording (raises TraceBusy if a trace is running)"""
+    global enabled, _started_at
+    if not _control_lock.acquire(blocking=False):
+        raise TraceBusy("A trace is already being recorded")
+    _events.clear()
+    _started_at = now()
+    enabled = True
+
+
+def stop() -> dict:
+    """Stop recording and return the trace as Chrome trace-event JSON"""
+    global enabled
+    enabled = False
+    try:
+        return export(list(_events), _started_at)
+    finally:
+        _control_lock.release()
+
+
+def export(events: List[tuple], origin: float) -> dict:
+    pid = os.getpid()
+    trace_events = [{
+        'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+        'args': {'name': 'Cloud Game Server'},
+    }]
+    for tid, name in list(_thread_names.items()):
+        trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+    for name, cat, start_ts, duration, tid, args in events:
+        event = {
+            'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': round((start_ts - origin) * 1e6, 3),
+            'dur': round(max(0.0, duration) * 1e6, 3),
+        }
+        if args:
+            event['args'] = args
+        trace_events.append(event)
+    return {
+        'traceEvents': trace_events,
+        'displayTimeUnit': 'ms',
+        'otherData': {'events': len(events), 'buffer': _events.maxlen, 'recorded_at': time.time()},
+    }
+
+
+def _clamp(seconds: float) -> float:
+    return max(0.1, min(MAX_SECONDS, seconds))
+
+
+def record(seconds: float) -> dict:
+    """Trace for `seconds` on the calling thread (blocking)"""
+    start()
+    try:
+        time.sleep(_clamp(seconds))
+    finally:
+        result = stop()
+    return result
+
+
+async def record_async(seconds: float) -> dict:
+    """Trace for `seconds` without blocking the event loop"""
+    start()
+    try:
+        await asyncio.sleep(_clamp(seconds))
+    finally:
+        result = stop()
+    return result
@@ -0,0 +1,502 @@
+# Virtual input device backends
+"""
+Backends create the virtual devices the input server drives:
+
+    vigem      vgamepad (ViGEmBus) Xbox 360 pads + pynput mouse   (Windows)
+    uinput     kernel uinput Xbox-style pads + relative mouse      (Linux)
+    recording  no devices; records every update                   (replay_input)
+
+INPUT_BACKEND picks one; 'auto' prefers uinput when /dev/uinput is
+writable, then vigem. The pynput mouse is the fallback for any backend
+without its own.
+
+Gamepad state uses the input server's conventions: button names from
+input.protocol.BUTTON_BITS, stick axes -1.0..1.0 with +y up, triggers 0..1.
+Changes are buffered until update(), which pushes them to the device in
+one call.
+"""
+import abc
+import os
+import struct
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config.settings import settings
+from utils.log import get_logger
+
+logger = get_logger('input')
+
+try:
+    import vgamepad as vg
+    VGAMEPAD_AVAILABLE = True
+except ImportError:
+    VGAMEPAD_AVAILABLE = False
+
+try:
+    from pynput.mouse import Controller as MouseController
+    PYNPUT_AVAILABLE = True
+except ImportError:
+    PYNPUT_AVAILABLE = False
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+UINPUT_PATH = '/dev/uinput'
+
+
+class VirtualGamepad(abc.ABC):
+    """Interface of a virtual Xbox-style controller"""
+
+    @abc.abstractmethod
+    def set_sticks(self, left: Dict[str, float], right: Dict[str, float]) -> None:
+        ...
+
+    @abc.abstractmethod
+    def set_button(self, button: str, pressed: bool) -> None:
+        ...
+
+    @abc.abstractmethod
+    def set_trigger(self, trigger: str, value: float) -> None:
+        """Set 'LT' or 'RT' to 0.0..1.0"""
+
+    @abc.abstractmethod
+    def reset(self) -> None:
+        ...
+
+    @abc.abstractmethod
+    def update(self) -> None:
+        """Push buffered changes to the device"""
+
+    def close(self) -> None:
+        pass
+
+
+class VirtualMouse(abc.ABC):
+    """Interface of a virtual relative mouse"""
+
+    @abc.abstractmethod
+    def move(self, dx: int, dy: int) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class InputBackend:
+    """Creates virtual devices; None means the device type is unavailable"""
+    name = 'none'
+    setup_hint = ''
+
+    def create_gamepad(self, index: int) -> Optional[VirtualGamepad]:
+        return None
+
+    def create_mouse(self) -> Optional[VirtualMouse]:
+        return PynputMouse() if PYNPUT_AVAILABLE else None
+
+
+# --- pynput mouse -----------------------------------------------------------
+
+class PynputMouse(VirtualMouse):
+    """Mouse via pynput (SendInput on Windows, X11 on Linux)"""
+
+    def __init__(self):
+        self._mouse = MouseController()
+
+    def move(self, dx: int, dy: int) -> None:
+        self._mouse.move(dx, dy)
+
+
+# --- ViGEmBus (vgamepad) ----------------------------------------------------
+
+class ViGEmGamepad(VirtualGamepad):
+    """Xbox 360 pad through vgamepad; update() sends one report"""
+
+    def __init__(self):
+        self._pad = vg.VX360Gamepad()
+        self._buttons = {
+            'A': vg.XUSB_BUTTON.XUSB_GAMEPAD_A,
+            'B': vg.XUSB_BUTTON.XUSB_GAMEPAD_B,
+            'X': vg.XUSB_BUTTON.XUSB_GAMEPAD_X,
+            'Y': vg.XUSB_BUTTON.XUSB_GAMEPAD_Y,
+            'LB': vg.XUSB_BUTTON.XUSB_GAMEPAD_LEFT_SHOULDER,
+            'RB': vg.XUSB_BUTTON.XUSB_GAMEPAD_RIGHT_SHOULDER,
+            'START': vg.XUSB_BUTTON.XUSB_GAMEPAD_START,
+            'SELECT': vg.XUSB_BUTTON.XUSB_GAMEPAD_BACK,
+            'D_UP': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_UP,
+            'D_DOWN': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_DOWN,
+            'D_LEFT': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_LEFT,
+            'D_RIGHT': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_RIGHT,
+        }
+
+    def set_sticks(self, left, right):
+        self._pad.left_joystick_float(x_value_float=left['x'], y_value_float=left['y'])
+        self._pad.right_joystick_float(x_value_float=right['x'], y_value_float=right['y'])
+
+    def set_button(self, button, pressed):
+        xbox_button = self._buttons.get(button)
+        if xbox_button is None:
+            return
+        if pressed:
+            self._pad.press_button(button=xbox_button)
+        else:
+            self._pad.release_button(button=xbox_button)
+
+    def set_trigger(self, trigger, value):
+        value = int(max(0.0, min(1.0, value)) * 255)
+        if trigger == 'LT':
+            self._pad.left_trigger(value=value)
+        else:
+            self._pad.right_trigger(value=value)
+
+    def reset(self):
+        self._pad.reset()
+
+    def update(self):
+        self._pad.update()
+
+
+class ViGEmBackend(InputBackend):
+    name = 'vigem'
+    setup_hint = "Install ViGEmBus driver from: https://github.com/ViGEm/ViGEmBus/releases"
+
+    def create_gamepad(self, index):
+        try:
+            return ViGEmGamepad()
+        except Exception as e:
+            logger.error(f"✗ Failed to create virtual gamepad: {e}")
+            return None
+
+
+# --- Linux uinput -----------------------------------------------------------
+
+def _ioc(direction: int, nr: int, size: int) -> int:
+    """Linux _IOC() for the uinput ('U') ioctl family"""
+    return (direction << 30) | (size << 16) | (ord('U') << 8) | nr
+
+# struct input_event (timeval is ignored by uinput), uinput_setup, uinput_abs_setup
+INPUT_EVENT = struct.Struct('llHHi')
+UINPUT_SETUP = struct.Struct('HHHH80sI')
+UINPUT_ABS_SETUP = struct.Struct('H2xiiiiii')
+
+_IOW = 1
+UI_DEV_CREATE = _ioc(0, 1, 0)
+UI_DEV_DESTROY = _ioc(0, 2, 0)
+UI_DEV_SETUP = _ioc(_IOW, 3, UINPUT_SETUP.size)
+UI_ABS_SETUP = _ioc(_IOW, 4, UINPUT_ABS_SETUP.size)
+UI_SET_EVBIT = _ioc(_IOW, 100, 4)
+UI_SET_KEYBIT = _ioc(_IOW, 101, 4)
+UI_SET_RELBIT = _ioc(_IOW, 102, 4)
+UI_SET_ABSBIT = _ioc(_IOW, 103, 4)
+
+EV_SYN, EV_KEY, EV_REL, EV_ABS = 0x00, 0x01, 0x02, 0x03
+SYN_REPORT = 0
+REL_X, REL_Y = 0x00, 0x01
+BTN_LEFT, BTN_RIGHT, BTN_MIDDLE = 0x110, 0x111, 0x112
+ABS_X, ABS_Y, ABS_Z, ABS_RX, ABS_RY, ABS_RZ = 0x00, 0x01, 0x02, 0x03, 0x04, 0x05
+ABS_HAT0X, ABS_HAT0Y = 0x10, 0x11
+BUS_USB = 0x03
+
+# Same codes and ranges as the kernel xpad driver, so SDL/Steam map it like a real pad
+XPAD_BUTTONS = {
+    'A': 0x130,       # BTN_SOUTH
+    'B': 0x131,       # BTN_EAST
+    'X': 0x133,       # BTN_NORTH
+    'Y': 0x134,       # BTN_WEST
+    'LB': 0x136,      # BTN_TL
+    'RB': 0x137,      # BTN_TR
+    'SELECT': 0x13a,  # BTN_SELECT
+    'START': 0x13b,   # BTN_START
+}
+XPAD_MODE_BUTTONS = (0x13c, 0x13d, 0x13e)  # BTN_MODE, BTN_THUMBL, BTN_THUMBR (advertised only)
+XPAD_ABS = {
+    ABS_X: (-32768, 32767, 16, 128),  # (min, max, fuzz, flat)
+    ABS_Y: (-32768, 32767, 16, 128),
+    ABS_RX: (-32768, 32767, 16, 128),
+    ABS_RY: (-32768, 32767, 16, 128),
+    ABS_Z: (0, 255, 0, 0),
+    ABS_RZ: (0, 255, 0, 0),
+    ABS_HAT0X: (-1, 1, 0, 0),
+    ABS_HAT0Y: (-1, 1, 0, 0),
+}
+DPAD_HAT = {
+    'D_LEFT': (ABS_HAT0X, -1), 'D_RIGHT': (ABS_HAT0X, 1),
+    'D_UP': (ABS_HAT0Y, -1), 'D_DOWN': (ABS_HAT0Y, 1),
+}
+
+
+def _axis(value: float) -> int:
+    return int(round(max(-1.0, min(1.0, value)) * 32767))
+
+
+class UInputDevice:
+    """A uinput device; writes batches of events with a single write()"""
+
+    def __init__(self, name: str, vendor: int, product: int, version: int,
+                 keys=(), rels=(), abs_axes: Optional[Dict[int, tuple]] = None):
+        self.fd = os.open(UINPUT_PATH, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            if keys:
+                fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_KEY)
+                for code in keys:
+                    fcntl.ioctl(self.fd, UI_SET_KEYBIT, code)
+            if rels:
+                fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_REL)
+                for code in rels:
+                    fcntl.ioctl(self.fd, UI_SET_RELBIT, code)
+            if abs_axes:
+                fcntl.ioctl(self.fd, UI_SET_EVBIT, EV_ABS)
+                for code, (minimum, maximum, fuzz, flat) in abs_axes.items():
+                    fcntl.ioctl(self.fd, UI_SET_ABSBIT, code)
+                    fcntl.ioctl(self.fd, UI_ABS_SETUP, UINPUT_ABS_SETUP.pack(
+                        code, 0, minimum, maximum, fuzz, flat, 0
+                    ))
+            fcntl.ioctl(self.fd, UI_DEV_SETUP, UINPUT_SETUP.pack(
+                BUS_USB, vendor, product, version, name.encode()[:79], 0
+            ))
+            fcntl.ioctl(self.fd, UI_DEV_CREATE)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def write_events(self, events: List[Tuple[int, int, int]]) -> None:
+        """Write (type, code, value) events plus SYN_REPORT in one syscall"""
+        events.append((EV_SYN, SYN_REPORT, 0))
+        os.write(self.fd, b''.join(INPUT_EVENT.pack(0, 0, *event) for event in events))
+
+    def close(self) -> None:
+        if self.fd is not None:
+            try:
+                fcntl.ioctl(self.fd, UI_DEV_DESTROY)
+            finally:
+                os.close(self.fd)
+                self.fd = None
+
+
+class UInputGamepad(VirtualGamepad):
+    """
+    Xbox 360-style pad on uinput. Changes are diffed against the last state
+    written and sent as one batch ending in SYN_REPORT.
+    """
+
+    def __init__(self, index: int):
+        self.device = UInputDevice(
+            'Microsoft X-Box 360 pad', 0x045e, 0x028e, 0x0110,
+            keys=list(XPAD_BUTTONS.values()) + list(XPAD_MODE_BUTTONS),
+            abs_axes=XPAD_ABS,
+        )
+        self._written: Dict[Tuple[int, int], int] = {}
+        self._state: Dict[Tuple[int, int], int] = {}
+        self._dpad = set()
+        self.reset()
+
+    def set_sticks(self, left, right):
+        # evdev Y grows downwards
+        self._state[(EV_ABS, ABS_X)] = _axis(left['x'])
+        self._state[(EV_ABS, ABS_Y)] = -_axis(left['y'])
+        self._state[(EV_ABS, ABS_RX)] = _axis(right['x'])
+        self._state[(EV_ABS, ABS_RY)] = -_axis(right['y'])
+
+    def set_button(self, button, pressed):
+        code = XPAD_BUTTONS.get(button)
+        if code is not None:
+            self._state[(EV_KEY, code)] = 1 if pressed else 0
+        elif button in DPAD_HAT:
+            if pressed:
+                self._dpad.add(button)
+            else:
+                self._dpad.discard(button)
+            self._update_hats()
+
+    def _update_hats(self):
+        hats = {ABS_HAT0X: 0, ABS_HAT0Y: 0}
+        for button in self._dpad:
+            code, value = DPAD_HAT[button]
+            hats[code] += value
+        for code, value in hats.items():
+            self._state[(EV_ABS, code)] = value
+
+    def set_trigger(self, trigger, value):
+        code = ABS_Z if trigger == 'LT' else ABS_RZ
+        self._state[(EV_ABS, code)] = int(max(0.0, min(1.0, value)) * 255)
+
+    def reset(self):
+        self._dpad.clear()
+        for code in XPAD_BUTTONS.values():
+            self._state[(EV_KEY, code)] = 0
+        for code in XPAD_ABS:
+            self._state[(EV_ABS, code)] = 0
+
+    def update(self):
+        events = [
+            (ev_type, code, value) for (ev_type, code), value in self._state.items()
+            if self._written.get((ev_type, code)) != value
+        ]
+        if not events:
+            return
+        self.device.write_events(events)
+        self._written.update(self._state)
+
+    def close(self):
+        self.device.close()
+
+
+class UInputMouse(VirtualMouse):
+    """Relative mouse on uinput; each move is one write"""
+
+    def __init__(self):
+        self.device = UInputDevice(
+            'Cloud Game Server mouse', 0x1209, 0x0001, 1,
+            keys=(BTN_LEFT, BTN_RIGHT, BTN_MIDDLE),  # Needed to be classified as a mouse
+            rels=(REL_X, REL_Y),
+        )
+
+    def move(self, dx, dy):
+        events = []
+        if dx:
+            events.append((EV_REL, REL_X, dx))
+        if dy:
+            events.append((EV_REL, REL_Y, dy))
+        if events:
+            self.device.write_events(events)
+
+    def close(self):
+        self.device.close()
+
+
+class UInputBackend(InputBackend):
+    name = 'uinput'
+    setup_hint = "Give the server write access to /dev/uinput (e.g. the 'input' group or a udev rule)"
+
+    def create_gamepad(self, index):
+        try:
+            return UInputGamepad(index)
+        except OSError as e:
+            logger.error(f"✗ Failed to create uinput gamepad: {e}")
+            return None
+
+    def create_mouse(self):
+        try:
+            return UInputMouse()
+        except OSError as e:
+            logger.warning(f"uinput mouse unavailable ({e}), falling back to pynput")
+            return super().create_mouse()
+
+
+# --- Recording (tests) ------------------------------------------------------
+
+class RecordingGamepad(VirtualGamepad):
+    """Keeps the pad state in memory and records a snapshot per update"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.buttons = set()
+        self.sticks = {'left': (0.0, 0.0), 'right': (0.0, 0.0)}
+        self.triggers = {'LT': 0.0, 'RT': 0.0}
+        self.updates: List[dict] = []
+
+    def set_sticks(self, left, right):
+        self.sticks = {'left': (left['x'], left['y']), 'right': (right['x'], right['y'])}
+
+    def set_button(self, button, pressed):
+        if pressed:
+            self.buttons.add(button)
+        else:
+            self.buttons.discard(button)
+
+    def set_trigger(self, trigger, value):
+        self.triggers[trigger] = value
+
+    def reset(self):
+        self.buttons.clear()
+        self.sticks = {'left': (0.0, 0.0), 'right': (0.0, 0.0)}
+        self.triggers = {'LT': 0.0, 'RT': 0.0}
+
+    def update(self):
+        self.updates.append({
+            'buttons': sorted(self.buttons),
+            'sticks': dict(self.sticks),
+            'triggers': dict(self.triggers),
+        })
+
+
+class RecordingMouse(VirtualMouse):
+    def __init__(self):
+        self.moves: List[Tuple[int, int]] = []
+
+    def move(self, dx, dy):
+        self.moves.append((dx, dy))
+
+
+class RecordingBackend(InputBackend):
+    """Creates in-memory devices, so input handling runs without drivers"""
+    name = 'recording'
+
+    def __init__(self):
+        self.gamepads: List[RecordingGamepad] = []
+        self.mouse: Optional[RecordingMouse] = None
+
+    def create_gamepad(self, index):
+        gamepad = RecordingGamepad(index)
+        self.gamepads.append(gamepad)
+        return gamepad
+
+    def create_mouse(self):
+        self.mouse = RecordingMouse()
+        return self.mouse
+
+
+# --- Selection --------------------------------------------------------------
+
+BACKENDS = {
+    'vigem': ViGEmBackend,
+    'uinput': UInputBackend,
+    'recording': RecordingBackend,
+    'none': InputBackend,
+}
+
+_backend: Optional[InputBackend] = None
+_backend_lock = threading.Lock()
+
+
+def _uinput_usable() -> bool:
+    return sys.platform.startswith('linux') and FCNTL_AVAILABLE and os.access(UINPUT_PATH, os.W_OK)
+
+
+def get_backend() -> InputBackend:
+    """The process-wide backend chosen by settings.input_backend"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend(settings.input_backend)
+            logger.info(f"Input backend: {_backend.name}")
+        return _backend
+
+
+def set_backend(backend: InputBackend) -> None:
+    """Replace the process-wide backend (before any controller is opened)"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def create_backend(name: str) -> InputBackend:
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        if _uinput_usable():
+            name = 'uinput'
+        elif VGAMEPAD_AVAILABLE:
+            name = 'vigem'
+        else:
+            logger.warning("No virtual gamepad backend: install vgamepad (Windows) or allow /dev/uinput (Linux)")
+            name = 'none'
+    if name == 'vigem' and not VGAMEPAD_AVAILABLE:
+        logger.warning("vgamepad not installed. Run: pip install vgamepad")
+        name = 'none'
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError(f"Unknown input backend: {name}")
+    return backend_class()
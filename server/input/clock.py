@@ -0,0 +1,187 @@
+# Input clock sync and latency histograms
+"""
+NTP-style clock sync and per-client input latency statistics.
+
+Times on the wire are milliseconds. Server times are core.latency.now() in
+ms (monotonic); client times are the client's own clock (performance.now()
+in the browser). The offset is client minus server time.
+
+Handshake, started by the server and repeated every INPUT_SYNC_INTERVAL:
+    server -> {"type": "ping", "t0": server send}
+    client -> {"type": "pong", "t0": ..., "t1": client receive, "t2": client send}
+    server -> {"type": "sync", "offset_ms": ..., "rtt_ms": ...}
+
+Input may carry its client send time ("t" in JSON, a CLIENT_TIME record in
+binary packets). Once the change reaches the virtual device the server
+answers {"type": "ack", "t": ..., "recv": ..., "inject": ..., "n": ...},
+where n is how many stamped messages that device update covered.
+"""
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from core.latency import now, percentile
+
+# Histogram bucket upper bounds in ms; the last bucket is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def server_ms(timestamp: Optional[float] = None) -> float:
+    """Server clock in milliseconds"""
+    return (now() if timestamp is None else timestamp) * 1000.0
+
+
+class RollingHistogram:
+    """Latency samples over a rolling window, summarized as percentiles and buckets"""
+
+    def __init__(self, window: int = 1000):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, value_ms: float) -> None:
+        with self._lock:
+            self._values.append(value_ms)
+            self.count += 1
+
+    def summary(self) -> Optional[dict]:
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        buckets = {f'<={bound}': 0 for bound in BUCKETS_MS}
+        buckets[f'>{BUCKETS_MS[-1]}'] = 0
+        for value in values:
+            for bound in BUCKETS_MS:
+                if value <= bound:
+                    buckets[f'<={bound}'] += 1
+                    break
+            else:
+                buckets[f'>{BUCKETS_MS[-1]}'] += 1
+        return {
+            'samples': self.count,
+            'p50_ms': round(percentile(values, 50), 2),
+            'p95_ms': round(percentile(values, 95), 2),
+            'p99_ms': round(percentile(values, 99), 2),
+            'max_ms': round(values[-1], 2),
+            'buckets': buckets,
+        }
+
+
+class ClockSync:
+    """
+    Clock offset from ping/pong exchanges. Like NTP, the offset comes from
+    the recent sample with the lowest RTT, since queueing delay makes the
+    two directions asymmetric and skews the estimate.
+    """
+
+    def __init__(self, window: int = 8):
+        self._samples = deque(maxlen=window)  # (rtt, offset)
+        self.offset: Optional[float] = None
+        self.rtt: Optional[float] = None
+
+    def add_sample(self, t0: float, t1: float, t2: float, t3: float) -> Tuple[float, float]:
+        """Add an exchange (all ms): t0/t3 server send/receive, t1/t2 client receive/send"""
+        rtt = max(0.0, (t3 - t0) - (t2 - t1))
+        offset = ((t1 - t0) + (t2 - t3)) / 2.0
+        self._samples.append((rtt, offset))
+        self.rtt, self.offset = min(self._samples)
+        return rtt, offset
+
+    @property
+    def synced(self) -> bool:
+        return self.offset is not None
+
+
+class ClientLatency:
+    """Clock sync state and latency histograms for one input connection"""
+
+    def __init__(self, client: str):
+        self.client = client
+        self.clock = ClockSync()
+        self.rtt = RollingHistogram()
+        self.uplink = RollingHistogram()   # Client send -> server receive (needs clock sync)
+        self.inject = RollingHistogram()   # Server receive -> virtual device updated
+        self.total = RollingHistogram()    # Client send -> virtual device updated
+
+    def ping_message(self) -> dict:
+        return {'type': 'ping', 't0': server_ms()}
+
+    def handle_pong(self, data: dict, received: float) -> Optional[dict]:
+        """Add a pong received at server time `received`; returns the sync reply"""
+        try:
+            t0, t1, t2 = float(data['t0']), float(data['t1']), float(data['t2'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        rtt, _ = self.clock.add_sample(t0, t1, t2, server_ms(received))
+        self.rtt.add(rtt)
+        return {
+            'type': 'sync',
+            'offset_ms': round(self.clock.offset, 3),
+            'rtt_ms': round(self.clock.rtt, 3),
+        }
+
+    def to_server_ms(self, client_time: float) -> Optional[float]:
+        """Convert a client timestamp to server ms, once the clock is synced"""
+        if not self.clock.synced:
+            return None
+        return client_time - self.clock.offset
+
+    def on_received(self, client_time: float, received: float) -> None:
+        """Record the uplink delay of a stamped message"""
+        sent = self.to_server_ms(client_time)
+        if sent is not None:
+            self.uplink.add(max(0.0, server_ms(received) - sent))
+
+    def on_injected(self, acks: List[Tuple[float, float]], injected: float) -> dict:
+        """
+        Record stamped messages covered by one device update and build the
+        ack. `acks` holds (client time, server receive time) pairs.
+        """
+        inject_ms = server_ms(injected)
+        for client_time, received in acks:
+            self.inject.add(inject_ms - server_ms(received))
+            sent = self.to_server_ms(client_time)
+            if sent is not None:
+                self.total.add(max(0.0, inject_ms - sent))
+        client_time, received = acks[-1]
+        return {
+            'type': 'ack',
+            't': client_time,
+            'recv': round(server_ms(received), 3),
+            'inject': round(inject_ms, 3),
+            'n': len(acks),
+        }
+
+    def summary(self) -> dict:
+        return {
+            'clock_offset_ms': None if self.clock.offset is None else round(self.clock.offset, 3),
+            'rtt': self.rtt.summary(),
+            'uplink': self.uplink.summary(),
+            'inject': self.inject.summary(),
+            'total': self.total.summary(),
+        }
+
+
+# Connected clients, for stats endpoints
+_clients: Dict[str, ClientLatency] = {}
+_clients_lock = threading.Lock()
+
+
+def register_client(client: str) -> ClientLatency:
+    latency = ClientLatency(client)
+    with _clients_lock:
+        _clients[client] = latency
+    return latency
+
+
+def unregister_client(client: str) -> None:
+    with _clients_lock:
+        _clients.pop(client, None)
+
+
+def clients_summary() -> dict:
+    """Latency statistics of every connected input client"""
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {latency.client: latency.summary() for latency in clients}
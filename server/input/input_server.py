@@ -1,6 +1,7 @@
 import asyncio
 import websockets
 import json
+import logging
 import os
 import time
 import threading
@@ -8,108 +9,34 @@ import socket
 import qrcode
 import sys
 from dotenv import load_dotenv
-from pynput.mouse import Controller as MouseController
 
 # Add parent directory to path for modular imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Try to import vgamepad for virtual controller
-try:
-    import vgamepad as vg
-    VGAMEPAD_AVAILABLE = True
-except ImportError:
-    VGAMEPAD_AVAILABLE = False
-    print("WARNING: vgamepad not installed. Run: pip install vgamepad")
+from config.settings import settings
+from core import trace
+from core.latency import latency_tracker, now
+from core.metrics import CLIENTS, INPUT_MESSAGES, INPUT_RATE, QUEUE_DEPTH
+from input.backends import get_backend
+from input.clock import register_client, unregister_client
+from input.jitter import JitterBuffer
+from input.protocol import BUTTON_BITS, BinaryDecoder, ProtocolError
+from input.recorder import open_recorder
+from utils.log import get_logger, setup_logging
+
+logger = get_logger('input')
+stick_logger = get_logger('input.stick')
+button_logger = get_logger('input.button')
 
 load_dotenv()
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('WS_PORT', 8765))
 
-# Virtual Xbox controller
-gamepad = None
-mouse = MouseController()
-
-def init_gamepad():
-    global gamepad
-    if VGAMEPAD_AVAILABLE:
-        try:
-            gamepad = vg.VX360Gamepad()
-            print("✓ Virtual Xbox 360 Controller initialized!")
-            return True
-        except Exception as e:
-            print(f"✗ Failed to create virtual gamepad: {e}")
-            print("  Try installing ViGEmBus driver: https://github.com/ViGEm/ViGEmBus/releases")
-            return False
-    return False
-
-# Stick state for continuous updates
-left_stick = {'x': 0.0, 'y': 0.0}
-right_stick = {'x': 0.0, 'y': 0.0}  # For mouse movement
+MAX_CONTROLLERS = 4  # XInput supports four pads
+mouse = None  # Virtual mouse from the input backend, created by start_update_thread()
 gamepad_thread_running = True
-mouse_sensitivity = 20  # Pixels per update at max stick deflection
-
-def gamepad_update_thread():
-    """Background thread to continuously update gamepad and mouse"""
-    global gamepad_thread_running
-    while gamepad_thread_running:
-        # Update Xbox controller sticks
-        if gamepad:
-            try:
-                # Left stick (movement)
-                gamepad.left_joystick_float(
-                    x_value_float=left_stick['x'],
-                    y_value_float=left_stick['y']
-                )
-                # Right stick (camera) - also send to virtual controller
-                gamepad.right_joystick_float(
-                    x_value_float=right_stick['x'],
-                    y_value_float=right_stick['y']
-                )
-                gamepad.update()
-            except Exception as e:
-                print(f"Gamepad update error: {e}")
-        
-        # Also move mouse for right stick (backup camera control)
-        if right_stick['x'] != 0 or right_stick['y'] != 0:
-            dx = int(right_stick['x'] * mouse_sensitivity)
-            dy = int(right_stick['y'] * mouse_sensitivity)
-            if dx != 0 or dy != 0:
-                mouse.move(dx, dy)
-        
-        time.sleep(0.016)  # ~60 FPS
-
-def handle_left_stick(x, y):
-    """Handle movement stick - Xbox left stick"""
-    # Invert Y so pushing UP on joystick = forward in game
-    left_stick['x'] = max(-1.0, min(1.0, x))
-    left_stick['y'] = max(-1.0, min(1.0, -y))  # Invert Y: up = forward
-    if abs(x) > 0.1 or abs(y) > 0.1:
-        print(f"Left Stick: x={x:.2f}, y={-y:.2f}")
-
-def handle_right_stick(x, y):
-    """Handle camera stick - Xbox right stick + Mouse"""
-    right_stick['x'] = max(-1.0, min(1.0, x))
-    right_stick['y'] = max(-1.0, min(1.0, y))  # Non-inverted Y: Up = Up (Negative delta for mouse)
-    if abs(x) > 0.1 or abs(y) > 0.1:
-        print(f"Right Stick: x={x:.2f}, y={y:.2f}")
-
-# Button mapping to Xbox 360 buttons
-BUTTON_MAP = {}
-if VGAMEPAD_AVAILABLE:
-    BUTTON_MAP = {
-        'A': vg.XUSB_BUTTON.XUSB_GAMEPAD_A,
-        'B': vg.XUSB_BUTTON.XUSB_GAMEPAD_B,
-        'X': vg.XUSB_BUTTON.XUSB_GAMEPAD_X,
-        'Y': vg.XUSB_BUTTON.XUSB_GAMEPAD_Y,
-        'LB': vg.XUSB_BUTTON.XUSB_GAMEPAD_LEFT_SHOULDER,
-        'RB': vg.XUSB_BUTTON.XUSB_GAMEPAD_RIGHT_SHOULDER,
-        'START': vg.XUSB_BUTTON.XUSB_GAMEPAD_START,
-        'SELECT': vg.XUSB_BUTTON.XUSB_GAMEPAD_BACK,
-        'D_UP': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_UP,
-        'D_DOWN': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_DOWN,
-        'D_LEFT': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_LEFT,
-        'D_RIGHT': vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_RIGHT,
-    }
+mouse_sensitivity = 20  # Pixels per 16 ms at max stick deflection
+mouse_rate = max(1, min(1000, settings.mouse_rate))  # Mouse ticks per second
 
 DPAD_TO_BUTTON = {
     'up': 'D_UP',
@@ -123,95 +50,443 @@ DPAD_TO_BUTTON = {
     'RIGHT': 'D_RIGHT',
 }
 
-def handle_button(button, pressed):
-    """Handle button press/release"""
-    if not gamepad:
-        print(f"Button {button}: {'Pressed' if pressed else 'Released'} (no gamepad)")
+
+class ControllerSlot:
+    """
+    One player's virtual Xbox controller and stick state. Each slot has its
+    own lock and update thread, so players never wait on each other.
+    Handlers change state and wake the thread, which writes the device once
+    per wake-up (a burst of messages becomes a single update). The device
+    comes from the input backend (input.backends). With INPUT_JITTER_BUFFER,
+    stamped stick samples wait in a JitterBuffer and the thread applies
+    them when they fall due.
+    Player 1 (slot 0) also drives the mouse from its right stick.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.gamepad = None
+        self.client = None  # Connection holding the slot, None when free
+        self.left_stick = {'x': 0.0, 'y': 0.0}
+        self.right_stick = {'x': 0.0, 'y': 0.0}
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._pending_since = None  # Arrival time of the oldest change not yet on the device
+        self._pending_acks = []     # (client time, receive time) of stamped changes not yet on the device
+        self.on_inject = None       # Called from the update thread with (acks, inject time)
+        self.jitter = JitterBuffer(f'player{self.player}', settings.input_jitter_max_ms) if settings.input_jitter_buffer else None
+        self._thread = None
+
+    @property
+    def player(self) -> int:
+        return self.index + 1
+
+    def open(self) -> bool:
+        """Plug in the virtual pad; it stays plugged in for the next player"""
+        if self.gamepad is not None:
+            return True
+        backend = get_backend()
+        self.gamepad = backend.create_gamepad(self.index)
+        if self.gamepad is None:
+            if backend.setup_hint:
+                logger.error(f"  {backend.setup_hint}")
+            return False
+        logger.info(f"✓ Virtual Xbox 360 Controller ({backend.name}) initialized for player {self.player}!")
+        return True
+
+    def start(self) -> None:
+        """Start the slot's update thread if it isn't running"""
+        if not (self._thread and self._thread.is_alive()):
+            self._thread = threading.Thread(
+                target=self._update_loop, name=f'gamepad-{self.player}', daemon=True
+            )
+            self._thread.start()
+
+    def _mark_dirty(self, arrived: float) -> None:
+        """Queue a device update for a change that arrived at `arrived`"""
+        with self._lock:
+            if self._pending_since is None:
+                self._pending_since = arrived
+        self._dirty.set()
+
+    def request_ack(self, client_time: float, received: float) -> None:
+        """Report a client-stamped change back through on_inject once it is on the device"""
+        with self._lock:
+            self._pending_acks.append((client_time, received))
+        self._dirty.set()
+
+    def buffer_stick(self, data: dict, client_time: float, received: float) -> None:
+        """Queue a stamped stick sample in the jitter buffer"""
+        if self.jitter.push(data, client_time, received):
+            self._dirty.set()  # New earliest sample: let the thread recompute its wait
+
+    def _release_buffered(self) -> None:
+        """Apply jitter-buffered stick samples that are due"""
+        for data, client_time, received in self.jitter.pop_due(now()):
+            handle_message(self, data)
+            self.request_ack(client_time, received)
+
+    def _update_loop(self) -> None:
+        """Push coalesced changes to the virtual gamepad"""
+        while gamepad_thread_running:
+            # Timeout so a stop request is noticed, or until a buffered sample is due
+            timeout = 0.5
+            if self.jitter:
+                due = self.jitter.next_due()
+                if due is not None:
+                    timeout = min(timeout, max(0.0, due - now()))
+            self._dirty.wait(timeout)
+            if self.jitter:
+                self._release_buffered()
+            if not self._dirty.is_set():
+                continue
+            self._dirty.clear()
+            with self._lock:
+                arrived, self._pending_since = self._pending_since, None
+                acks, self._pending_acks = self._pending_acks, []
+                if arrived is None and not acks:
+                    continue
+                if self.gamepad:
+                    self._write_device()
+            injected = now()
+            if arrived is not None and self.gamepad:
+                latency_tracker.record_latency('input_gamepad', arrived, injected)
+            if acks and self.on_inject:
+                try:
+                    self.on_inject(acks, injected)
+                except Exception as e:
+                    logger.warning(f"Input ack failed (player {self.player}): {e}")
+
+    def _write_device(self) -> None:
+        """Send the current stick state and report (call with the lock held)"""
+        started = now()
+        try:
+            # Left stick (movement), right stick (camera) - buttons were set by their handlers
+            self.gamepad.set_sticks(self.left_stick, self.right_stick)
+            self.gamepad.update()
+            if trace.enabled:
+                trace.span('inject', 'input', started, now(), player=self.player)
+        except Exception as e:
+            logger.warning(f"Gamepad update error (player {self.player}): {e}")
+
+    def handle_left_stick(self, x, y):
+        """Handle movement stick - Xbox left stick"""
+        arrived = now()
+        # Invert Y so pushing UP on joystick = forward in game
+        self.left_stick['x'] = max(-1.0, min(1.0, x))
+        self.left_stick['y'] = max(-1.0, min(1.0, -y))  # Invert Y: up = forward
+        self._mark_dirty(arrived)
+        if stick_logger.isEnabledFor(logging.DEBUG) and (abs(x) > 0.1 or abs(y) > 0.1):
+            stick_logger.debug(f"P{self.player} Left Stick: x={x:.2f}, y={-y:.2f}")
+
+    def handle_right_stick(self, x, y):
+        """Handle camera stick - Xbox right stick (+ mouse for player 1)"""
+        arrived = now()
+        self.right_stick['x'] = max(-1.0, min(1.0, x))
+        self.right_stick['y'] = max(-1.0, min(1.0, y))  # Non-inverted Y: Up = Up (Negative delta for mouse)
+        self._mark_dirty(arrived)
+        if self.index == 0:
+            update_mouse(self.right_stick, arrived)
+        if stick_logger.isEnabledFor(logging.DEBUG) and (abs(x) > 0.1 or abs(y) > 0.1):
+            stick_logger.debug(f"P{self.player} Right Stick: x={x:.2f}, y={y:.2f}")
+
+    def handle_button(self, button, pressed):
+        """Handle button press/release"""
+        if not self.gamepad:
+            button_logger.debug("P%d Button %s: %s (no gamepad)", self.player, button, 'Pressed' if pressed else 'Released')
+            return
+        
+        arrived = now()
+        
+        # Handle triggers separately (they are analog)
+        if button in ('LT', 'RT'):
+            value = 1.0 if pressed else 0.0
+            with self._lock:
+                self.gamepad.set_trigger(button, value)
+            button_logger.debug("P%d %s: %.1f", self.player, button, value)
+            self._mark_dirty(arrived)
+            return
+        
+        # Regular buttons
+        if button in BUTTON_BITS:
+            with self._lock:
+                self.gamepad.set_button(button, pressed)
+            button_logger.debug("P%d Button %s: %s", self.player, button, 'Pressed' if pressed else 'Released')
+            self._mark_dirty(arrived)
+
+    def handle_dpad(self, direction, pressed):
+        """Handle D-pad"""
+        button = DPAD_TO_BUTTON.get(direction)
+        if button:
+            self.handle_button(button, pressed)
+
+    def reset(self):
+        """Reset this controller's inputs to neutral"""
+        if self.index == 0:
+            stop_mouse()
+        if self.jitter:
+            self.jitter.clear()
+        with self._lock:
+            self.left_stick.update(x=0.0, y=0.0)
+            self.right_stick.update(x=0.0, y=0.0)
+            if self.gamepad:
+                try:
+                    self.gamepad.reset()
+                    self.gamepad.update()
+                except Exception as e:
+                    logger.warning(f"Gamepad reset error (player {self.player}): {e}")
+
+
+# Controller slots; index = player number - 1
+slots = [ControllerSlot(i) for i in range(MAX_CONTROLLERS)]
+_slots_lock = threading.Lock()
+CLIENTS.callbacks.append(lambda: {'input': sum(1 for slot in slots if slot.client is not None)})
+QUEUE_DEPTH.callbacks.append(lambda: {'input_jitter': sum(slot.jitter.queued for slot in slots if slot.jitter)})
+
+def init_gamepad():
+    """Plug in player 1's pad up front so games see a controller at launch"""
+    return slots[0].open()
+
+def acquire_slot(client: str):
+    """Give a connection the lowest free controller slot, or None if all are taken"""
+    with _slots_lock:
+        for slot in slots:
+            if slot.client is None:
+                slot.client = client
+                break
+        else:
+            return None
+    slot.open()
+    slot.start()
+    logger.info(f"Player {slot.player} assigned to {client}")
+    return slot
+
+def release_slot(slot):
+    """Reset a connection's controller and free its slot; other players are untouched"""
+    if slot is None or slot.client is None:
         return
+    slot.reset()
+    logger.info(f"Player {slot.player} released by {slot.client}")
+    with _slots_lock:
+        slot.client = None
+
+# Right-stick mouse motion (player 1), on its own high-rate ticker
+_mouse_stick = {'x': 0.0, 'y': 0.0}
+_mouse_active = threading.Event()
+_mouse_pending_since = None  # Arrival time of the right stick change not yet moved
+
+def update_mouse(stick, arrived):
+    """Start or stop mouse motion for a new right stick position"""
+    global _mouse_pending_since
+    _mouse_stick.update(stick)
+    deflected = (abs(stick['x']) * mouse_sensitivity >= 1 or abs(stick['y']) * mouse_sensitivity >= 1)
+    if deflected:
+        if _mouse_pending_since is None:
+            _mouse_pending_since = arrived
+        _mouse_active.set()
+    else:
+        stop_mouse()
+
+def stop_mouse():
+    """Stop mouse motion"""
+    global _mouse_pending_since
+    _mouse_active.clear()
+    _mouse_pending_since = None
+
+def mouse_update_thread():
+    """
+    Move the mouse from player 1's right stick (backup camera control) at
+    `mouse_rate` Hz while it is deflected; idle otherwise. Speed matches
+    the old 60 Hz loop, with sub-pixel remainders carried between ticks.
+    """
+    global _mouse_pending_since
+    while gamepad_thread_running:
+        if not _mouse_active.wait(0.5):
+            continue
+        interval = 1.0 / mouse_rate
+        step = mouse_sensitivity * 60.0 / mouse_rate
+        carry_x = carry_y = 0.0
+        next_tick = now()
+        while gamepad_thread_running and _mouse_active.is_set():
+            carry_x += _mouse_stick['x'] * step
+            carry_y += _mouse_stick['y'] * step
+            dx, dy = int(carry_x), int(carry_y)
+            if dx or dy:
+                carry_x -= dx
+                carry_y -= dy
+                try:
+                    mouse.move(dx, dy)
+                except Exception as e:
+                    logger.warning(f"Mouse move error: {e}")
+                arrived, _mouse_pending_since = _mouse_pending_since, None
+                if arrived is not None:
+                    latency_tracker.record_latency('input_mouse', arrived)
+            # Sleep to an absolute deadline so ticks don't drift; time.sleep is
+            # high resolution on Linux and on Windows since Python 3.11
+            next_tick += interval
+            delay = next_tick - now()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = now()  # Fell behind: skip missed ticks instead of bursting
+
+_mouse_thread = None
+
+def start_update_thread():
+    """Start the mouse thread and the update threads of occupied slots"""
+    global _mouse_thread, gamepad_thread_running, mouse
+    gamepad_thread_running = True
+    if mouse is None:
+        mouse = get_backend().create_mouse()
+        if mouse is None:
+            logger.warning("No virtual mouse available; right stick only drives the gamepad")
+    if mouse is not None and not (_mouse_thread and _mouse_thread.is_alive()):
+        _mouse_thread = threading.Thread(target=mouse_update_thread, name='mouse', daemon=True)
+        _mouse_thread.start()
+    for slot in slots:
+        if slot.client is not None:
+            slot.start()
+
+def ensure_input_ready():
+    """Start the input threads if nothing has yet
+    (used when input arrives over WebRTC without the WebSocket server)"""
+    start_update_thread()
+
+def handle_message(slot, data):
+    """Dispatch a decoded input message to a player's controller"""
+    msg_type = data.get('type')
     
-    # Handle triggers separately (they are analog)
-    if button == 'LT':
-        value = 255 if pressed else 0
-        gamepad.left_trigger(value=value)
-        print(f"LT: {value}")
-        gamepad.update()
-        return
+    if msg_type == 'left_stick':
+        x = float(data.get('x', 0))
+        y = float(data.get('y', 0))
+        slot.handle_left_stick(x, y)
     
-    if button == 'RT':
-        value = 255 if pressed else 0
-        gamepad.right_trigger(value=value)
-        print(f"RT: {value}")
-        gamepad.update()
-        return
+    elif msg_type == 'right_stick':
+        x = float(data.get('x', 0))
+        y = float(data.get('y', 0))
+        slot.handle_right_stick(x, y)
     
-    # Regular buttons
-    xbox_button = BUTTON_MAP.get(button)
-    if xbox_button:
-        if pressed:
-            gamepad.press_button(button=xbox_button)
-            print(f"Button {button}: Pressed")
-        else:
-            gamepad.release_button(button=xbox_button)
-            print(f"Button {button}: Released")
-        gamepad.update()
-
-def handle_dpad(direction, pressed):
-    """Handle D-pad"""
-    button = DPAD_TO_BUTTON.get(direction)
-    if button:
-        handle_button(button, pressed)
-
-def reset_gamepad():
-    """Reset all gamepad inputs to neutral"""
-    global left_stick, right_stick
-    left_stick = {'x': 0.0, 'y': 0.0}
-    right_stick = {'x': 0.0, 'y': 0.0}
+    elif msg_type == 'button':
+        button = data.get('button')
+        pressed = data.get('pressed', False)
+        slot.handle_button(button, pressed)
     
-    if gamepad:
-        gamepad.reset()
-        gamepad.update()
+    elif msg_type == 'dpad':
+        direction = data.get('direction')
+        pressed = data.get('pressed', False)
+        slot.handle_dpad(direction, pressed)
+
+def handle_raw_message(slot, message, decoder=None, latency=None, recorder=None):
+    """
+    Decode a message from any transport and dispatch it to `slot`. Binary
+    messages use input.protocol (one decoder per connection); text is JSON.
+    With a ClientLatency (input.clock), client-stamped input is timed and
+    acked, and a clock-sync pong returns the reply for the caller to send.
+    With a SessionRecorder (input.recorder), decoded messages are recorded.
+    """
+    received = now()
+    try:
+        if isinstance(message, (bytes, bytearray)):
+            if decoder is None:
+                decoder = BinaryDecoder()
+            messages = decoder.decode(message)
+            client_time = decoder.client_time
+        else:
+            data = json.loads(message)
+            if data.get('type') == 'pong':
+                return latency.handle_pong(data, received) if latency else None
+            messages = [data]
+            client_time = data.get('t')
+        INPUT_MESSAGES.inc(len(messages))
+        INPUT_RATE.mark(len(messages))
+        immediate = 0
+        for data in messages:
+            if recorder:
+                recorder.record(data, received)
+            if slot.jitter and client_time is not None and data.get('type') in ('left_stick', 'right_stick'):
+                slot.buffer_stick(data, float(client_time), received)  # Acked when released
+            else:
+                handle_message(slot, data)
+                immediate += 1
+        if latency and messages and client_time is not None:
+            latency.on_received(float(client_time), received)
+            if immediate:
+                slot.request_ack(float(client_time), received)
+        if trace.enabled:
+            trace.span('receive', 'input', received, now(), player=slot.player, messages=len(messages))
+    except json.JSONDecodeError:
+        logger.warning(f"Invalid JSON: {message!r:.80}")
+    except ProtocolError as e:
+        logger.warning(f"Invalid binary input: {e}")
+    except Exception as e:
+        logger.warning(f"Error handling message: {e}")
+    return None
+
+async def clock_sync_loop(websocket, latency):
+    """Ping the client for clock sync: a quick burst on connect, then periodically"""
+    try:
+        for _ in range(5):
+            await websocket.send(json.dumps(latency.ping_message()))
+            await asyncio.sleep(0.2)
+        while True:
+            await asyncio.sleep(settings.input_sync_interval)
+            await websocket.send(json.dumps(latency.ping_message()))
+    except websockets.exceptions.ConnectionClosed:
+        pass
 
 async def handler(websocket, path=None):
-    """Handle WebSocket connections"""
-    client_ip = websocket.remote_address[0] if websocket.remote_address else 'unknown'
-    print(f"Client connected: {client_ip}")
+    """Handle WebSocket connections; each one gets its own controller"""
+    address = websocket.remote_address or ('unknown', 0)
+    client_ip = address[0]
+    client = f"ws {client_ip}:{address[1]}"
+    logger.info(f"Client connected: {client_ip}")
+    slot = acquire_slot(client)
+    if slot is None:
+        logger.warning(f"All {MAX_CONTROLLERS} controller slots in use, rejecting {client_ip}")
+        await websocket.close(1013, 'All controller slots in use')
+        return
+    decoder = BinaryDecoder()
+    
+    # Latency tracking: acks go out from the slot's update thread via the loop
+    latency = register_client(client)
+    loop = asyncio.get_running_loop()
+    def send_ack(acks, injected):
+        ack = json.dumps(latency.on_injected(acks, injected))
+        asyncio.run_coroutine_threadsafe(websocket.send(ack), loop)
+    slot.on_inject = send_ack
+    sync_task = asyncio.create_task(clock_sync_loop(websocket, latency)) if settings.input_sync_interval > 0 else None
+    recorder = open_recorder(client)
     
     try:
         async for message in websocket:
-            try:
-                data = json.loads(message)
-                msg_type = data.get('type')
-                
-                if msg_type == 'left_stick':
-                    x = float(data.get('x', 0))
-                    y = float(data.get('y', 0))
-                    handle_left_stick(x, y)
-                
-                elif msg_type == 'right_stick':
-                    x = float(data.get('x', 0))
-                    y = float(data.get('y', 0))
-                    handle_right_stick(x, y)
-                
-                elif msg_type == 'button':
-                    button = data.get('button')
-                    pressed = data.get('pressed', False)
-                    handle_button(button, pressed)
-                
-                elif msg_type == 'dpad':
-                    direction = data.get('direction')
-                    pressed = data.get('pressed', False)
-                    handle_dpad(direction, pressed)
-                    
-            except json.JSONDecodeError:
-                print(f"Invalid JSON: {message}")
-            except Exception as e:
-                print(f"Error handling message: {e}")
+            reply = handle_raw_message(slot, message, decoder, latency, recorder)
+            if reply:
+                await websocket.send(json.dumps(reply))
                 
     except websockets.exceptions.ConnectionClosed:
-        print(f"Client disconnected: {client_ip}")
+        logger.info(f"Client disconnected: {client_ip}")
     finally:
-        reset_gamepad()
-        print(f"Cleanup completed for: {client_ip}")
+        if sync_task:
+            sync_task.cancel()
+        slot.on_inject = None
+        if recorder:
+            recorder.close()
+        unregister_client(client)
+        release_slot(slot)
+        logger.info(f"Cleanup completed for: {client_ip}")
+
+async def serve(host=HOST, port=PORT):
+    """Serve input WebSockets until cancelled, then stop the input threads"""
+    global gamepad_thread_running
+    init_gamepad()
+    start_update_thread()
+    try:
+        async with websockets.serve(handler, host, port):
+            logger.info(f"Input server listening on ws://{host}:{port}")
+            await asyncio.Future()
+    finally:
+        gamepad_thread_running = False
+        stop_mouse()
 
 def get_server_info():
     """Get local IP and generate connection data"""
@@ -227,7 +502,7 @@ def get_server_info():
             "mjpeg_port": int(os.getenv('MJPEG_PORT', 8080))
         }
     except Exception as e:
-        print(f"Error getting server info: {e}")
+        logger.error(f"Error getting server info: {e}")
         return None
 
 def get_qr_image():
@@ -254,15 +529,14 @@ async def main():
     if not init_gamepad():
         print("\n⚠ Running without virtual gamepad!")
         print("  Buttons/Left stick won't work in games.")
-        print("  Install ViGEmBus driver from:")
-        print("  https://github.com/ViGEm/ViGEmBus/releases")
+        if get_backend().setup_hint:
+            print(f"  {get_backend().setup_hint}")
     
     print("\n✓ Mouse control enabled for camera (Right Stick)")
     print("  Version: v2 (Mouse Up-Down Fixed)")
     
     # Start update thread
-    update_thread = threading.Thread(target=gamepad_update_thread, daemon=True)
-    update_thread.start()
+    start_update_thread()
     
     server_info = get_server_info()
     print(f"\nListening on ws://{HOST}:{PORT}")
@@ -286,12 +560,13 @@ async def main():
     print("  D-Pad:       Xbox D-Pad")
     print("  Start:       Xbox Start")
     print("  Select:      Xbox Back")
+    print(f"  Players:     one controller per connection, up to {MAX_CONTROLLERS}")
     print("\nWaiting for connections...")
     
-    async with websockets.serve(handler, HOST, PORT):
-        await asyncio.Future()
+    await serve()
 
 if __name__ == '__main__':
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
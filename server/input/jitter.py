@@ -0,0 +1,131 @@
+# Input jitter buffer
+"""
+Adaptive playout buffer for stick samples (INPUT_JITTER_BUFFER).
+
+Over Wi-Fi, samples the client sent at an even cadence arrive in bursts.
+The buffer holds each client-stamped stick sample until
+
+    playout = client send time + base transit + depth
+
+base transit is the smallest (server receive - client send) seen recently,
+so no clock sync is needed and slow drift is followed. depth tracks the
+95th percentile of transit above base: it grows at once when jitter rises
+and shrinks slowly, capped at INPUT_JITTER_MAX_MS. Samples come out in
+client time order; a sample older than one already released for the same
+stick is stale and dropped. Buttons never pass through the buffer.
+"""
+import heapq
+import itertools
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from core.latency import percentile
+from core.metrics import gauge
+from input.clock import server_ms
+
+DEPTH_DECAY = 0.02  # Fraction of the gap closed per sample when jitter falls
+
+
+class JitterBuffer:
+    """Reorders and re-times one connection's stick samples"""
+
+    def __init__(self, name: str, max_depth_ms: float, window: int = 128):
+        self.name = name
+        self.max_depth_ms = max(0.0, max_depth_ms)
+        self._lock = threading.Lock()
+        self._queue: List[Tuple[float, int, dict, float]] = []  # (client time, order, msg, received)
+        self._order = itertools.count()
+        self._transits = deque(maxlen=window)
+        self._last_released: Dict[str, float] = {}
+        self.base = None
+        self.depth_ms = 0.0
+        self.jitter_ms = 0.0
+        self.buffered = 0
+        self.released = 0
+        self.stale = 0
+        self.late = 0
+        _buffers[name] = self
+
+    def push(self, msg: dict, client_time: float, received: float) -> bool:
+        """Queue a stick sample; True if it is now the next one due"""
+        transit = server_ms(received) - client_time
+        with self._lock:
+            last = self._last_released.get(msg['type'])
+            if last is not None and client_time <= last:
+                self.stale += 1
+                return False
+            self._transits.append(transit)
+            self.base = min(self._transits)
+            self.jitter_ms = percentile(sorted(t - self.base for t in self._transits), 95)
+            target = min(self.max_depth_ms, self.jitter_ms)
+            if target > self.depth_ms:
+                self.depth_ms = target
+            else:
+                self.depth_ms += (target - self.depth_ms) * DEPTH_DECAY
+            if transit > self.base + self.depth_ms:
+                self.late += 1
+            heapq.heappush(self._queue, (client_time, next(self._order), msg, received))
+            self.buffered += 1
+            return self._queue[0][2] is msg
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def next_due(self) -> Optional[float]:
+        """Server time (seconds, core.latency.now()) the next sample is due, or None"""
+        with self._lock:
+            if not self._queue:
+                return None
+            return (self._queue[0][0] + self.base + self.depth_ms) / 1000.0
+
+    def pop_due(self, at: float) -> List[Tuple[dict, float, float]]:
+        """Remove the samples due by server time `at`: (msg, client time, received)"""
+        at_ms = server_ms(at)
+        due = []
+        with self._lock:
+            while self._queue and self._queue[0][0] + self.base + self.depth_ms <= at_ms:
+                client_time, _, msg, received = heapq.heappop(self._queue)
+                last = self._last_released.get(msg['type'])
+                if last is not None and client_time <= last:
+                    self.stale += 1
+                    continue
+                self._last_released[msg['type']] = client_time
+                due.append((msg, client_time, received))
+            self.released += len(due)
+        return due
+
+    def clear(self) -> None:
+        """Forget queued samples and timing (a new client has its own clock)"""
+        with self._lock:
+            self._queue.clear()
+            self._transits.clear()
+            self._last_released.clear()
+            self.base = None
+            self.depth_ms = 0.0
+            self.jitter_ms = 0.0
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'depth_ms': round(self.depth_ms, 2),
+                'jitter_p95_ms': round(self.jitter_ms, 2),
+                'queued': len(self._queue),
+                'buffered': self.buffered,
+                'released': self.released,
+                'stale_dropped': self.stale,
+                'late': self.late,
+            }
+
+
+_buffers: Dict[str, JitterBuffer] = {}
+gauge(
+    'cloudgame_input_jitter_depth_seconds', 'Input jitter buffer depth', ('player',),
+    callback=lambda: {name: buffer.depth_ms / 1000.0 for name, buffer in list(_buffers.items())},
+)
+
+
+def buffers_summary() -> dict:
+    """Depth and counters of every jitter buffer"""
+    return {name: buffer.summary() for name, buffer in list(_buffers.items())}
@@ -0,0 +1,176 @@
+# Binary input protocol
+"""
+Compact binary wire format for controller input (little-endian).
+
+Packet:
+    header   <BBH   version, record count, sequence number (uint16, wraps)
+    records  one or more, each starting with a type byte
+
+Records:
+    LEFT_STICK / RIGHT_STICK   <Bhh   type, x, y  (int16, -32767..32767 = -1.0..1.0)
+    BUTTONS                    <BI    type, bitmask of every pressed button
+    CLIENT_TIME                <Bd    type, client send time in ms (see input.clock, version 2)
+
+Versions: 1 has the stick and button records, 2 adds CLIENT_TIME. A new
+version may only add record types, and clients put them after the ones
+older versions know. From version 2 on the decoder accepts newer versions,
+stops at the first record type it does not know and keeps what it decoded
+before it, so newer clients keep driving older servers. Version-1 servers
+reject anything but version 1, so they drop version-2 packets as a whole.
+
+BUTTONS carries the full button state, not an edge, so a lost or duplicated
+packet cannot leave a button stuck. The decoder diffs it against the last
+state and emits ordinary press/release messages.
+
+Sequence numbers are per connection (per DataChannel over WebRTC). Packets
+older than the newest one seen are dropped, which matters on unordered
+transports such as the WebRTC axes channel. Several records in one packet
+let a client batch everything that changed within a frame.
+JSON text messages stay supported for older clients.
+"""
+import struct
+from typing import Iterable, List, Optional
+
+PROTOCOL_VERSION = 2
+MIN_PROTOCOL_VERSION = 1
+
+HEADER = struct.Struct('<BBH')
+STICK = struct.Struct('<Bhh')
+BUTTONS = struct.Struct('<BI')
+CLIENT_TIME = struct.Struct('<Bd')
+
+TYPE_LEFT_STICK = 1
+TYPE_RIGHT_STICK = 2
+TYPE_BUTTONS = 3
+TYPE_CLIENT_TIME = 4
+
+AXIS_SCALE = 32767
+
+# Bit position of each button in a BUTTONS record
+BUTTON_BITS = [
+    'A', 'B', 'X', 'Y',
+    'LB', 'RB', 'LT', 'RT',
+    'START', 'SELECT',
+    'D_UP', 'D_DOWN', 'D_LEFT', 'D_RIGHT',
+]
+BUTTON_MASKS = {name: 1 << bit for bit, name in enumerate(BUTTON_BITS)}
+
+_STICK_TYPES = {TYPE_LEFT_STICK: 'left_stick', TYPE_RIGHT_STICK: 'right_stick'}
+_STICK_CODES = {name: code for code, name in _STICK_TYPES.items()}
+
+
+class ProtocolError(ValueError):
+    """Raised for malformed binary input packets"""
+
+
+def _seq_newer(seq: int, last: int) -> bool:
+    """True if uint16 sequence `seq` comes after `last` (with wraparound)"""
+    return 0 < ((seq - last) & 0xFFFF) < 0x8000
+
+
+def _axis(value: float) -> int:
+    return int(round(max(-1.0, min(1.0, value)) * AXIS_SCALE))
+
+
+def encode_packet(seq: int, messages: Iterable[dict], buttons: Optional[int] = None,
+                  client_time: Optional[float] = None) -> bytes:
+    """
+    Pack stick messages (same dicts as the JSON protocol), an optional
+    button bitmask and an optional client send time into one packet.
+    """
+    records = []
+    for msg in messages:
+        code = _STICK_CODES.get(msg.get('type'))
+        if code is None:
+            raise ProtocolError(f"Cannot encode message type: {msg.get('type')}")
+        records.append(STICK.pack(code, _axis(msg.get('x', 0)), _axis(msg.get('y', 0))))
+    if buttons is not None:
+        records.append(BUTTONS.pack(TYPE_BUTTONS, buttons))
+    if client_time is not None:
+        records.append(CLIENT_TIME.pack(TYPE_CLIENT_TIME, client_time))  # Version 2 record, so last
+    return HEADER.pack(PROTOCOL_VERSION, len(records), seq & 0xFFFF) + b''.join(records)
+
+
+def buttons_mask(pressed: Iterable[str]) -> int:
+    """Bitmask for a set of pressed button names"""
+    mask = 0
+    for name in pressed:
+        mask |= BUTTON_MASKS[name]
+    return mask
+
+
+_RECORDS = {
+    TYPE_LEFT_STICK: STICK,
+    TYPE_RIGHT_STICK: STICK,
+    TYPE_BUTTONS: BUTTONS,
+    TYPE_CLIENT_TIME: CLIENT_TIME,
+}
+
+
+def _parse_records(data: bytes, count: int) -> List[tuple]:
+    """
+    The unpacked tuple of each known record; raises ProtocolError if one is
+    malformed. Parsing stops at a record type this version does not know.
+    """
+    records = []
+    offset = HEADER.size
+    for _ in range(count):
+        if offset >= len(data):
+            raise ProtocolError("Truncated packet")
+        record_type = data[offset]
+        record = _RECORDS.get(record_type)
+        if record is None:
+            break  # From a newer client: trailing, and its size is unknown
+        if offset + record.size > len(data):
+            raise ProtocolError("Truncated packet")
+        records.append(record.unpack_from(data, offset))
+        offset += record.size
+    return records
+
+
+class BinaryDecoder:
+    """Per-connection decoder; tracks sequence numbers and button state"""
+
+    def __init__(self):
+        self.last_seq: Optional[int] = None
+        self.buttons = 0
+        self.dropped = 0
+        self.client_time: Optional[float] = None  # From the last decoded packet, if stamped
+
+    def decode(self, data: bytes) -> List[dict]:
+        """Decode a packet into JSON-protocol style message dicts"""
+        if len(data) < HEADER.size:
+            raise ProtocolError("Packet too short")
+        version, count, seq = HEADER.unpack_from(data, 0)
+        if version < MIN_PROTOCOL_VERSION:
+            raise ProtocolError(f"Unsupported protocol version: {version}")
+        # Parse the whole packet before touching any state, so a malformed
+        # one leaves the sequence number and button state as they were
+        records = _parse_records(data, count)
+
+        self.client_time = None
+        if self.last_seq is not None and not _seq_newer(seq, self.last_seq):
+            self.dropped += 1
+            return []
+        self.last_seq = seq
+
+        messages = []
+        for record in records:
+            stick = _STICK_TYPES.get(record[0])
+            if stick:
+                messages.append({'type': stick, 'x': record[1] / AXIS_SCALE, 'y': record[2] / AXIS_SCALE})
+            elif record[0] == TYPE_BUTTONS:
+                messages.extend(self._button_changes(record[1]))
+            else:
+                self.client_time = record[1]
+        return messages
+
+    def _button_changes(self, mask: int) -> List[dict]:
+        """Press/release messages for bits that differ from the last state"""
+        changed = mask ^ self.buttons
+        self.buttons = mask
+        messages = []
+        for bit, name in enumerate(BUTTON_BITS):
+            if changed & (1 << bit):
+                messages.append({'type': 'button', 'button': name, 'pressed': bool(mask & (1 << bit))})
+        return messages
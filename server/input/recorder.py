@@ -0,0 +1,126 @@
+# Input session recording
+"""
+Records the decoded input messages of each session to a compact file, for
+reproducing input problems and as load for benchmarks/replay_input.py.
+Enabled by INPUT_RECORD_DIR; one file per connection.
+
+File:
+    header   <4sBd   magic b'CGIR', format version, wall-clock start (time.time())
+    records  <IBBhh  µs since the previous record, kind, code, a, b
+
+Kinds:
+    LEFT_STICK / RIGHT_STICK   a, b = x, y scaled by 32767 (as received)
+    BUTTON                     code = index in protocol.BUTTON_BITS, a = pressed
+    DPAD                       code = index in DPAD_DIRECTIONS, a = pressed
+"""
+import os
+import re
+import struct
+import time
+from typing import Iterator, Optional, Tuple
+
+from config.settings import settings
+from core.latency import now
+from input.protocol import AXIS_SCALE, BUTTON_BITS
+from utils.log import get_logger
+
+logger = get_logger('input')
+
+MAGIC = b'CGIR'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBd')
+RECORD = struct.Struct('<IBBhh')
+
+KIND_LEFT_STICK = 1
+KIND_RIGHT_STICK = 2
+KIND_BUTTON = 3
+KIND_DPAD = 4
+
+DPAD_DIRECTIONS = ('up', 'down', 'left', 'right')
+_STICK_KINDS = {'left_stick': KIND_LEFT_STICK, 'right_stick': KIND_RIGHT_STICK}
+_KIND_STICKS = {kind: name for name, kind in _STICK_KINDS.items()}
+_BUTTON_CODES = {name: code for code, name in enumerate(BUTTON_BITS)}
+_MAX_DELTA_US = 0xFFFFFFFF
+
+
+def _axis(value) -> int:
+    return int(round(max(-1.0, min(1.0, float(value))) * AXIS_SCALE))
+
+
+class SessionRecorder:
+    """Appends one session's messages to a recording file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, time.time()))
+        self._last = now()
+
+    def record(self, data: dict, received: float) -> None:
+        """Add a decoded message that arrived at core.latency.now() time `received`"""
+        if self._file is None:
+            return
+        msg_type = data.get('type')
+        pressed = 1 if data.get('pressed') else 0
+        if msg_type in _STICK_KINDS:
+            kind, code, a, b = _STICK_KINDS[msg_type], 0, _axis(data.get('x', 0)), _axis(data.get('y', 0))
+        elif msg_type == 'button' and data.get('button') in _BUTTON_CODES:
+            kind, code, a, b = KIND_BUTTON, _BUTTON_CODES[data['button']], pressed, 0
+        elif msg_type == 'dpad' and str(data.get('direction')).lower() in DPAD_DIRECTIONS:
+            kind, code, a, b = KIND_DPAD, DPAD_DIRECTIONS.index(str(data['direction']).lower()), pressed, 0
+        else:
+            return
+        delta_us = min(_MAX_DELTA_US, max(0, int((received - self._last) * 1e6)))
+        self._last = received
+        self._file.write(RECORD.pack(delta_us, kind, code, a, b))
+        self.count += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Recorded {self.count} input messages to {self.path}")
+
+
+def open_recorder(client: str) -> Optional[SessionRecorder]:
+    """A recorder for a new connection, or None when recording is off"""
+    if not settings.input_record_dir:
+        return None
+    try:
+        os.makedirs(settings.input_record_dir, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9.-]+', '_', client).strip('_')
+        path = os.path.join(
+            settings.input_record_dir, f"input-{time.strftime('%Y%m%d-%H%M%S')}-{name}.cgir"
+        )
+        return SessionRecorder(path)
+    except OSError as e:
+        logger.warning(f"Input recording disabled for {client}: {e}")
+        return None
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, dict]]:
+    """Yield (seconds since the first message, message) from a recording"""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path}: not an input recording")
+        magic, version, _ = HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path}: not an input recording (version {version})")
+        data = f.read()
+    offset_us = 0
+    first = True
+    for delta_us, kind, code, a, b in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+        if not first:
+            offset_us += delta_us
+        first = False
+        if kind in _KIND_STICKS:
+            msg = {'type': _KIND_STICKS[kind], 'x': a / AXIS_SCALE, 'y': b / AXIS_SCALE}
+        elif kind == KIND_BUTTON and code < len(BUTTON_BITS):
+            msg = {'type': 'button', 'button': BUTTON_BITS[code], 'pressed': bool(a)}
+        elif kind == KIND_DPAD and code < len(DPAD_DIRECTIONS):
+            msg = {'type': 'dpad', 'direction': DPAD_DIRECTIONS[code], 'pressed': bool(a)}
+        else:
+            continue
+        yield offset_us / 1e6, msg
@@ -3,16 +3,21 @@
 Cloud Game Server - Modular Entry Point
 
 Usage:
-    python main.py [--webrtc] [--mjpeg] [--gui]
+    python main.py [--webrtc] [--mjpeg] [--gui] [--calibrate]
     
 Options:
     --webrtc    Start WebRTC video server (recommended for 60fps)
     --mjpeg     Start MJPEG video server (fallback)
     --gui       Start with GUI (default if no options specified)
+    --calibrate Re-measure this host and pick fps/scale/quality (core/autotune.py)
+
+Without the GUI, input and video run as supervised components on one
+event loop (core/runtime.py); EVENT_LOOP=uvloop selects uvloop. The CPU
+governor (core/governor.py) runs alongside them unless GOVERNOR=0.
+PIPELINE=process moves MJPEG capture, encoding and sending into separate
+processes (core/process_pipeline.py).
 """
 import argparse
-import asyncio
-import threading
 import sys
 import os
 
@@ -21,6 +26,7 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from config.settings import settings
 from utils.network import get_local_ip, print_qr_ascii
+from utils.log import setup_logging
 
 
 def print_banner():
@@ -35,36 +41,47 @@ def print_banner():
     print("=" * 55)
 
 
-def start_input_server():
-    """Start input server in separate thread"""
-    from input.input_server import main as input_main
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        loop.run_until_complete(input_main())
-    except KeyboardInterrupt:
-        pass
+def input_component():
+    """Input WebSocket server"""
+    from core.runtime import Component
+    from input.input_server import serve
+    return Component('input', serve, thread_prefixes=('gamepad-', 'mouse'))
 
 
-def start_mjpeg_server():
-    """Start MJPEG video server"""
-    from video.mjpeg_server import start_server
-    start_server()
+def mjpeg_component():
+    """MJPEG video server"""
+    from core.runtime import Component
+    from video.mjpeg_server import serve
+    return Component('mjpeg', serve, thread_prefixes=('mjpeg',))
 
 
-def start_webrtc_server():
-    """Start WebRTC video server"""
+def webrtc_component():
+    """WebRTC video server, or MJPEG if WebRTC is unavailable"""
+    from core.runtime import Component
     try:
-        from video.webrtc_server import start_server, WEBRTC_AVAILABLE
+        from video.webrtc_server import serve, WEBRTC_AVAILABLE
         if not WEBRTC_AVAILABLE:
             print("⚠ WebRTC not available. Install: pip install aiortc aiohttp av")
             print("  Falling back to MJPEG...")
-            start_mjpeg_server()
-            return
-        start_server()
+            return mjpeg_component()
     except ImportError:
         print("⚠ WebRTC module not found. Install: pip install aiortc aiohttp av")
-        start_mjpeg_server()
+        return mjpeg_component()
+    return Component('webrtc', serve, thread_prefixes=('webrtc-', 'capture'))
+
+
+def pipeline_component():
+    """Multi-process MJPEG pipeline (PIPELINE=process)"""
+    from core.runtime import Component
+    from core.process_pipeline import serve
+    return Component('pipeline', serve)
+
+
+def governor_component():
+    """CPU load governor"""
+    from core.runtime import Component
+    from core.governor import serve
+    return Component('governor', serve)
 
 
 def start_gui():
@@ -77,11 +94,13 @@ def start_gui():
 
 
 def main():
+    setup_logging()
     parser = argparse.ArgumentParser(description='Cloud Game Server')
     parser.add_argument('--webrtc', action='store_true', help='Use WebRTC (60fps, low latency)')
     parser.add_argument('--mjpeg', action='store_true', help='Use MJPEG (fallback)')
     parser.add_argument('--gui', action='store_true', help='Start with GUI')
     parser.add_argument('--headless', action='store_true', help='Run without GUI')
+    parser.add_argument('--calibrate', action='store_true', help='Re-run the startup calibration')
     args = parser.parse_args()
     
     # Default to GUI if no args
@@ -89,6 +108,10 @@ def main():
         start_gui()
         return
     
+    # Pick fps/scale/quality for this host (cached after the first run)
+    from core.autotune import autotune
+    autotune('webrtc' if args.webrtc else 'mjpeg', force=args.calibrate)
+    
     print_banner()
     
     # Print QR code
@@ -96,18 +119,19 @@ def main():
     print(f"\n📱 Scan to connect: {url}")
     print_qr_ascii(url)
     
-    # Start input server in background thread
-    input_thread = threading.Thread(target=start_input_server, daemon=True)
-    input_thread.start()
-    print("✓ Input server started")
-    
-    # Start video server (blocking)
+    from core.runtime import Runtime
+    components = [input_component()]
     if args.webrtc:
         print("✓ Starting WebRTC server (60fps)...")
-        start_webrtc_server()
+        components.append(webrtc_component())
     else:
         print("✓ Starting MJPEG server...")
-        start_mjpeg_server()
+        components.append(pipeline_component() if settings.pipeline == 'process' else mjpeg_component())
+    if settings.governor:
+        components.append(governor_component())
+    
+    # Input and video share one supervised event loop (blocking)
+    Runtime(components).run()
 
 
 if __name__ == '__main__':
@@ -10,6 +10,8 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
 from dotenv import load_dotenv
 
+from core.latency import latency_tracker, mjpeg_part_header, now
+
 # Try to import dxcam
 try:
     import dxcam
@@ -22,12 +24,12 @@ load_dotenv()
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('MJPEG_PORT', 8888))
 
-# Configuration
+# Configuration (same variables and defaults as video/mjpeg_server.py)
 _settings_lock = threading.Lock()
 _settings = {
-    'target_fps': 60,
-    'jpeg_quality': 50,
-    'scale_factor': 0.75
+    'target_fps': int(os.getenv('MJPEG_TARGET_FPS', 60)),
+    'jpeg_quality': int(os.getenv('MJPEG_QUALITY', 50)),
+    'scale_factor': float(os.getenv('MJPEG_SCALE', 0.75))
 }
 
 # Global Camera Instance
@@ -38,6 +40,7 @@ _camera_lock = threading.Lock()
 _frame_lock = threading.Lock()
 _latest_jpeg = None
 _latest_frame_id = 0
+_latest_stages = {}
 _active_clients = 0
 _broadcast_thread = None
 _shutdown_event = threading.Event()
@@ -78,10 +81,11 @@ atexit.register(cleanup_camera)
 
 def broadcast_loop():
     """Background thread to capture and encode frames repeatedly"""
-    global _latest_jpeg, _latest_frame_id
+    global _latest_jpeg, _latest_frame_id, _latest_stages
     
     print("✓ Broadcast loop started")
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 50, int(cv2.IMWRITE_JPEG_OPTIMIZE), 0]
+    # Quality is set from the settings for every frame
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), get_settings()['jpeg_quality'], int(cv2.IMWRITE_JPEG_OPTIMIZE), 0]
     
     while not _shutdown_event.is_set():
         # Pause if no clients to save CPU
@@ -101,6 +105,7 @@ def broadcast_loop():
             if frame is None:
                 time.sleep(0.001)
                 continue
+            stages = {'capture': now()}
             
             # Read settings
             settings = get_settings()
@@ -112,14 +117,17 @@ def broadcast_loop():
                 width = int(frame.shape[1] * scale)
                 height = int(frame.shape[0] * scale)
                 frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_NEAREST)
+            stages['transform'] = now()
             
             # Encode
             encode_param[1] = settings['jpeg_quality']
             success, jpeg = cv2.imencode('.jpg', frame, encode_param)
+            stages['encode'] = now()
             
             if success:
                 with _frame_lock:
                     _latest_jpeg = jpeg.tobytes()
+                    _latest_stages = stages
                     _latest_frame_id += 1
             
             # Rate limit slightly to match target FPS roughly
@@ -190,6 +198,14 @@ class MJPEGHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps(get_settings()).encode())
             return
         
+        if self.path == '/latency':
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps(latency_tracker.summary()).encode())
+            return
+        
         if self.path != '/':
             self.send_error(404)
             return
@@ -210,10 +226,15 @@ class MJPEGHandler(BaseHTTPRequestHandler):
                 if current_id > last_sent_id:
                     with _frame_lock:
                         jpeg_bytes = _latest_jpeg
+                        stages = _latest_stages
+                        current_id = _latest_frame_id
                     
                     if jpeg_bytes:
-                        self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + 
-                                       jpeg_bytes + b'\r\n')
+                        self.wfile.write(
+                            mjpeg_part_header(current_id, stages['capture'], len(jpeg_bytes)) +
+                            jpeg_bytes + b'\r\n'
+                        )
+                        latency_tracker.record('mjpeg', {**stages, 'send': now()})
                         last_sent_id = current_id
                 else:
                     # Wait briefly for next frame to be encoded
@@ -11,6 +11,7 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from config.settings import settings
 from utils.network import get_local_ip, generate_qr_code, get_server_info
+from utils.log import setup_logging
 from input.input_server import main as input_server_main, gamepad_thread_running
 from video.mjpeg_server import start_server as mjpeg_start, stop_server as mjpeg_stop
 
@@ -255,6 +256,7 @@ class ServerApp:
 
 
 if __name__ == "__main__":
+    setup_logging()
     root = tk.Tk()
     app = ServerApp(root)
     root.mainloop()
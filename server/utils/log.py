@@ -0,0 +1,158 @@
+# Non-blocking, rate-limited logging
+"""
+Logging for the streaming and input hot paths.
+
+Records are handed to a background thread through a bounded queue, so a slow
+console (Windows conhost, journald) never blocks a capture loop or an input
+handler. If the queue is full the record is dropped, not waited on.
+Each category (logger name) is rate limited separately. The next record
+that gets through reports how many were suppressed.
+
+Debug traces for a category can be switched on at runtime with set_level(),
+or at startup with LOG_DEBUG=input,mjpeg.
+
+Entry points (main.py and the servers' __main__ blocks) call
+setup_logging() once. Importing a module only creates its logger, so tools
+and benchmarks that import server modules keep Python's default logging.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from config.settings import settings
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Categories used by the server
+CATEGORIES = ('input', 'input.stick', 'input.button', 'mjpeg', 'webrtc', 'capture', 'encoder', 'runtime', 'autotune', 'governor', 'pipeline')
+
+_setup_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per logger name: `rate` records per second, bursts of `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.rates: Dict[str, float] = {}
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def set_rate(self, name: str, rate: float) -> None:
+        """Override the rate for one category (0 disables limiting)"""
+        with self._lock:
+            self.rates[name] = rate
+            self._buckets.pop(name, None)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.name, self.rate)
+        if rate <= 0:
+            return True
+        capacity = max(self.burst, rate)
+        stamp = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                # [tokens, last refill, suppressed count]
+                bucket = self._buckets[record.name] = [capacity, stamp, 0]
+            bucket[0] = min(capacity, bucket[0] + (stamp - bucket[1]) * rate)
+            bucket[1] = stamp
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar suppressed)"
+            record.args = None
+        return True
+
+
+_rate_filter = RateLimitFilter(settings.log_rate_limit)  # Attached by setup_logging()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: Optional[str] = None) -> None:
+    """Route all logging through the background queue (idempotent)"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.Queue(maxsize=10000)
+        handler = DroppingQueueHandler(log_queue)
+        handler.addFilter(_rate_filter)
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%H:%M:%S'))
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(_parse_level(level or settings.log_level))
+        for name in settings.log_debug.split(','):
+            if name.strip():
+                logging.getLogger(name.strip()).setLevel(logging.DEBUG)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a category (no side effects; see setup_logging)"""
+    return logging.getLogger(name)
+
+
+def _parse_level(level) -> int:
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    return value
+
+
+def set_level(level, name: Optional[str] = None) -> None:
+    """Change the level of one category (or the root logger) at runtime"""
+    logging.getLogger(name).setLevel(_parse_level(level))
+
+
+def set_rate_limit(name: str, rate: float) -> None:
+    """Change the records-per-second limit of one category at runtime"""
+    _rate_filter.set_rate(name, rate)
+
+
+def get_levels() -> dict:
+    """Effective level of the root logger and each category"""
+    levels = {'root': logging.getLevelName(logging.getLogger().level)}
+    for name in CATEGORIES:
+        levels[name] = logging.getLevelName(logging.getLogger(name).getEffectiveLevel())
+    return levels
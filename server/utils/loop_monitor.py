@@ -0,0 +1,54 @@
+# Event loop lag monitoring
+import asyncio
+import time
+from typing import Optional
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the asyncio event loop wakes up a periodic timer.
+    Any blocking call on the loop (capture, encode, disk I/O) shows up as lag.
+    """
+    
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.avg_lag = 0.0
+        self.samples = 0
+        self._task: Optional[asyncio.Task] = None
+        
+    def start(self) -> None:
+        """Start sampling on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            
+    async def stop(self) -> None:
+        """Stop sampling"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            # Exponential moving average keeps the figure stable between polls
+            self.avg_lag = lag if self.samples == 0 else self.avg_lag * 0.9 + lag * 0.1
+            self.samples += 1
+            
+    def stats(self) -> dict:
+        """Get lag statistics in milliseconds"""
+        return {
+            'last_ms': round(self.last_lag * 1000, 3),
+            'avg_ms': round(self.avg_lag * 1000, 3),
+            'max_ms': round(self.max_lag * 1000, 3),
+            'samples': self.samples,
+        }
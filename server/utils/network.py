@@ -1,5 +1,6 @@
 # Network utilities
 import socket
+import sys
 import qrcode
 from io import BytesIO
 
@@ -44,7 +45,8 @@ def print_qr_ascii(data: str) -> None:
     qr = qrcode.QRCode(version=1, box_size=1, border=2)
     qr.add_data(data)
     qr.make(fit=True)
-    qr.print_ascii(tty=True)
+    # tty=True only works on a terminal; plain output keeps headless/service runs alive
+    qr.print_ascii(tty=sys.stdout.isatty())
 
 
 def get_server_info(ws_port: int, mjpeg_port: int, webrtc_port: int = None) -> dict:
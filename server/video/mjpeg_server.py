@@ -6,43 +6,68 @@ from socketserver import ThreadingMixIn
 import time
 import os
 import json
+import logging
 import threading
 import sys
+from urllib.parse import parse_qs, urlparse
 from dotenv import load_dotenv
 
-# Try to use dxcam (faster), fallback to mss
+# Add parent directory to path for modular imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import settings as server_settings
+from core import marker
+from core.capture import get_monitor_capture
+from core.latency import latency_tracker, mjpeg_part_header, now
+from core.governor import get_governor, register_target
+from core.metrics import (
+    CAPTURE_SECONDS, CLIENTS, DEADLINE_MISSES, ENCODED_BYTES, FRAMES_DROPPED, render_json, render_prometheus
+)
+from core.runtime import get_runtime, run_in_thread
+from core import trace
+from input.clock import clients_summary
+from input.jitter import buffers_summary
+from utils.log import get_logger, get_levels, set_level, setup_logging
+
+logger = get_logger('mjpeg')
+
+# Try to use dxcam (faster), fallback to mss; CAPTURE_METHOD=synthetic grabs a test pattern
 try:
     import dxcam
-    USE_DXCAM = True
-    print("Using dxcam (DirectX) - faster capture")
+    USE_DXCAM = server_settings.capture_method != 'synthetic'
 except ImportError:
-    import mss
     USE_DXCAM = False
-    print("Using mss (fallback) - install dxcam for faster capture")
-
-# Add parent directory to path for modular imports
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if USE_DXCAM:
+    logger.info("Using dxcam (DirectX) - faster capture")
+elif server_settings.capture_method == 'synthetic':
+    logger.info("Using synthetic test pattern (CAPTURE_METHOD=synthetic)")
+else:
+    logger.info("Using mss (fallback) - install dxcam for faster capture")
 
 load_dotenv()
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('MJPEG_PORT', 8888))
 
-# Runtime-configurable settings (thread-safe)
+# Runtime-configurable settings (thread-safe). The defaults are the values
+# .env used to pin; they apply wherever autotune does not replace them
+# (AUTOTUNE=off, server_gui.py)
 _settings_lock = threading.Lock()
 _settings = {
     'target_fps': int(os.getenv('MJPEG_TARGET_FPS', 60)),
-    'jpeg_quality': int(os.getenv('MJPEG_QUALITY', 70)),
+    'jpeg_quality': int(os.getenv('MJPEG_QUALITY', 50)),
     'scale_factor': float(os.getenv('MJPEG_SCALE', 0.75)),
     'buffer_delay': float(os.getenv('MJPEG_BUFFER_DELAY', 0))
 }
+_settings_version = 0  # Bumped on every change so running streams pick it up
 
 def get_settings():
     with _settings_lock:
         return _settings.copy()
 
 def update_settings(new_settings):
-    global _settings
+    global _settings, _settings_version
     with _settings_lock:
+        _settings_version += 1
         if 'target_fps' in new_settings:
             _settings['target_fps'] = max(1, min(120, int(new_settings['target_fps'])))
         if 'jpeg_quality' in new_settings:
@@ -53,6 +78,31 @@ def update_settings(new_settings):
             _settings['buffer_delay'] = max(0.0, min(1.0, float(new_settings['buffer_delay'])))
         return _settings.copy()
 
+def _stream_params():
+    """(settings version, JPEG params, frame interval, scale) for a stream loop"""
+    with _settings_lock:
+        return (
+            _settings_version,
+            [int(cv2.IMWRITE_JPEG_QUALITY), _settings['jpeg_quality']],
+            1.0 / _settings['target_fps'],
+            _settings['scale_factor'],
+        )
+
+def _governor_settings():
+    with _settings_lock:
+        return {key: _settings[key] for key in ('target_fps', 'scale_factor', 'jpeg_quality')}
+
+# Stream loops follow the CPU governor (core/governor.py)
+register_target('mjpeg', _governor_settings, update_settings)
+
+# Metric children used per frame
+capture_seconds = CAPTURE_SECONDS.labels('mjpeg')
+encoded_bytes = ENCODED_BYTES.labels('mjpeg')
+encode_failed = FRAMES_DROPPED.labels('mjpeg', 'encode_failed')
+skipped_frames = FRAMES_DROPPED.labels('mjpeg', 'skipped')
+_stream_clients = CLIENTS.labels('mjpeg')
+deadline_missed = DEADLINE_MISSES.labels('mjpeg')
+
 class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
     daemon_threads = True
 
@@ -66,6 +116,10 @@ def get_dxcam_camera():
     return _dxcam_camera
 
 class MJPEGHandler(BaseHTTPRequestHandler):
+    def setup(self):
+        threading.current_thread().name = 'mjpeg-client'  # Counted as MJPEG CPU time by core.runtime
+        super().setup()
+    
     def log_message(self, format, *args):
         pass  # Disable logging for performance
     
@@ -89,47 +143,175 @@ class MJPEGHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps(settings).encode())
             return
         
-        if self.path != '/':
+        if self.path == '/latency':
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self._send_cors_headers()
+            self.end_headers()
+            self.wfile.write(json.dumps(latency_tracker.summary()).encode())
+            return
+        
+        if self.path == '/input/latency':
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self._send_cors_headers()
+            self.end_headers()
+            self.wfile.write(json.dumps(clients_summary()).encode())
+            return
+        
+        if self.path == '/input/jitter':
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self._send_cors_headers()
+            self.end_headers()
+            self.wfile.write(json.dumps(buffers_summary()).encode())
+            return
+        
+        if urlparse(self.path).path == '/metrics':
+            self.send_response(200)
+            if parse_qs(urlparse(self.path).query).get('format') == ['json']:
+                self.send_header('Content-type', 'application/json')
+                body = json.dumps(render_json()).encode()
+            else:
+                self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+                body = render_prometheus().encode()
+            self._send_cors_headers()
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        
+        if self.path == '/debug/runtime':
+            runtime = get_runtime()
+            self.send_response(200 if runtime else 404)
+            self.send_header('Content-type', 'application/json')
+            self._send_cors_headers()
+            self.end_headers()
+            body = runtime.stats_threadsafe() if runtime else {'error': 'not running under the headless runtime'}
+            self.wfile.write(json.dumps(body).encode())
+            return
+        
+        if self.path == '/debug/governor':
+            governor = get_governor()
+            self.send_response(200 if governor else 404)
+            self.send_header('Content-type', 'application/json')
+            self._send_cors_headers()
+            self.end_headers()
+            body = governor.state() if governor else {'error': 'CPU governor not running (GOVERNOR=0 or GUI mode)'}
+            self.wfile.write(json.dumps(body).encode())
+            return
+        
+        if urlparse(self.path).path == '/debug/trace':
+            # /debug/trace?seconds=5 records spans for 5 s and returns Chrome trace JSON
+            try:
+                seconds = float(parse_qs(urlparse(self.path).query).get('seconds', ['5'])[0])
+                status, body = 200, trace.record(seconds)
+            except ValueError:
+                status, body = 400, {'error': 'seconds must be a number'}
+            except trace.TraceBusy as e:
+                status, body = 409, {'error': str(e)}
+            self.send_response(status)
+            self.send_header('Content-type', 'application/json')
+            if status == 200:
+                self.send_header('Content-Disposition', 'attachment; filename="trace.json"')
+            self._send_cors_headers()
+            self.end_headers()
+            self.wfile.write(json.dumps(body).encode())
+            return
+        
+        if self.path.startswith('/debug/log'):
+            # /debug/log?level=debug&logger=mjpeg switches traces on at runtime
+            query = parse_qs(urlparse(self.path).query)
+            status, body = 200, None
+            if 'level' in query:
+                try:
+                    set_level(query['level'][0], query.get('logger', [None])[0])
+                except ValueError as e:
+                    status, body = 400, {'error': str(e)}
+            self.send_response(status)
+            self.send_header('Content-type', 'application/json')
+            self._send_cors_headers()
+            self.end_headers()
+            self.wfile.write(json.dumps(body or get_levels()).encode())
+            return
+        
+        if self.path == '/monitors':
+            try:
+                monitors = get_monitor_capture().monitors()
+                subscribers = get_monitor_capture().subscribers()
+                status = 200
+                body = [
+                    dict(monitor, index=index, path=f'/monitor/{index}', streams=subscribers.get(index, 0))
+                    for index, monitor in enumerate(monitors) if index > 0
+                ]
+            except Exception as e:
+                status, body = 503, {'error': f'capture unavailable: {e}'}
+            self.send_response(status)
+            self.send_header('Content-type', 'application/json')
+            self._send_cors_headers()
+            self.end_headers()
+            self.wfile.write(json.dumps(body).encode())
+            return
+        
+        # / streams the configured monitor, /monitor/N any other one
+        path = urlparse(self.path).path
+        if path.startswith('/monitor/') and path[len('/monitor/'):].isdigit():
+            index = int(path[len('/monitor/'):])
+        elif path == '/':
+            index = None if USE_DXCAM else server_settings.monitor_index
+        else:
             self.send_error(404)
             return
         
+        if index is None:
+            stream = self._stream_dxcam
+        else:
+            try:
+                subscription = get_monitor_capture().subscribe(index, get_settings()['target_fps'])
+            except ValueError as e:
+                self.send_error(404, str(e))
+                return
+            except Exception as e:
+                self.send_error(503, f'capture unavailable: {e}')
+                return
+            stream = lambda: self._stream_monitor(subscription)
+        
         self.send_response(200)
         self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
         self.send_header('Cache-Control', 'no-cache')
         self.end_headers()
         
-        settings = get_settings()
-        jpeg_quality = settings['jpeg_quality']
-        target_fps = settings['target_fps']
-        scale_factor = settings['scale_factor']
-        
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
-        frame_count = 0
-        start_time = time.time()
-        frame_time = 1.0 / target_fps
-        
-        if USE_DXCAM:
-            self._stream_dxcam(encode_param, frame_time, scale_factor, target_fps, jpeg_quality)
-        else:
-            self._stream_mss(encode_param, frame_time, scale_factor, target_fps, jpeg_quality)
+        _stream_clients.inc()
+        try:
+            stream()
+        finally:
+            _stream_clients.dec()
+            if index is not None:
+                subscription.close()
     
-    def _stream_dxcam(self, encode_param, frame_time, scale_factor, target_fps, jpeg_quality):
+    def _stream_dxcam(self):
         camera = get_dxcam_camera()
         if camera is None:
             return
         
         frame_count = 0
         start_time = time.time()
-        target_w = None
-        target_h = None
+        version = None
         
         while True:
             loop_start = time.time()
+            # Settings changed (POST /config or the CPU governor): apply from this frame
+            if version != _settings_version:
+                version, encode_param, frame_time, scale_factor = _stream_params()
+                target_w = None
+                target_h = None
             try:
+                grab_start = now()
                 frame = camera.grab()
                 if frame is None:
                     time.sleep(0.001)
                     continue
+                stages = {'capture': now()}
+                capture_seconds.observe(stages['capture'] - grab_start)
                 
                 # Calculate target size on first frame
                 if target_w is None and scale_factor < 1.0:
@@ -140,82 +322,107 @@ class MJPEGHandler(BaseHTTPRequestHandler):
                 # Resize if needed
                 if scale_factor < 1.0 and target_w:
                     frame = cv2.resize(frame, (target_w, target_h), interpolation=cv2.INTER_NEAREST)
+                if server_settings.latency_marker:
+                    marker.stamp(frame, frame_count + 1, stages['capture'])
+                stages['transform'] = now()
                 
                 # Encode JPEG
                 success, jpeg = cv2.imencode('.jpg', frame, encode_param)
                 if not success:
+                    encode_failed.inc()
                     continue
+                stages['encode'] = now()
                 
                 # Send frame
+                frame_count += 1
                 frame_data = jpeg.tobytes()
-                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
+                self.wfile.write(
+                    mjpeg_part_header(frame_count, stages['capture'], len(frame_data)) + frame_data + b'\r\n'
+                )
+                stages['send'] = now()
+                encoded_bytes.inc(len(frame_data))
+                latency_tracker.record('mjpeg', stages)
+                if trace.enabled:
+                    trace.stage_spans('mjpeg', stages, grab_start, frame=frame_count)
                 
-                frame_count += 1
-                if frame_count % 60 == 0:
+                if frame_count % 60 == 0 and logger.isEnabledFor(logging.DEBUG):
                     elapsed = time.time() - start_time
-                    fps = frame_count / elapsed
-                    print(f"FPS: {fps:.1f}")
+                    logger.debug(f"FPS: {frame_count / elapsed:.1f}")
                 
                 # Frame limiter
                 elapsed = time.time() - loop_start
                 sleep_time = frame_time - elapsed
                 if sleep_time > 0.001:
                     time.sleep(sleep_time)
+                elif sleep_time < 0:
+                    deadline_missed.inc()
                     
             except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
                 break
             except Exception as e:
-                print(f"Error: {e}")
+                logger.warning(f"Stream error: {e}")
                 break
     
-    def _stream_mss(self, encode_param, frame_time, scale_factor, target_fps, jpeg_quality):
-        import mss
+    def _stream_monitor(self, subscription):
+        """Send one monitor's frames from the shared capture (core.capture.MonitorCapture)"""
         frame_count = 0
         start_time = time.time()
+        version = None
+        previous = None
         
-        with mss.mss() as sct:
-            monitor = sct.monitors[1]
-            target_w = None
-            target_h = None
-            
-            if scale_factor < 1.0:
-                temp_img = sct.grab(monitor)
-                temp_frame = np.array(temp_img)
-                h, w = temp_frame.shape[:2]
-                target_w = int(w * scale_factor)
-                target_h = int(h * scale_factor)
-            
-            while True:
-                loop_start = time.time()
-                try:
-                    img = sct.grab(monitor)
-                    frame = np.array(img)[:, :, :3]
-                    
-                    if scale_factor < 1.0 and target_w:
-                        frame = cv2.resize(frame, (target_w, target_h), interpolation=cv2.INTER_NEAREST)
-                    
-                    success, jpeg = cv2.imencode('.jpg', frame, encode_param)
-                    if not success:
-                        continue
-                    
-                    frame_data = jpeg.tobytes()
-                    self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-                    
-                    frame_count += 1
-                    if frame_count % 60 == 0:
-                        fps = frame_count / (time.time() - start_time)
-                        print(f"FPS: {fps:.1f}")
+        while True:
+            if version != _settings_version:
+                version, encode_param, frame_time, scale_factor = _stream_params()
+                subscription.fps = 1.0 / frame_time
+                target_w = None
+                target_h = None
+            try:
+                # The capture thread paces frames; a slow client skips to the newest
+                grabbed = subscription.wait_for_frame(previous, timeout=1.0)
+                if grabbed is None:
+                    continue
+                if previous is not None and grabbed.frame_id > previous.frame_id + 1:
+                    skipped_frames.inc(grabbed.frame_id - previous.frame_id - 1)
+                previous = grabbed
+                stages = dict(grabbed.stages)
+                frame = grabbed.data  # Shared view: resize or encode it, never write to it
+                
+                # Calculate target size on the first frame at this scale
+                if target_w is None and scale_factor < 1.0:
+                    target_w = int(grabbed.width * scale_factor)
+                    target_h = int(grabbed.height * scale_factor)
+                
+                if scale_factor < 1.0 and target_w:
+                    frame = cv2.resize(frame, (target_w, target_h), interpolation=cv2.INTER_NEAREST)
+                    if server_settings.latency_marker:
+                        marker.stamp(frame, grabbed.frame_id, stages['capture'])  # Full-size cells
+                stages['transform'] = now()
+                
+                success, jpeg = cv2.imencode('.jpg', frame, encode_param)
+                if not success:
+                    encode_failed.inc()
+                    continue
+                stages['encode'] = now()
+                
+                frame_count += 1
+                frame_data = jpeg.tobytes()
+                self.wfile.write(
+                    mjpeg_part_header(frame_count, stages['capture'], len(frame_data)) + frame_data + b'\r\n'
+                )
+                stages['send'] = now()
+                encoded_bytes.inc(len(frame_data))
+                latency_tracker.record('mjpeg', stages)
+                if trace.enabled:
+                    trace.stage_spans('mjpeg', stages, frame=grabbed.frame_id, monitor=subscription.index)
+                
+                if frame_count % 60 == 0 and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Monitor {subscription.index} FPS: {frame_count / (time.time() - start_time):.1f}")
                     
-                    elapsed = time.time() - loop_start
-                    sleep_time = frame_time - elapsed
-                    if sleep_time > 0.001:
-                        time.sleep(sleep_time)
-                        
-                except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
-                    break
-                except Exception as e:
-                    print(f"Error: {e}")
-                    break
+            except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+                break
+            except Exception as e:
+                logger.warning(f"Stream error: {e}")
+                break
     
     def do_POST(self):
         if self.path == '/config':
@@ -229,7 +436,7 @@ class MJPEGHandler(BaseHTTPRequestHandler):
                 self._send_cors_headers()
                 self.end_headers()
                 self.wfile.write(json.dumps(updated_settings).encode())
-                print(f"Settings updated: {updated_settings}")
+                logger.info(f"Settings updated: {updated_settings}")
             except Exception as e:
                 self.send_response(400)
                 self.send_header('Content-type', 'application/json')
@@ -246,9 +453,10 @@ def start_server():
     httpd = ThreadingHTTPServer((HOST, PORT), MJPEGHandler)
     settings = get_settings()
     print(f'=' * 50)
-    print(f'  MJPEG Stream Server ({"dxcam" if USE_DXCAM else "mss"})')
+    print(f'  MJPEG Stream Server ({"dxcam" if USE_DXCAM else server_settings.capture_method})')
     print(f'=' * 50)
     print(f'  URL: http://{HOST}:{PORT}/')
+    print(f'  Monitors: http://{HOST}:{PORT}/monitor/N (list at /monitors)')
     print(f'  Target FPS: {settings["target_fps"]}')
     print(f'  Quality: {settings["jpeg_quality"]}%')
     print(f'  Scale: {int(settings["scale_factor"]*100)}%')
@@ -264,9 +472,17 @@ def stop_server():
     if _dxcam_camera:
         del _dxcam_camera
         _dxcam_camera = None
-    print("MJPEG Server stopped.")
+    logger.info("MJPEG Server stopped.")
+
+async def serve():
+    """Serve on a worker thread until cancelled (used by the headless runtime)"""
+    try:
+        await run_in_thread(start_server, name='mjpeg-server')
+    finally:
+        await run_in_thread(stop_server, name='mjpeg-stop')
 
 if __name__ == '__main__':
+    setup_logging()
     try:
         start_server()
     except KeyboardInterrupt:
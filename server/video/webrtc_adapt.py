@@ -0,0 +1,146 @@
+# Per-peer resolution and frame-rate adaptation
+import asyncio
+import time
+from typing import Optional
+
+from utils.log import get_logger
+
+logger = get_logger('webrtc')
+
+# Quality ladder: (scale, fraction of target fps). Resolution drops first,
+# frame rate last, since frame pacing matters most for games.
+LADDER = [
+    (1.0, 1.0),
+    (0.75, 1.0),
+    (0.5, 1.0),
+    (0.5, 0.5),
+    (0.35, 0.5),
+    (0.25, 0.25),
+]
+
+
+class PeerRateController:
+    """
+    Steps a PeerVideoTrack down the quality ladder when the peer reports
+    congestion (REMB below the send rate, receiver-report loss or RTT
+    growth) and back up once it recovers.
+
+    Hysteresis: a step down needs `down_after` congested samples in a row,
+    a step up needs `up_after` clean samples and `hold` seconds since the
+    last change. Each failed probe upwards doubles the hold time.
+    aiortc does not implement transport-cc feedback, so REMB is the
+    bandwidth signal.
+    """
+
+    def __init__(self, stats, track, target_fps: int, interval: float = 1.0,
+                 down_after: int = 2, up_after: int = 5, hold: float = 5.0,
+                 loss_threshold: float = 0.05, remb_margin: float = 0.85):
+        self.stats = stats
+        self.track = track
+        self.target_fps = target_fps
+        self.interval = interval
+        self.down_after = down_after
+        self.up_after = up_after
+        self.base_hold = hold
+        self.hold = hold
+        self.loss_threshold = loss_threshold
+        self.remb_margin = remb_margin
+
+        self.level = 0
+        self.reason = ''
+        self._congested = 0
+        self._clean = 0
+        self._last_change = time.time()
+        self._probing = False
+        self._min_rtt: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.apply()
+
+    def start(self) -> None:
+        """Start the control loop on the running event loop"""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        """Stop the control loop"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def apply(self) -> None:
+        """Push the current ladder level to the track"""
+        scale, fps_fraction = LADDER[self.level]
+        self.track.scale = scale
+        self.track.max_fps = max(1, int(self.target_fps * fps_fraction))
+
+    def state(self) -> dict:
+        """Current adaptation state for stats output"""
+        return {
+            'level': self.level,
+            'scale': self.track.scale,
+            'max_fps': self.track.max_fps,
+            'reason': self.reason,
+        }
+
+    def congestion_reason(self, sample: dict) -> Optional[str]:
+        """Return why the sample looks congested, or None if it is clean"""
+        fraction_lost = sample.get('fraction_lost') or 0.0
+        if fraction_lost > self.loss_threshold:
+            return f"loss {fraction_lost:.1%}"
+
+        remb = sample.get('remb_bps')
+        bitrate = sample.get('bitrate_bps') or 0
+        if remb and bitrate and remb < bitrate * self.remb_margin:
+            return f"remb {remb / 1e6:.2f} < sent {bitrate / 1e6:.2f} Mbps"
+
+        rtt = sample.get('rtt_ms')
+        if rtt is not None:
+            self._min_rtt = rtt if self._min_rtt is None else min(self._min_rtt, rtt)
+            if rtt > self._min_rtt * 2 + 50:
+                return f"rtt {rtt:.0f}ms (min {self._min_rtt:.0f}ms)"
+        return None
+
+    def update(self, sample: dict) -> None:
+        """Feed one stats sample and step the ladder if needed"""
+        reason = self.congestion_reason(sample)
+        now = time.time()
+
+        if reason:
+            self._congested += 1
+            self._clean = 0
+            if self._congested >= self.down_after and self.level < len(LADDER) - 1:
+                # Going down soon after going up means the probe failed
+                if self._probing and now - self._last_change < self.hold:
+                    self.hold = min(self.hold * 2, 60.0)
+                self._step(self.level + 1, reason, now)
+        else:
+            self._clean += 1
+            self._congested = 0
+            if (self._clean >= self.up_after and self.level > 0
+                    and now - self._last_change >= self.hold):
+                self._step(self.level - 1, 'recovered', now)
+
+        # A long stable period resets the probe back-off
+        if now - self._last_change > self.base_hold * 6:
+            self.hold = self.base_hold
+
+    def _step(self, level: int, reason: str, now: float) -> None:
+        old = self.level
+        self._probing = level < old
+        self.level = level
+        self.reason = reason
+        self._congested = 0
+        self._clean = 0
+        self._last_change = now
+        self.apply()
+        logger.info(
+            f"Peer {self.stats.id}: quality level {old} -> {level} "
+            f"(scale {self.track.scale}, {self.track.max_fps} fps) - {reason}"
+        )
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.update(await self.stats.collect(sample_bitrate=True))
+            except Exception as e:
+                logger.warning(f"Peer {self.stats.id}: adaptation sample failed: {e}")
@@ -0,0 +1,85 @@
+# Pre-encoded H.264 track for WebRTC
+import asyncio
+from typing import Optional
+
+try:
+    from aiortc import RTCRtpSender
+    from aiortc.mediastreams import MediaStreamTrack
+    import av
+    WEBRTC_AVAILABLE = True
+except ImportError:
+    WEBRTC_AVAILABLE = False
+
+from config.settings import settings
+from core import trace
+from core.encoder import VideoEncoder, EncoderConfig, parse_bitrate
+from core.latency import now
+from video.webrtc_stats import peer_executor
+
+
+class H264EncodedTrack(MediaStreamTrack if WEBRTC_AVAILABLE else object):
+    """
+    Wraps a frame track and hands aiortc pre-encoded H.264 packets from
+    VideoEncoder (ultrafast/zerolatency or hardware, settings.video_bitrate).
+    aiortc only packetizes these, skipping its own encoder. The bitrate
+    follows REMB like aiortc's encoders do, capped at the configured value.
+    """
+    kind = "video"
+
+    def __init__(self, source, stats=None):
+        if WEBRTC_AVAILABLE:
+            super().__init__()
+        self.source = source
+        self.stats = stats
+        self.encoder = VideoEncoder(EncoderConfig(
+            codec=settings.video_codec,
+            bitrate=settings.video_bitrate,
+            fps=settings.target_fps,
+        ))
+        self.max_bitrate = parse_bitrate(settings.video_bitrate)
+
+    def _encode(self, frame, force_keyframe: bool) -> Optional['av.Packet']:
+        """Encode one frame (runs in an executor)"""
+        started = now()
+        packets = self.encoder.encode_video_frame(frame, force_keyframe)
+        if trace.enabled:
+            trace.span('encode', 'webrtc', started, now(), keyframe=force_keyframe, packets=len(packets or ()))
+        if not packets:
+            return None
+        packet = packets[0] if len(packets) == 1 else av.Packet(b''.join(bytes(p) for p in packets))
+        # Keep the source frame's timeline
+        packet.pts = frame.pts
+        packet.time_base = frame.time_base
+        return packet
+
+    async def recv(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            frame = await self.source.recv()
+            force_keyframe = False
+            if self.stats:
+                if self.stats.keyframe_requested:
+                    self.stats.keyframe_requested = False
+                    force_keyframe = True
+                # Follow the receiver's bandwidth estimate, capped at the configured bitrate
+                if self.stats.remb_bitrate:
+                    self.encoder.set_bitrate(min(self.max_bitrate, self.stats.remb_bitrate))
+            packet = await loop.run_in_executor(peer_executor, self._encode, frame, force_keyframe)
+            if packet is not None:
+                return packet
+
+    def stop(self):
+        super().stop()
+        self.source.stop()
+        self.encoder.stop()
+
+
+def prefer_h264(pc, sender) -> None:
+    """Restrict the sender's transceiver to H.264 (plus RTX) for pre-encoded packets"""
+    codecs = [
+        codec for codec in RTCRtpSender.getCapabilities('video').codecs
+        if codec.mimeType in ('video/H264', 'video/rtx')
+    ]
+    for transceiver in pc.getTransceivers():
+        if transceiver.sender is sender:
+            transceiver.setCodecPreferences(codecs)
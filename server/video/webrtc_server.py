@@ -1,21 +1,21 @@
 # WebRTC streaming server
 import asyncio
 import json
-import logging
 from aiohttp import web
-from typing import Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from typing import Dict, List, Optional, Set
 import time
 
 # Try to import aiortc
 try:
-    from aiortc import RTCPeerConnection, RTCSessionDescription
+    from aiortc import RTCConfiguration, RTCIceServer, RTCPeerConnection, RTCSessionDescription
     from aiortc.contrib.media import MediaPlayer, MediaRelay
     from aiortc.mediastreams import MediaStreamTrack
     import av
     WEBRTC_AVAILABLE = True
 except ImportError:
     WEBRTC_AVAILABLE = False
-    print("⚠ aiortc not installed. Run: pip install aiortc aiohttp av")
 
 import sys
 import os
@@ -23,20 +23,63 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.settings import settings
 from core.capture import get_capture, Frame
+from core.governor import get_governor, register_target
+from core.latency import latency_tracker, now
+from core.metrics import CLIENTS, FRAMES_DROPPED, QUEUE_DEPTH, render_json, render_prometheus
+from core.runtime import get_runtime
+from core import trace
+from input.clock import clients_summary
+from input.jitter import buffers_summary
 from utils.network import get_local_ip
+from utils.loop_monitor import LoopLagMonitor
+from utils.log import get_logger, get_levels, set_level, setup_logging
+from video.webrtc_stats import PeerStats, PeerVideoTrack
+from video.webrtc_adapt import PeerRateController
+from video.webrtc_h264 import H264EncodedTrack, prefer_h264
+
+# Controller input over DataChannels (virtual devices come from input.backends)
+try:
+    from input import input_server
+    from input.protocol import BinaryDecoder
+    from input.recorder import open_recorder
+    INPUT_AVAILABLE = True
+except ImportError:
+    INPUT_AVAILABLE = False
+
+# Negotiated DataChannel ids, shared with the client page
+AXES_CHANNEL_ID = 0     # unordered, maxRetransmits=0: stale stick samples are never resent
+BUTTONS_CHANNEL_ID = 1  # reliable, ordered: presses and releases must not be lost
 
 # Logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger('webrtc')
+logger = get_logger('webrtc')
+if not WEBRTC_AVAILABLE:
+    logger.warning("⚠ aiortc not installed. Run: pip install aiortc aiohttp av")
 
 # Active peer connections
 pcs: Set['RTCPeerConnection'] = set()
+peer_stats: Dict['RTCPeerConnection', PeerStats] = {}
+input_slots: Dict['RTCPeerConnection', 'input_server.ControllerSlot'] = {}  # Controller per peer
+input_recorders: Dict['RTCPeerConnection', 'SessionRecorder'] = {}  # With INPUT_RECORD_DIR
 relay = None
+source_track: Optional['ScreenVideoTrack'] = None
+
+# Frame conversion runs here so the event loop only awaits finished frames
+_frame_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='webrtc-frame')
+loop_monitor = LoopLagMonitor()
+CLIENTS.callbacks.append(lambda: {'webrtc': len(pcs)})
+QUEUE_DEPTH.callbacks.append(lambda: {'webrtc_frame': _frame_executor._work_queue.qsize()})
+_stats_task: Optional[asyncio.Task] = None
+
+# Peer connections created ahead of time: (pc, stats, track)
+_pc_pool: List[tuple] = []
+_pool_task: Optional[asyncio.Task] = None
+_prewarm_warned = False  # create_peer_connection logs a missing ICE gatherer once
 
 
 class ScreenVideoTrack(MediaStreamTrack if WEBRTC_AVAILABLE else object):
     """
-    A video track that captures the screen and streams via WebRTC
+    A video track that streams frames from the background screen capture thread.
+    A single instance is shared by all peers through MediaRelay.
     """
     kind = "video"
     
@@ -44,52 +87,210 @@ class ScreenVideoTrack(MediaStreamTrack if WEBRTC_AVAILABLE else object):
         if WEBRTC_AVAILABLE:
             super().__init__()
         self.capture = get_capture()
-        self.capture.start()
-        self._start_time = None
-        self._frame_count = 0
+        self.capture.start_continuous(settings.target_fps)
+        self._last_frame: Optional[Frame] = None
+        self._first_capture_ts: Optional[float] = None
+        self._last_pts = -1
         self._target_fps = settings.target_fps
         self._frame_duration = 1.0 / self._target_fps
         
-    async def recv(self):
-        """Receive the next frame"""
-        if not WEBRTC_AVAILABLE:
-            raise RuntimeError("aiortc not available")
-            
-        if self._start_time is None:
-            self._start_time = time.time()
-        
-        # Capture frame
-        frame_data = self.capture.capture_frame()
+    def _next_video_frame(self):
+        """Wait for a new capture and convert it (runs in the frame executor)"""
+        frame_data = self.capture.wait_for_frame(self._last_frame, timeout=self._frame_duration * 4)
         
         if frame_data is None:
             # Return a black frame if capture fails
+            FRAMES_DROPPED.labels('webrtc', 'capture_timeout').inc()
             import numpy as np
+            captured_at = now()
             frame_data = Frame(
                 data=np.zeros((720, 1280, 3), dtype=np.uint8),
-                timestamp=time.time(),
+                timestamp=captured_at,
                 width=1280,
-                height=720
+                height=720,
+                stages={'capture': captured_at}
             )
+        else:
+            # Frames captured while the track was busy are never sent
+            if self._last_frame is not None and frame_data.frame_id > self._last_frame.frame_id + 1:
+                FRAMES_DROPPED.labels('webrtc', 'skipped').inc(frame_data.frame_id - self._last_frame.frame_id - 1)
+            self._last_frame = frame_data
         
-        # Convert to av.VideoFrame
+        # Convert to av.VideoFrame, carrying frame id and stage times for latency stats
+        converting = now()
         frame = av.VideoFrame.from_ndarray(frame_data.data, format='bgr24')
+        frame.opaque = (frame_data.frame_id, dict(frame_data.stages))
+        if trace.enabled:
+            trace.span('convert', 'webrtc', converting, now(), frame=frame_data.frame_id)
+        return frame
         
-        # Set timestamp for proper playback
-        pts = int(self._frame_count * self._frame_duration * 90000)  # 90kHz timebase
-        frame.pts = pts
-        frame.time_base = av.Rational(1, 90000)
+    async def recv(self):
+        """Receive the next frame"""
+        if not WEBRTC_AVAILABLE:
+            raise RuntimeError("aiortc not available")
         
-        self._frame_count += 1
+        # Capture thread paces frames at target fps; we only wait for the next one
+        loop = asyncio.get_running_loop()
+        frame = await loop.run_in_executor(_frame_executor, self._next_video_frame)
         
-        # Frame rate limiting
-        elapsed = time.time() - self._start_time
-        expected = self._frame_count * self._frame_duration
-        if expected > elapsed:
-            await asyncio.sleep(expected - elapsed)
+        # Timestamps follow capture time so the receiver sees real frame spacing
+        captured_at = frame.opaque[1]['capture']
+        if self._first_capture_ts is None:
+            self._first_capture_ts = captured_at
+        pts = int((captured_at - self._first_capture_ts) * 90000)  # 90kHz timebase
+        pts = max(pts, self._last_pts + 1)
+        self._last_pts = pts
+        frame.pts = pts
+        frame.time_base = Fraction(1, 90000)
         
         return frame
 
 
+def get_source_track() -> 'ScreenVideoTrack':
+    """Get or create the shared screen track"""
+    global source_track, relay
+    if relay is None:
+        relay = MediaRelay()
+    if source_track is None or source_track.readyState == 'ended':
+        source_track = ScreenVideoTrack()
+    return source_track
+
+
+def _governor_settings() -> dict:
+    capture = get_capture()
+    return {
+        'target_fps': round(1.0 / capture._frame_time),
+        'scale_factor': capture.scale_factor,
+        'jpeg_quality': settings.jpeg_quality,
+    }
+
+
+def _apply_governor_settings(values: dict) -> None:
+    """Change the shared capture rate and size (peers' encoders follow the new size)"""
+    capture = get_capture()
+    capture.set_fps(values['target_fps'])
+    capture.set_scale(values['scale_factor'])
+    if source_track:
+        source_track._frame_duration = 1.0 / values['target_fps']
+
+
+# The shared capture follows the CPU governor (core/governor.py)
+register_target('webrtc', _governor_settings, _apply_governor_settings)
+
+
+def attach_input_channel(pc, channel):
+    """Feed a DataChannel's messages to the peer's controller"""
+    slot = input_slots.get(pc)
+    if slot is None:
+        return
+    # Sequence numbers and button state are per channel
+    decoder = BinaryDecoder()
+    recorder = input_recorders.get(pc)
+    
+    @channel.on('message')
+    def on_message(message):
+        input_server.handle_raw_message(slot, message, decoder, recorder=recorder)
+    
+    @channel.on('close')
+    def on_close():
+        slot.reset()
+
+
+def release_input_slot(pc):
+    """Free the peer's controller slot (safe to call more than once)"""
+    slot = input_slots.pop(pc, None)
+    if slot is not None:
+        input_server.release_slot(slot)
+    recorder = input_recorders.pop(pc, None)
+    if recorder is not None:
+        recorder.close()
+
+
+def setup_input_channels(pc, client: str):
+    """Give the peer a controller and create its pre-negotiated input channels"""
+    if not INPUT_AVAILABLE:
+        return
+    input_server.ensure_input_ready()
+    slot = input_server.acquire_slot(client)
+    if slot is None:
+        logger.warning(f"All controller slots in use, no input for {client}")
+        return
+    input_slots[pc] = slot
+    recorder = open_recorder(client)
+    if recorder:
+        input_recorders[pc] = recorder
+    
+    axes = pc.createDataChannel(
+        'input-axes', ordered=False, maxRetransmits=0,
+        negotiated=True, id=AXES_CHANNEL_ID
+    )
+    buttons = pc.createDataChannel(
+        'input-buttons', ordered=True,
+        negotiated=True, id=BUTTONS_CHANNEL_ID
+    )
+    attach_input_channel(pc, axes)
+    attach_input_channel(pc, buttons)
+    
+    # Clients may also open their own (non-negotiated) input channels
+    @pc.on('datachannel')
+    def on_datachannel(channel):
+        if channel.label.startswith('input'):
+            attach_input_channel(pc, channel)
+
+
+def get_ice_servers() -> List[str]:
+    """ICE server URLs; none in LAN mode so only host candidates are gathered"""
+    if settings.ice_lan_only:
+        return []
+    return [url.strip() for url in settings.ice_servers.split(',') if url.strip()]
+
+
+async def create_peer_connection(prewarm: bool = False):
+    """Create a peer connection with its video sender, ready for an offer"""
+    # An explicit empty list stops aiortc falling back to Google STUN
+    config = RTCConfiguration(iceServers=[RTCIceServer(urls=url) for url in get_ice_servers()])
+    pc = RTCPeerConnection(configuration=config)
+    stats = PeerStats(pc)
+    
+    # Add video track (unbuffered so a slow peer only ever gets the latest frame)
+    track = get_source_track()
+    peer_track = PeerVideoTrack(relay.subscribe(track, buffered=False), stats)
+    if settings.webrtc_encoder == 'ffmpeg':
+        sender = pc.addTrack(H264EncodedTrack(peer_track, stats))
+        prefer_h264(pc, sender)
+    else:
+        sender = pc.addTrack(peer_track)
+    stats.watch_sender(sender)
+    
+    if prewarm:
+        # Gather candidates now; setLocalDescription skips gathering once complete.
+        # aiortc internals (checked against the range requirements.txt pins):
+        # without them candidates are gathered at answer time as usual
+        dtls = getattr(sender, 'transport', None)
+        gatherer = getattr(getattr(dtls, 'transport', None), 'iceGatherer', None)
+        if callable(getattr(gatherer, 'gather', None)):
+            await gatherer.gather()
+        else:
+            global _prewarm_warned
+            if not _prewarm_warned:
+                _prewarm_warned = True
+                logger.warning("This aiortc has no sender ICE gatherer: pooled connections gather at answer time")
+    return pc, stats, peer_track
+
+
+async def fill_pc_pool():
+    """Top the pool of pre-created peer connections back up"""
+    while len(_pc_pool) < settings.pc_pool_size:
+        _pc_pool.append(await create_peer_connection(prewarm=True))
+
+
+def refill_pc_pool():
+    """Schedule a pool refill unless one is already running"""
+    global _pool_task
+    if settings.pc_pool_size > 0 and (_pool_task is None or _pool_task.done()):
+        _pool_task = asyncio.get_running_loop().create_task(fill_pc_pool())
+
+
 async def handle_offer(request):
     """Handle WebRTC offer from client"""
     if not WEBRTC_AVAILABLE:
@@ -99,27 +300,42 @@ async def handle_offer(request):
             content_type='application/json'
         )
     
+    offer_time = time.time()
     params = await request.json()
     offer = RTCSessionDescription(sdp=params['sdp'], type=params['type'])
     
-    pc = RTCPeerConnection()
+    pooled = bool(_pc_pool)
+    if pooled:
+        pc, stats, peer_track = _pc_pool.pop(0)
+    else:
+        pc, stats, peer_track = await create_peer_connection()
+    refill_pc_pool()
+    stats.start_session(request.remote or 'unknown', offer_time, pooled)
     pcs.add(pc)
+    peer_stats[pc] = stats
     
     @pc.on('connectionstatechange')
     async def on_connectionstatechange():
-        logger.info(f"Connection state: {pc.connectionState}")
+        logger.info(f"Connection state [{stats.id}]: {pc.connectionState}")
         if pc.connectionState == 'failed' or pc.connectionState == 'closed':
+            if stats.controller:
+                stats.controller.stop()
             await pc.close()
             pcs.discard(pc)
+            peer_stats.pop(pc, None)
+            release_input_slot(pc)
     
-    # Add video track
-    video_track = ScreenVideoTrack()
-    pc.addTrack(video_track)
+    if settings.adaptive_streaming:
+        stats.controller = PeerRateController(stats, peer_track, settings.target_fps)
+        stats.controller.start()
     
     # Set remote description and create answer
     await pc.setRemoteDescription(offer)
+    if 'm=application' in offer.sdp:
+        setup_input_channels(pc, f"webrtc {stats.id}")
     answer = await pc.createAnswer()
     await pc.setLocalDescription(answer)
+    stats.answer_time = time.time()
     
     return web.Response(
         content_type='application/json',
@@ -152,9 +368,17 @@ async def handle_index(request):
         
         async function start() {
             const pc = new RTCPeerConnection({
-                iceServers: [{ urls: 'stun:stun.l.google.com:19302' }]
+                iceServers: __ICE_SERVERS__.map(url => ({ urls: url }))
             });
             
+            // Controller input: lossy unordered channel for sticks, reliable one for buttons
+            const axes = pc.createDataChannel('input-axes', { negotiated: true, id: 0, ordered: false, maxRetransmits: 0 });
+            const buttons = pc.createDataChannel('input-buttons', { negotiated: true, id: 1, ordered: true });
+            window.sendInput = (msg) => {
+                const channel = (msg.type === 'left_stick' || msg.type === 'right_stick') ? axes : buttons;
+                if (channel.readyState === 'open') channel.send(JSON.stringify(msg));
+            };
+            
             pc.ontrack = (event) => {
                 video.srcObject = event.streams[0];
                 status.textContent = 'Connected!';
@@ -162,6 +386,11 @@ async def handle_index(request):
             
             pc.onconnectionstatechange = () => {
                 status.textContent = 'State: ' + pc.connectionState;
+                // Reconnect straight away after a Wi-Fi roam instead of waiting for ICE timeouts
+                if (pc.connectionState === 'failed' || pc.connectionState === 'disconnected') {
+                    pc.close();
+                    setTimeout(() => start().catch(e => status.textContent = 'Error: ' + e), 250);
+                }
             };
             
             // Create offer
@@ -188,14 +417,145 @@ async def handle_index(request):
 </body>
 </html>
 """
+    html = html.replace('__ICE_SERVERS__', json.dumps(get_ice_servers()))
     return web.Response(content_type='text/html', text=html)
 
 
+async def collect_stats() -> list:
+    """Collect stats for every active peer"""
+    results = await asyncio.gather(
+        *(stats.collect() for stats in list(peer_stats.values())),
+        return_exceptions=True
+    )
+    return [r for r in results if not isinstance(r, Exception)]
+
+
+async def handle_stats(request):
+    """Return per-peer connection quality statistics"""
+    return web.json_response({
+        'timestamp': time.time(),
+        'peers': await collect_stats(),
+        'latency': latency_tracker.summary(),
+        'input': clients_summary(),
+        'input_jitter': buffers_summary(),
+        'loop_lag': loop_monitor.stats(),
+    })
+
+
+async def handle_input_latency(request):
+    """Return per-client input RTT and one-way latency histograms"""
+    return web.json_response(clients_summary())
+
+
+async def handle_input_jitter(request):
+    """Return jitter buffer depth and counters per player (INPUT_JITTER_BUFFER)"""
+    return web.json_response(buffers_summary())
+
+
+async def handle_metrics(request):
+    """Pipeline metrics in Prometheus text format, or JSON with ?format=json"""
+    if request.query.get('format') == 'json':
+        return web.json_response(render_json())
+    return web.Response(
+        body=render_prometheus().encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+    )
+
+
+async def handle_runtime_stats(request):
+    """Return supervised runtime statistics (headless mode only)"""
+    runtime = get_runtime()
+    if runtime is None:
+        return web.json_response({'error': 'not running under the headless runtime'}, status=404)
+    return web.json_response(runtime.stats())
+
+
+async def handle_loop_stats(request):
+    """Return event loop lag statistics"""
+    return web.json_response({
+        'loop_lag': loop_monitor.stats(),
+        'peers': len(pcs),
+    })
+
+
+async def handle_trace(request):
+    """Record spans for ?seconds=N (default 5) and return Chrome trace JSON for Perfetto"""
+    try:
+        seconds = float(request.query.get('seconds', 5))
+    except ValueError:
+        return web.json_response({'error': 'seconds must be a number'}, status=400)
+    try:
+        body = await trace.record_async(seconds)
+    except trace.TraceBusy as e:
+        return web.json_response({'error': str(e)}, status=409)
+    return web.json_response(body, headers={'Content-Disposition': 'attachment; filename="trace.json"'})
+
+
+async def handle_governor(request):
+    """Return the CPU governor's level and last load sample"""
+    governor = get_governor()
+    if governor is None:
+        return web.json_response({'error': 'CPU governor not running (GOVERNOR=0 or GUI mode)'}, status=404)
+    return web.json_response(governor.state())
+
+
+async def handle_log_level(request):
+    """Show log levels, or change one: /debug/log?level=debug&logger=input"""
+    level = request.query.get('level')
+    if level:
+        try:
+            set_level(level, request.query.get('logger'))
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+    return web.json_response(get_levels())
+
+
+async def log_stats_periodically(interval: float):
+    """Log one structured stats line per peer every `interval` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        for peer in await collect_stats():
+            logger.info("stats %s", json.dumps(peer))
+
+
+async def on_startup(app):
+    """Start background monitors"""
+    global _stats_task
+    loop_monitor.start()
+    if settings.pc_pool_size > 0 and WEBRTC_AVAILABLE:
+        # Start capturing now so the first pooled session has frames immediately
+        get_source_track()
+        refill_pc_pool()
+    if settings.stats_interval > 0:
+        _stats_task = asyncio.get_running_loop().create_task(
+            log_stats_periodically(settings.stats_interval)
+        )
+
+
 async def on_shutdown(app):
     """Cleanup on shutdown"""
+    global source_track
+    if _stats_task:
+        _stats_task.cancel()
+    if _pool_task:
+        _pool_task.cancel()
+    pooled = [pc.close() for pc, _, _ in _pc_pool]
+    await asyncio.gather(*pooled)
+    _pc_pool.clear()
+    for stats in peer_stats.values():
+        if stats.controller:
+            stats.controller.stop()
     coros = [pc.close() for pc in pcs]
     await asyncio.gather(*coros)
+    for pc in list(input_slots):
+        release_input_slot(pc)
     pcs.clear()
+    peer_stats.clear()
+    if source_track:
+        source_track.stop()
+        source_track.capture.stop()
+        source_track = None
+    await loop_monitor.stop()
 
 
 def create_app():
@@ -203,6 +563,16 @@ def create_app():
     app = web.Application()
     app.router.add_get('/', handle_index)
     app.router.add_post('/offer', handle_offer)
+    app.router.add_get('/stats', handle_stats)
+    app.router.add_get('/metrics', handle_metrics)
+    app.router.add_get('/input/latency', handle_input_latency)
+    app.router.add_get('/input/jitter', handle_input_jitter)
+    app.router.add_get('/debug/loop', handle_loop_stats)
+    app.router.add_get('/debug/runtime', handle_runtime_stats)
+    app.router.add_get('/debug/log', handle_log_level)
+    app.router.add_get('/debug/trace', handle_trace)
+    app.router.add_get('/debug/governor', handle_governor)
+    app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
     return app
 
@@ -217,6 +587,7 @@ def start_server(host: str = None, port: int = None):
     print("=" * 50)
     print(f"  URL: http://{get_local_ip()}:{port}/")
     print(f"  Target FPS: {settings.target_fps}")
+    print(f"  Encoder: {settings.webrtc_encoder}")
     print(f"  WebRTC Available: {WEBRTC_AVAILABLE}")
     print("=" * 50)
     
@@ -239,5 +610,15 @@ async def start_server_async(host: str = None, port: int = None):
     return runner
 
 
+async def serve(host: str = None, port: int = None):
+    """Serve until cancelled (used by the headless runtime)"""
+    runner = await start_server_async(host, port)
+    try:
+        await asyncio.Future()
+    finally:
+        await runner.cleanup()
+
+
 if __name__ == '__main__':
+    setup_logging()
     start_server()
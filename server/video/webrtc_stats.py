@@ -0,0 +1,304 @@
+# WebRTC connection statistics
+import asyncio
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from core import trace
+from core.latency import latency_tracker, now, percentile
+from core.metrics import ENCODED_BYTES
+from utils.log import get_logger
+
+try:
+    import av
+    from aiortc.mediastreams import MediaStreamTrack
+    from aiortc.rtp import (
+        RtcpPsfbPacket, RtcpRtpfbPacket,
+        RTCP_PSFB_APP, RTCP_PSFB_FIR, RTCP_PSFB_PLI, RTCP_RTPFB_NACK,
+        unpack_remb_fci,
+    )
+    WEBRTC_AVAILABLE = True
+except ImportError:
+    WEBRTC_AVAILABLE = False
+
+logger = get_logger('webrtc')
+
+# RTP clock rate used for video jitter reported in receiver reports
+VIDEO_CLOCK_RATE = 90000
+
+_rtcp_hook_warned = False  # watch_sender logs a missing aiortc hook once
+
+# Per-peer frame copies and H.264 encodes, on named threads so the runtime
+# charges their CPU to the webrtc component (not the loop's default executor)
+peer_executor = ThreadPoolExecutor(thread_name_prefix='webrtc-peer')
+
+
+class PeerStats:
+    """
+    Quality metrics for a single peer connection.
+    Combines RTCPeerConnection.getStats() with counters aiortc does not expose
+    (NACK/PLI/REMB) and server-side capture-to-send latency.
+    """
+
+    def __init__(self, pc, remote: str = 'unknown'):
+        self.pc = pc
+        self.id = uuid.uuid4().hex[:8]
+        self.remote = remote
+        self.created = time.time()
+
+        # Frames handed to the encoder
+        self.frames_sent = 0
+        self.width = 0
+        self.height = 0
+        self._frame_times = deque(maxlen=120)
+        self._latencies = deque(maxlen=300)
+
+        # RTCP feedback counters
+        self.nack_count = 0
+        self.nack_packets = 0
+        self.pli_count = 0
+        self.fir_count = 0
+        self.remb_bitrate: Optional[int] = None
+        self.keyframe_requested = False  # Consumed by pre-encoded tracks
+
+        # Previous sample for bitrate calculation
+        self._last_bytes: Optional[int] = None
+        self._last_bytes_time: Optional[float] = None
+        self.bitrate = 0.0
+
+        # Optional PeerRateController reporting its adaptation state
+        self.controller = None
+
+        # Session setup timing
+        self.pooled = False
+        self.offer_time: Optional[float] = None
+        self.answer_time: Optional[float] = None
+        self.first_frame_time: Optional[float] = None
+
+    def start_session(self, remote: str, offer_time: float, pooled: bool = False) -> None:
+        """Mark the start of negotiation (the POST /offer arrival)"""
+        self.remote = remote
+        self.created = offer_time
+        self.offer_time = offer_time
+        self.pooled = pooled
+
+    def _ms_since_offer(self, when: Optional[float]) -> Optional[float]:
+        if when is None or self.offer_time is None:
+            return None
+        return round((when - self.offer_time) * 1000, 1)
+
+    def watch_sender(self, sender) -> None:
+        """Count RTCP feedback received by a sender"""
+        # aiortc reports none of these in getStats() and has no public hook, so
+        # this wraps a private method (present in the aiortc range requirements.txt pins)
+        handle_rtcp = getattr(sender, '_handle_rtcp_packet', None)
+        if not callable(handle_rtcp):
+            global _rtcp_hook_warned
+            if not _rtcp_hook_warned:
+                _rtcp_hook_warned = True
+                logger.warning("This aiortc has no RTCRtpSender._handle_rtcp_packet: NACK/PLI/FIR/REMB "
+                               "are not counted and pre-encoded H.264 ignores keyframe requests")
+            return
+
+        async def counting_handle_rtcp(packet):
+            if isinstance(packet, RtcpRtpfbPacket) and packet.fmt == RTCP_RTPFB_NACK:
+                self.nack_count += 1
+                self.nack_packets += len(packet.lost)
+            elif isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_PLI:
+                self.pli_count += 1
+                self.keyframe_requested = True
+            elif isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_FIR:
+                self.fir_count += 1
+                self.keyframe_requested = True
+            elif isinstance(packet, RtcpPsfbPacket) and packet.fmt == RTCP_PSFB_APP:
+                try:
+                    self.remb_bitrate, _ = unpack_remb_fci(packet.fci)
+                except ValueError:
+                    pass
+            await handle_rtcp(packet)
+
+        # The DTLS transport looks this method up on the instance for every RTCP packet
+        sender._handle_rtcp_packet = counting_handle_rtcp
+
+    def record_frame(self, width: int, height: int) -> None:
+        """Record a frame handed to the encoder"""
+        self.frames_sent += 1
+        self.width = width
+        self.height = height
+        self._frame_times.append(time.time())
+
+    def record_sent(self, stages: dict) -> None:
+        """Record when a frame finished sending, given its pipeline stage times"""
+        sent_at = now()
+        self._latencies.append(sent_at - stages['capture'])
+        latency_tracker.record('webrtc', {**stages, 'send': sent_at})
+        if self.first_frame_time is None:
+            self.first_frame_time = time.time()
+            logger.info(
+                f"Peer {self.id}: first frame sent {self._ms_since_offer(self.first_frame_time)}ms after offer"
+                f"{' (pooled)' if self.pooled else ''}"
+            )
+
+    @property
+    def fps(self) -> float:
+        """Frames per second over the recent window"""
+        if len(self._frame_times) < 2:
+            return 0.0
+        span = self._frame_times[-1] - self._frame_times[0]
+        return (len(self._frame_times) - 1) / span if span > 0 else 0.0
+
+    def latency_stats(self) -> dict:
+        """Capture-to-send latency summary in milliseconds"""
+        values = sorted(self._latencies)
+        if not values:
+            return {'avg_ms': None, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+        return {
+            'avg_ms': round(sum(values) / len(values) * 1000, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+        }
+
+    async def collect(self, sample_bitrate: bool = False) -> dict:
+        """
+        Collect a stats snapshot for this peer.
+
+        Only one caller may move the bitrate window: the rate controller's
+        tick (sample_bitrate=True) when the peer has one, otherwise any
+        caller. Other callers report the last sampled bitrate, so /stats
+        polls do not shrink the window the controller compares with REMB.
+        """
+        report = await self.pc.getStats()
+
+        outbound = {}
+        remote_inbound = {}
+        for stat in report.values():
+            if stat.type == 'outbound-rtp' and getattr(stat, 'kind', None) == 'video':
+                outbound = stat
+            elif stat.type == 'remote-inbound-rtp' and getattr(stat, 'kind', None) == 'video':
+                remote_inbound = stat
+
+        bytes_sent = getattr(outbound, 'bytesSent', None)
+        sampled_at = time.time()
+        if bytes_sent is not None and (sample_bitrate or self.controller is None):
+            if self._last_bytes is not None and sampled_at > self._last_bytes_time:
+                self.bitrate = (bytes_sent - self._last_bytes) * 8 / (sampled_at - self._last_bytes_time)
+            # aiortc encodes inside the sender, so bytes are counted from RTP stats as they are polled
+            ENCODED_BYTES.labels('webrtc').inc(bytes_sent - (self._last_bytes or 0))
+            self._last_bytes = bytes_sent
+            self._last_bytes_time = sampled_at
+
+        rtt = getattr(remote_inbound, 'roundTripTime', None)
+        jitter = getattr(remote_inbound, 'jitter', None)
+        fraction_lost = getattr(remote_inbound, 'fractionLost', None)
+
+        return {
+            'peer': self.id,
+            'remote': self.remote,
+            'state': self.pc.connectionState,
+            'uptime_s': round(sampled_at - self.created, 1),
+            'rtt_ms': round(rtt * 1000, 2) if rtt is not None else None,
+            'jitter_ms': round(jitter * 1000 / VIDEO_CLOCK_RATE, 2) if jitter is not None else None,
+            'packets_sent': getattr(outbound, 'packetsSent', None),
+            'packets_lost': getattr(remote_inbound, 'packetsLost', None),
+            'fraction_lost': round(fraction_lost / 256, 4) if fraction_lost is not None else None,
+            'nack_count': self.nack_count,
+            'nack_packets': self.nack_packets,
+            'pli_count': self.pli_count,
+            'fir_count': self.fir_count,
+            'remb_bps': self.remb_bitrate,
+            'bytes_sent': bytes_sent,
+            'bitrate_bps': round(self.bitrate),
+            'frames_sent': self.frames_sent,
+            'fps': round(self.fps, 1),
+            'frame_width': self.width,
+            'frame_height': self.height,
+            'capture_to_send': self.latency_stats(),
+            'adaptation': self.controller.state() if self.controller else None,
+            'pooled': self.pooled,
+            'answer_ms': self._ms_since_offer(self.answer_time),
+            'time_to_first_frame_ms': self._ms_since_offer(self.first_frame_time),
+        }
+
+
+class PeerVideoTrack(MediaStreamTrack if WEBRTC_AVAILABLE else object):
+    """
+    Per-peer wrapper around the relayed screen track that feeds PeerStats
+    and applies this peer's scale and frame-rate limit.
+
+    aiortc's sender loop is recv -> encode -> send packets -> recv, so the
+    next recv() call marks the moment the previous frame left the sender.
+    """
+    kind = "video"
+
+    def __init__(self, source, stats: PeerStats):
+        if WEBRTC_AVAILABLE:
+            super().__init__()
+        self.source = source
+        self.stats = stats
+        self.scale = 1.0
+        self.max_fps: Optional[int] = None
+        self._pending_stages: Optional[dict] = None
+        self._handed_at = 0.0
+        self._last_sent: Optional[float] = None
+
+    async def _next_source_frame(self):
+        """Read relayed frames, dropping those above this peer's frame rate"""
+        while True:
+            frame = await self.source.recv()
+            arrived = time.time()
+            if self.max_fps and self._last_sent is not None:
+                # Small tolerance so capture jitter does not halve the rate
+                if arrived - self._last_sent < 0.9 / self.max_fps:
+                    continue
+            self._last_sent = arrived
+            return frame
+
+    @staticmethod
+    def _private_copy(frame, width: int, height: int):
+        """A new frame with this peer's size in yuv420p (runs in an executor)"""
+        private = frame.reformat(width=width, height=height, format='yuv420p')
+        if private is frame:
+            # Already in that format and size: reformat hands back the same object
+            private = av.VideoFrame.from_ndarray(frame.to_ndarray(), format='yuv420p')
+        return private
+
+    async def recv(self):
+        if self._pending_stages is not None:
+            if trace.enabled:
+                # aiortc encodes, packetizes and writes between our recv() calls
+                trace.span('encode+write', 'webrtc', self._handed_at, now(), peer=self.stats.id)
+            self.stats.record_sent(self._pending_stages)
+            self._pending_stages = None
+
+        frame = await self._next_source_frame()
+        meta = frame.opaque
+        # The relayed frame is shared by every peer, and encoders write to the
+        # frame they get (pict_type for keyframes, pts rebasing): hand each
+        # peer its own, converted to the encoders' yuv420p at this peer's size
+        if self.scale < 1.0:
+            # Encoders need even dimensions for 4:2:0
+            width = max(2, int(frame.width * self.scale) & ~1)
+            height = max(2, int(frame.height * self.scale) & ~1)
+        else:
+            width, height = frame.width, frame.height
+        loop = asyncio.get_running_loop()
+        resizing = now()
+        private = await loop.run_in_executor(peer_executor, self._private_copy, frame, width, height)
+        if trace.enabled:
+            trace.span('resize', 'webrtc', resizing, now(), peer=self.stats.id, width=width)
+        private.pts = frame.pts
+        private.time_base = frame.time_base
+        private.opaque = meta
+        frame = private
+        self.stats.record_frame(frame.width, frame.height)
+        if meta is not None:
+            self._pending_stages = meta[1]
+            self._handed_at = now()
+        return frame
+
+    def stop(self):
+        super().stop()
+        self.source.stop()